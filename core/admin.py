@@ -2,11 +2,32 @@ from django.contrib import admin
 
 # Register your models here.
 
-from .models import User, Educator, Student, Course, Lesson, CourseTag
+from .models import User, Educator, Student, Course, Lesson, CourseTag, GeneratedQuestionSet, QuestionGenerationJob, LessonProgress, LessonQuestions, RegistrationJob
 
 admin.site.register(User)
 admin.site.register(Educator)
 admin.site.register(Student)
-admin.site.register(Course)
+
 admin.site.register(Lesson)
-admin.site.register(CourseTag)
\ No newline at end of file
+admin.site.register(CourseTag)
+admin.site.register(GeneratedQuestionSet)
+admin.site.register(QuestionGenerationJob)
+admin.site.register(LessonProgress)
+admin.site.register(LessonQuestions)
+
+
+@admin.register(Course)
+class CourseAdmin(admin.ModelAdmin):
+    def save_model(self, request, obj, form, change):
+        if change:
+            obj.save_edits()  # leaves subscriber_count/lesson_count alone
+        else:
+            obj.save()
+
+
+@admin.register(RegistrationJob)
+class RegistrationJobAdmin(admin.ModelAdmin):
+    # rows holds the upload's plaintext passwords until a worker has run it
+    exclude = ('rows',)
+    list_display = ('id', 'status', 'requested_by', 'created_at', 'finished_at')
+    list_filter = ('status',)
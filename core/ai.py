@@ -0,0 +1,328 @@
+"""
+Question/MCQ generation: pluggable model backends plus a persistent result
+cache keyed by a hash of the (normalized) lesson content.
+
+The backend is picked with settings.QUESTION_GENERATION_BACKEND:
+  core.ai.GeminiBackend   Google Gemini (needs GEMINI_API_KEY)
+  core.ai.StubBackend     deterministic, offline - for tests, benchmarks and local dev
+
+Backends are created on first use (get_backend()) and GeminiBackend only
+imports and configures the Google SDK on its first call, so importing this
+module - every worker boot, every manage.py command - stays cheap and works
+without an API key. `manage.py startup_profile` shows what boot does cost.
+
+Async views use agenerate_questions_for(), which awaits backend.agenerate():
+Gemini is called over its REST API with httpx, other backends run their
+blocking generate() in a thread.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import sys
+import threading
+from concurrent.futures import Future
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .metrics import timed
+from .models import GeneratedQuestionSet
+
+# bump when the prompt changes, so old cached answers aren't served for the new prompt
+PROMPT_VERSION = 1
+
+PROMPT_TEMPLATE = (
+    "Generate 3 open-ended answer questions with answers (2-4 sentences) and 3 multiple choice questions with 4 options each and the correct option, "
+    "based on the following lesson content:\n\n"
+    "{lesson_content}\n\n"
+    "Return the response in JSON format like:\n"
+    "{{\n"
+    "  \"questions\": [\n"
+    "    {{ \"question\": \"Q1...\", \"answer\": \"...\" }},\n"
+    "    ...\n"
+    "  ],\n"
+    "  \"mcqs\": [\n"
+    "    {{\n"
+    "      \"question\": \"What is...\",\n"
+    "      \"options\": [\"A\", \"B\", \"C\", \"D\"],\n"
+    "      \"answer\": \"B\"\n"
+    "    }},\n"
+    "    ...\n"
+    "  ]\n"
+    "}}"
+)
+
+
+# --------------------- backends -------------------------------
+
+class QuestionBackend:
+    """Takes a prompt, returns the model's raw text answer."""
+    name = None
+
+    def generate(self, prompt):
+        raise NotImplementedError
+
+    async def agenerate(self, prompt):
+        # no async client: run the blocking call in a thread, not the shared sync one
+        return await sync_to_async(self.generate, thread_sensitive=False)(prompt)
+
+
+class GeminiBackend(QuestionBackend):
+    name = 'gemini-1.5-flash'
+    api_url = 'https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent'
+
+    def __init__(self):
+        self._genai = None
+        self._lock = threading.Lock()
+
+    @property
+    def api_key(self):
+        if not settings.GEMINI_API_KEY:
+            raise ImproperlyConfigured('GEMINI_API_KEY is not set, question generation with Gemini needs it.')
+        return settings.GEMINI_API_KEY
+
+    @property
+    def genai(self):
+        # the SDK is heavy to import, only the processes that call the model pay for it
+        if self._genai is None:
+            with self._lock:
+                if self._genai is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._genai = genai
+        return self._genai
+
+    def generate(self, prompt):
+        model = self.genai.GenerativeModel(self.name)
+        response = model.generate_content(prompt)
+        return response.text
+
+    async def agenerate(self, prompt):
+        import httpx  # only needed once a request awaits the model
+
+        # a client per call: under WSGI every async view gets a fresh event loop,
+        # and pooled connections can't move between loops
+        async with httpx.AsyncClient(timeout=getattr(settings, 'QUESTION_GENERATION_TIMEOUT', 60)) as client:
+            response = await client.post(
+                self.api_url.format(model=self.name),
+                headers={'x-goog-api-key': self.api_key},
+                json={'contents': [{'parts': [{'text': prompt}]}]},
+            )
+        response.raise_for_status()
+        parts = response.json()['candidates'][0]['content']['parts']
+        return ''.join(part.get('text', '') for part in parts)
+
+
+class StubBackend(QuestionBackend):
+    name = 'stub'
+
+    async def agenerate(self, prompt):
+        return self.generate(prompt)
+
+    def generate(self, prompt):
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        questions = [
+            {'question': f'Question {i} ({digest[i * 8:i * 8 + 8]})?', 'answer': f'Answer {i}.'}
+            for i in range(1, 4)
+        ]
+        mcqs = [
+            {
+                'question': f'MCQ {i} ({digest[i * 8 + 24:i * 8 + 32]})?',
+                'options': ['A', 'B', 'C', 'D'],
+                'answer': 'ABCD'[int(digest[i], 16) % 4],
+            }
+            for i in range(1, 4)
+        ]
+        return '```json\n%s\n```' % json.dumps({'questions': questions, 'mcqs': mcqs})
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend():
+    path = getattr(settings, 'QUESTION_GENERATION_BACKEND', 'core.ai.GeminiBackend')
+    if path not in _backends:
+        with _backends_lock:
+            if path not in _backends:
+                _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+# --------------------- helpers -------------------------------
+
+def normalize_content(lesson_content):
+    # whitespace differences shouldn't make a new model call
+    return ' '.join(lesson_content.split())
+
+
+def content_hash(lesson_content, backend=None):
+    backend = backend or get_backend()
+    key = f'{backend.name}:{PROMPT_VERSION}:{normalize_content(lesson_content)}'
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def is_transient(error):
+    """A model call error worth trying again later: timeouts, network trouble, the API overloaded."""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    httpx = sys.modules.get('httpx')  # an httpx error means it's imported, don't import it for nothing
+    if httpx is None:
+        return False
+    if isinstance(error, httpx.TransportError):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and (
+        error.response.status_code == 429 or error.response.status_code >= 500
+    )
+
+
+def parse_model_output(raw_text):
+    # Extract JSON using regex if it's wrapped in code block
+    json_match = re.search(r"```json\s*(.*?)\s*```", raw_text, re.DOTALL)
+    json_data = json_match.group(1) if json_match else raw_text
+    return json.loads(json_data)
+
+
+# --------------------- cache -------------------------------
+
+def get_cached_questions(key):
+    ttl = getattr(settings, 'QUESTION_CACHE_TTL', None)
+    entry = GeneratedQuestionSet.objects.filter(content_hash=key).first()
+    if entry is None:
+        return None
+
+    now = timezone.now()
+    if ttl is not None and entry.created_at < now - ttl:
+        entry.delete()
+        return None
+
+    # LRU bookkeeping, but at most one write per entry per hour
+    if entry.last_used_at < now - timedelta(hours=1):
+        GeneratedQuestionSet.objects.filter(pk=entry.pk).update(last_used_at=now)
+    return entry.result
+
+
+def store_questions(key, result):
+    try:
+        GeneratedQuestionSet.objects.create(
+            content_hash=key,
+            prompt_version=PROMPT_VERSION,
+            result=result,
+        )
+    except IntegrityError:
+        # someone else stored the same content in the meantime
+        pass
+
+
+def evict_questions():
+    """
+    Drop the least recently used entries past QUESTION_CACHE_MAX_ENTRIES; returns how many.
+    Counting is a scan of the whole table, so this runs from the question
+    worker's housekeeping (once a minute), not on every store.
+    """
+    max_entries = getattr(settings, 'QUESTION_CACHE_MAX_ENTRIES', None)
+    if not max_entries:
+        return 0
+    excess = GeneratedQuestionSet.objects.count() - max_entries
+    if excess <= 0:
+        return 0
+    oldest = GeneratedQuestionSet.objects.order_by('last_used_at').values_list('pk', flat=True)[:excess]
+    deleted, _ = GeneratedQuestionSet.objects.filter(pk__in=list(oldest)).delete()
+    return deleted
+
+
+# requests for the same content that arrive while a call is running wait for it
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def generate_questions_for(lesson_content):
+    """
+    Questions and MCQs for `lesson_content`, from the cache when possible.
+    Concurrent calls with the same content in this process share one model call.
+    """
+    backend = get_backend()
+    key = content_hash(lesson_content, backend)
+
+    cached = get_cached_questions(key)
+    if cached is not None:
+        return cached
+
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+
+    if not leader:
+        return future.result()
+
+    try:
+        # the previous leader may have finished between our lookup and taking the lead
+        result = get_cached_questions(key)
+        if result is not None:
+            future.set_result(result)
+            return result
+
+        prompt = PROMPT_TEMPLATE.format(lesson_content=normalize_content(lesson_content))
+        with timed('ai'):
+            output = backend.generate(prompt)
+        result = parse_model_output(output)
+        store_questions(key, result)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
+
+
+async def agenerate_questions_for(lesson_content):
+    """generate_questions_for() for async views, sharing its in-flight calls."""
+    backend = get_backend()
+    key = content_hash(lesson_content, backend)
+
+    cached = await sync_to_async(get_cached_questions)(key)
+    if cached is not None:
+        return cached
+
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+
+    if not leader:
+        return await asyncio.wrap_future(future)
+
+    try:
+        result = await sync_to_async(get_cached_questions)(key)
+        if result is not None:
+            future.set_result(result)
+            return result
+
+        prompt = PROMPT_TEMPLATE.format(lesson_content=normalize_content(lesson_content))
+        with timed('ai'):
+            output = await backend.agenerate(prompt)
+        result = parse_model_output(output)
+        await sync_to_async(store_questions)(key, result)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        # e.g. ?wait= ran out: whoever shares this call gets an error, not a cancellation of their own
+        future.set_exception(TimeoutError('the model call was cancelled'))
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
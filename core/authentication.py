@@ -0,0 +1,118 @@
+"""
+JWT auth without a database hit per request.
+
+At login the access/refresh tokens get the user's role, email, display name
+and Student/Educator ids as claims, reloaded from the database on every
+token refresh (so a change shows up within ACCESS_TOKEN_LIFETIME). ClaimsJWTAuthentication turns those
+claims straight into a lightweight ClaimsUser, so views can use
+request.user.student_id / educator_id instead of loading User and the
+reverse one-to-one. Tokens issued before these claims existed fall back to
+the database.
+
+The async views (see views.py) aren't wrapped by DRF and call
+aauthenticate() themselves.
+"""
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .metrics import timed
+from .models import Educator, Student, User
+
+# claims every token issued by EduLearnTokenObtainPairSerializer carries
+PROFILE_CLAIMS = ('role', 'email', 'name', 'student_id', 'educator_id')
+
+
+def load_profile(user):
+    """role/email/name/student_id/educator_id for a User, read from the database."""
+    student = educator = None
+    if user.role == 'student':
+        student = Student.objects.filter(user=user).values_list('id', 'full_name').first()
+    elif user.role == 'educator':
+        educator = Educator.objects.filter(user=user).values_list('id', flat=True).first()
+
+    name = ''
+    if user.role == 'student':
+        name = student[1] if student else user.email  # fallback if not found
+    elif user.role == 'educator':
+        name = "Educator"  # Later you can adjust if educator has profile info
+
+    return {
+        'role': user.role,
+        'email': user.email,
+        'name': name,
+        'student_id': student[0] if student else None,
+        'educator_id': educator,
+    }
+
+
+def set_profile_claims(token, user):
+    for claim, value in load_profile(user).items():
+        token[claim] = value
+    return token
+
+
+class EduLearnTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return set_profile_claims(super().get_token(user), user)
+
+
+class EduLearnTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Reloads the profile claims on every refresh. The access token (and, with
+    ROTATE_REFRESH_TOKENS, the new refresh token) copies its claims from the
+    refresh token, so without this a renamed student or a new profile would
+    keep the login-time claims for the whole session.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = User.objects.filter(
+            **{api_settings.USER_ID_FIELD: refresh.payload.get(api_settings.USER_ID_CLAIM)}
+        ).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        # same jti and expiry, fresh claims; the parent checks and rotates it as usual
+        return super().validate({**attrs, 'refresh': str(set_profile_claims(refresh, user))})
+
+
+class ClaimsUser(TokenUser):
+    """request.user for a token with profile claims; missing claims read as None."""
+
+    def __str__(self):
+        return self.email or super().__str__()
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        with timed('auth'):
+            return super().authenticate(request)
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views; only tokens without the claims need a (threaded) database read."""
+        with timed('auth'):
+            header = self.get_header(request)
+            if header is None:
+                return None
+            raw_token = self.get_raw_token(header)
+            if raw_token is None:
+                return None
+            validated_token = self.get_validated_token(raw_token)
+            if all(claim in validated_token for claim in PROFILE_CLAIMS):
+                return ClaimsUser(validated_token), validated_token
+            return await sync_to_async(self.get_user)(validated_token), validated_token
+
+    def get_user(self, validated_token):
+        if all(claim in validated_token for claim in PROFILE_CLAIMS):
+            return ClaimsUser(validated_token)
+
+        # older token: load the user and give it the same attributes
+        user = super().get_user(validated_token)
+        for attr, value in load_profile(user).items():
+            if attr not in ('role', 'email'):
+                setattr(user, attr, value)
+        return user
@@ -0,0 +1,141 @@
+"""
+Response cache for the public catalog endpoints.
+
+Each cached model has a version number in the cache, bumped by signals
+(see signals.py) whenever a row changes. Cache keys include the versions a
+view depends on, so a write simply makes the old entries unreachable -
+nothing has to be deleted. Entries also carry a strong ETag (hash of the
+body), and a matching If-None-Match gets a 304 straight from the cache.
+
+With the default local-memory backend the versions are per process; set
+CACHE_URL to share them (and the entries) between workers.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+VERSION_KEY = 'catalog:version:%s'
+
+
+def catalog_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def _fresh_version():
+    # never restart from 0/1 after an eviction, or old entries would match again
+    return int(time.time() * 1000)
+
+
+def get_versions(names):
+    cache = catalog_cache()
+    keys = [VERSION_KEY % name for name in names]
+    found = cache.get_many(keys)
+    versions = []
+    for key in keys:
+        if key not in found:
+            cache.add(key, _fresh_version(), timeout=None)
+            found[key] = cache.get(key)
+        versions.append(found[key])
+    return versions
+
+
+async def aget_versions(names):
+    # get_versions() for async views
+    cache = catalog_cache()
+    keys = [VERSION_KEY % name for name in names]
+    found = await cache.aget_many(keys)
+    versions = []
+    for key in keys:
+        if key not in found:
+            await cache.aadd(key, _fresh_version(), timeout=None)
+            found[key] = await cache.aget(key)
+        versions.append(found[key])
+    return versions
+
+
+def response_cache_key(request, versions):
+    parts = [
+        request.build_absolute_uri(),
+        request.META.get('HTTP_ACCEPT', ''),
+        *map(str, versions),
+    ]
+    digest = hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+    return 'catalog:response:%s' % digest
+
+
+def bump_version(name):
+    cache = catalog_cache()
+    key = VERSION_KEY % name
+    try:
+        cache.incr(key)
+    except ValueError:
+        # not there yet (or evicted)
+        cache.add(key, _fresh_version(), timeout=None)
+
+
+def make_etag(data):
+    body = json.dumps(data, cls=JSONEncoder, sort_keys=True).encode('utf-8')
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+def _strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    # If-None-Match compares weakly; gzipped responses go out with W/"..." and come back that way
+    etags = {_strip_weak(tag) for tag in parse_etags(header)}
+    return '*' in etags or _strip_weak(etag) in etags
+
+
+class CatalogCacheMixin:
+    """
+    Caches list/retrieve responses of a viewset for anonymous clients.
+    `cache_dependencies` names the versions (see signals.py) the output depends on.
+    """
+    cache_dependencies = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def is_cacheable(self, request):
+        # anything authenticated may be personalised, don't share it
+        return 'HTTP_AUTHORIZATION' not in request.META
+
+    def get_cache_key(self, request):
+        return response_cache_key(request, get_versions(self.cache_dependencies))
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+
+        cache = catalog_cache()
+        key = self.get_cache_key(request)
+        entry = cache.get(key)
+
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry = {'data': response.data, 'etag': make_etag(response.data)}
+            cache.set(key, entry, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+        else:
+            response = Response(entry['data'])
+
+        if etag_matches(request, entry['etag']):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        response['ETag'] = entry['etag']
+        return response
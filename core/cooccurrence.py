@@ -0,0 +1,200 @@
+"""
+"Students also took" - item-item collaborative filtering over subscriptions.
+
+The co-subscription matrix (how many students have both course A and B) is
+kept sparse in CoursePairCount, one row per pair that actually occurs. The
+similarity of two courses is the cosine of their subscriber sets,
+    count(A, B) / sqrt(subscribers(A) * subscribers(B)),
+and the best `top_k` neighbours of every course are stored ranked in
+CourseNeighbor, so the endpoint reads them with one indexed query.
+
+build_full() recounts everything from SubscribedCourse. update() only
+counts the subscriptions added since the last run (CooccurrenceState keeps
+the id watermark) and re-ranks the courses whose pairs changed.
+Unsubscribes are only picked up by the next full build.
+
+Students with more than `max_basket` subscriptions only count their most
+recent ones: they add pairs quadratically and say the least about which
+courses belong together.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import CooccurrenceState, Course, CourseNeighbor, CoursePairCount, SubscribedCourse
+
+CHUNK = 500  # ids per IN (...)
+
+
+def chunks(items, size=CHUNK):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _student_baskets(upper_id, batch_size):
+    """(student_id, [course_id, ...] oldest first) for subscriptions with id <= upper_id."""
+    last_student, last_id = 0, 0
+    student, basket = None, []
+    while True:
+        rows = list(
+            SubscribedCourse.objects.filter(id__lte=upper_id)
+            .filter(Q(student_id__gt=last_student) | Q(student_id=last_student, id__gt=last_id))
+            .order_by('student_id', 'id')
+            .values_list('student_id', 'id', 'course_id')[:batch_size]
+        )
+        if not rows:
+            break
+        for student_id, subscription_id, course_id in rows:
+            if student_id != student:
+                if basket:
+                    yield student, basket
+                student, basket = student_id, []
+            basket.append(course_id)
+        last_student, last_id = rows[-1][0], rows[-1][1]
+    if basket:
+        yield student, basket
+
+
+def _subscriber_counts(course_ids):
+    sizes = {}
+    for chunk in chunks(course_ids):
+        sizes.update(Course.objects.filter(id__in=chunk).values_list('id', 'subscriber_count'))
+    return sizes
+
+
+def rank_neighbors(pair_counts, course_ids, top_k, min_support):
+    """{course_id: [(score, neighbor_id), ...] best first} for the courses in `course_ids`."""
+    involved = {course for pair in pair_counts for course in pair}
+    sizes = _subscriber_counts(involved)
+    best = defaultdict(list)  # min-heaps of size top_k
+
+    for (a, b), count in pair_counts.items():
+        if count < min_support:
+            continue
+        # max() guards against subscriber_count lagging behind
+        score = count / math.sqrt(max(sizes.get(a, 0), count) * max(sizes.get(b, 0), count))
+        for course, neighbor in ((a, b), (b, a)):
+            if course not in course_ids:
+                continue
+            heap = best[course]
+            entry = (score, -neighbor)  # ties: lower id first
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+    return {
+        course: [(score, -neighbor) for score, neighbor in sorted(heap, reverse=True)]
+        for course, heap in best.items()
+    }
+
+
+def _write_neighbors(course_ids, ranked):
+    for chunk in chunks(course_ids):
+        CourseNeighbor.objects.filter(course_id__in=chunk).delete()
+    CourseNeighbor.objects.bulk_create([
+        CourseNeighbor(course_id=course, neighbor_id=neighbor, score=score, rank=rank)
+        for course, neighbors in ranked.items()
+        for rank, (score, neighbor) in enumerate(neighbors, start=1)
+    ], batch_size=2000)
+
+
+def _save_state(upper_id):
+    CooccurrenceState.objects.update_or_create(
+        pk=1, defaults={'last_subscription_id': upper_id, 'built_at': timezone.now()}
+    )
+
+
+def build_full(top_k=10, min_support=2, max_basket=200, batch_size=10000):
+    """Recount all pairs and re-rank every course. Returns (pairs, courses with neighbours)."""
+    upper_id = SubscribedCourse.objects.aggregate(top=Max('id'))['top'] or 0
+
+    pair_counts = Counter()
+    for _, basket in _student_baskets(upper_id, batch_size):
+        # sorted so every pair is counted as (smaller id, larger id)
+        pair_counts.update(combinations(sorted(set(basket[-max_basket:])), 2))
+
+    ranked = rank_neighbors(pair_counts, {course for pair in pair_counts for course in pair}, top_k, min_support)
+
+    with transaction.atomic():
+        CoursePairCount.objects.all().delete()
+        CoursePairCount.objects.bulk_create(
+            [CoursePairCount(course_a_id=a, course_b_id=b, count=count) for (a, b), count in pair_counts.items()],
+            batch_size=5000,
+        )
+        CourseNeighbor.objects.all().delete()
+        _write_neighbors([], ranked)
+        _save_state(upper_id)
+    return len(pair_counts), len(ranked)
+
+
+def update(top_k=10, min_support=2, max_basket=200):
+    """Count subscriptions newer than the watermark. Returns (new subscriptions, re-ranked courses)."""
+    state = CooccurrenceState.objects.filter(pk=1).first()
+    if state is None:
+        pairs, courses = build_full(top_k, min_support, max_basket)
+        return None, courses
+    upper_id = SubscribedCourse.objects.aggregate(top=Max('id'))['top'] or 0
+    if upper_id <= state.last_subscription_id:
+        return 0, 0
+
+    new = list(
+        SubscribedCourse.objects.filter(id__gt=state.last_subscription_id, id__lte=upper_id)
+        .values_list('student_id', 'id', 'course_id')
+    )
+    history = defaultdict(list)  # student -> [(subscription id, course id)]
+    for chunk in chunks({student_id for student_id, _, _ in new}):
+        for student_id, subscription_id, course_id in (
+            SubscribedCourse.objects.filter(student_id__in=chunk, id__lte=upper_id)
+            .values_list('student_id', 'id', 'course_id')
+        ):
+            history[student_id].append((subscription_id, course_id))
+
+    # each new subscription pairs with the student's earlier ones (new ones included,
+    # processed in id order, so a pair of two new subscriptions is counted once)
+    deltas = Counter()
+    for student_id, subscription_id, course_id in new:
+        earlier = [c for s, c in sorted(history[student_id]) if s < subscription_id][-(max_basket - 1):]
+        for other in earlier:
+            if other != course_id:
+                deltas[(min(course_id, other), max(course_id, other))] += 1
+
+    affected = {course for pair in deltas for course in pair}
+    with transaction.atomic():
+        _add_pair_counts(deltas)
+        pair_counts = {}
+        for chunk in chunks(affected):
+            for a, b, count in CoursePairCount.objects.filter(
+                Q(course_a_id__in=chunk) | Q(course_b_id__in=chunk)
+            ).values_list('course_a_id', 'course_b_id', 'count'):
+                pair_counts[(a, b)] = count
+        ranked = rank_neighbors(pair_counts, affected, top_k, min_support)
+        _write_neighbors(affected, ranked)
+        _save_state(upper_id)
+    return len(new), len(affected)
+
+
+def _add_pair_counts(deltas):
+    counts = dict(deltas)
+    for chunk in chunks({a for a, _ in deltas}):
+        for a, b, count in CoursePairCount.objects.filter(course_a_id__in=chunk).values_list(
+            'course_a_id', 'course_b_id', 'count'
+        ):
+            if (a, b) in counts:
+                counts[(a, b)] += count
+
+    kwargs = {'update_conflicts': True, 'update_fields': ['count']}
+    # MySQL's ON DUPLICATE KEY UPDATE has no conflict target
+    if connection.features.supports_update_conflicts_with_target:
+        kwargs['unique_fields'] = ['course_a', 'course_b']
+    CoursePairCount.objects.bulk_create(
+        [CoursePairCount(course_a_id=a, course_b_id=b, count=count) for (a, b), count in counts.items()],
+        batch_size=5000,
+        **kwargs,
+    )
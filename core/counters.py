@@ -0,0 +1,42 @@
+"""
+Course.subscriber_count and Course.lesson_count.
+
+Single rows change them with an atomic F() update (signals.py); bulk paths
+that skip signals (subscribe_student, import_catalog) recount the affected
+courses with refresh_course_counters(). `manage.py reconcile_course_counters`
+repairs any drift.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Course, Lesson, SubscribedCourse
+
+# counter field -> (model, fk to course)
+COUNTED = {
+    'subscriber_count': SubscribedCourse,
+    'lesson_count': Lesson,
+}
+
+
+def change_counter(course_id, field, delta):
+    courses = Course.objects.filter(pk=course_id)
+    if delta < 0:
+        courses = courses.filter(**{f'{field}__gte': -delta})  # never wrap the unsigned column
+    courses.update(**{field: F(field) + delta})
+
+
+def actual_count(field):
+    """Subquery counting the rows behind `field` for OuterRef('pk')."""
+    model = COUNTED[field]
+    counted = (
+        model.objects.filter(course_id=OuterRef('pk'))
+        .order_by().values('course_id').annotate(total=Count('id')).values('total')
+    )
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+def refresh_course_counters(course_ids, fields=tuple(COUNTED)):
+    """Recount `fields` for the given courses in one UPDATE."""
+    course_ids = list(course_ids)
+    if course_ids:
+        Course.objects.filter(id__in=course_ids).update(**{field: actual_count(field) for field in fields})
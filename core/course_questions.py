@@ -0,0 +1,250 @@
+"""
+Questions and MCQs for every lesson of a course, for
+POST /api/courses/<id>/generate-questions/ (run as a job by the question worker).
+
+Lessons are read server-side. Content longer than QUESTION_CHUNK_TOKENS
+(estimated at CHARS_PER_TOKEN characters a token) is split into chunks on
+paragraph, then sentence, then word boundaries, so no prompt outgrows the
+model's limits. The chunks of all lessons go through generate_questions_for()
+- which caches every chunk by content hash and shares identical calls - on
+up to QUESTION_COURSE_CONCURRENCY threads, each call retried
+QUESTION_CALL_RETRIES times with exponential backoff. That cap is per job;
+every model call also takes a token from the 'question_model_calls' global
+bucket in THROTTLES (core/throttling.py), which all workers share when the
+throttle cache is shared, and waits while it is empty.
+
+A lesson's chunk answers are merged, questions asked twice dropped, and the
+result stored in LessonQuestions with the lesson's content_sha256 and the
+backend/prompt that made it. Checking whether a course is up to date
+compares those columns in SQL, without reading any lesson content. Lessons
+whose content hasn't changed since are never sent again, so a failed or
+requeued job only redoes what is missing.
+"""
+import hashlib
+import logging
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import F
+
+from .ai import PROMPT_VERSION, generate_questions_for, get_backend
+from .models import Lesson, LessonQuestions, lesson_content_hash
+from . import throttling
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4  # rough average for English text
+
+# coarsest first: paragraphs, sentences, words
+SEPARATORS = (
+    re.compile(r'\n\s*\n'),
+    re.compile(r'(?<=[.!?])\s+'),
+    re.compile(r'\s+'),
+)
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _pieces(text, max_chars, level=0):
+    if len(text) <= max_chars:
+        return [text]
+    if level == len(SEPARATORS):
+        # one enormous "word", cut it
+        return [text[start:start + max_chars] for start in range(0, len(text), max_chars)]
+    pieces = []
+    for part in SEPARATORS[level].split(text):
+        part = part.strip()
+        if part:
+            pieces += _pieces(part, max_chars, level + 1)
+    return pieces
+
+
+def chunk_text(text, max_tokens):
+    """Split `text` into as few chunks of at most ~max_tokens as the boundaries allow."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks, current = [], ''
+    for piece in _pieces(text.strip(), max_chars):
+        if current and len(current) + 1 + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f'{current}\n{piece}' if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def question_key(item):
+    # "What is X?" and "what is x" are the same question
+    if not isinstance(item, dict):
+        return None
+    return ' '.join(re.sub(r'\W+', ' ', str(item.get('question', '')).casefold()).split()) or None
+
+
+def merge_results(results):
+    """Concatenate the questions/MCQs of several chunk answers, first occurrence wins."""
+    merged = {'questions': [], 'mcqs': []}
+    for kind, items in merged.items():
+        seen = set()
+        for result in results:
+            for item in result.get(kind) or ():
+                key = question_key(item)
+                if key is not None and key not in seen:
+                    seen.add(key)
+                    items.append(item)
+    return merged
+
+
+def wait_for_model_call():
+    # the global cap across every worker's jobs, see THROTTLES['question_model_calls']
+    while (wait := throttling.check('question_model_calls', None)) is not None:
+        time.sleep(wait)
+
+
+def generate_with_retry(chunk, retries, backoff):
+    for attempt in range(retries + 1):
+        try:
+            wait_for_model_call()
+            return generate_questions_for(chunk)
+        except ImproperlyConfigured:
+            raise
+        except Exception as e:
+            if attempt == retries:
+                raise
+            # full jitter, so the retries of a burst of failures don't line up again
+            delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            logger.warning('question chunk failed (%s), retrying in %.1fs', e, delay)
+            time.sleep(delay)
+
+
+def _generate_in_thread(chunk, retries, backoff):
+    try:
+        return generate_with_retry(chunk, retries, backoff)
+    finally:
+        # pool threads each have their own connection, don't leave it open
+        connection.close()
+
+
+def course_job_hash(course_id):
+    # QuestionGenerationJob.content_hash for a course job: one queued job per course
+    return hashlib.sha256(f'course:{course_id}'.encode('utf-8')).hexdigest()
+
+
+def generator():
+    # LessonQuestions.generator: answers of another backend or prompt don't count
+    return f'{get_backend().name}:{PROMPT_VERSION}'
+
+
+def _lessons(course_id, *fields):
+    return list(
+        Lesson.objects.filter(course_id=course_id)
+        .order_by('lesson_number', 'id')
+        .only('id', 'title', 'lesson_number', *fields)
+    )
+
+
+def _payload(course_id, lessons, stored):
+    return {
+        'course': course_id,
+        'lessons': [
+            {
+                'lesson': lesson.id,
+                'title': lesson.title,
+                'lesson_number': lesson.lesson_number,
+                **stored[lesson.id].result,
+            }
+            for lesson in lessons
+        ],
+    }
+
+
+def stored_course_questions(course_id):
+    """The course's questions if every lesson has an up-to-date LessonQuestions row, else None."""
+    lessons = _lessons(course_id)
+    stored = {
+        row.lesson_id: row
+        for row in LessonQuestions.objects.filter(
+            lesson__course_id=course_id, content_hash=F('lesson__content_sha256'), generator=generator(),
+        )
+    }
+    if any(lesson.id not in stored for lesson in lessons):
+        return None
+    return _payload(course_id, lessons, stored)
+
+
+def generate_course_questions(course_id, concurrency=None, heartbeat=None):
+    """
+    Generate what is missing or outdated, store it and return
+    {'course': id, 'lessons': [{'lesson', 'title', 'lesson_number', 'questions', 'mcqs'}]}.
+    Lessons that still fail after the retries are left out of the store and
+    raise at the end, once the others are saved. `heartbeat()` is called after
+    every chunk, so the job running this doesn't look dead (see jobs.py).
+    """
+    concurrency = concurrency or getattr(settings, 'QUESTION_COURSE_CONCURRENCY', 4)
+    max_tokens = getattr(settings, 'QUESTION_CHUNK_TOKENS', 2000)
+    retries = getattr(settings, 'QUESTION_CALL_RETRIES', 2)
+    backoff = getattr(settings, 'QUESTION_RETRY_BACKOFF', 1.0)
+
+    made_by = generator()
+    lessons = _lessons(course_id, 'content', 'content_sha256')
+    stored = {row.lesson_id: row for row in LessonQuestions.objects.filter(lesson__course_id=course_id)}
+
+    # rows written with bulk_create() (or before the column existed) may lack their hash
+    unhashed = []
+    for lesson in lessons:
+        key = lesson_content_hash(lesson.content)
+        if lesson.content_sha256 != key:
+            lesson.content_sha256 = key
+            unhashed.append(lesson)
+    if unhashed:
+        Lesson.objects.bulk_update(unhashed, ['content_sha256'])
+
+    todo = {}  # lesson id -> (content hash, [chunks])
+    for lesson in lessons:
+        row = stored.get(lesson.id)
+        if row is None or row.content_hash != lesson.content_sha256 or row.generator != made_by:
+            todo[lesson.id] = (lesson.content_sha256, chunk_text(lesson.content, max_tokens))
+
+    calls = [(lesson_id, chunk) for lesson_id, (_, chunks) in todo.items() for chunk in chunks]
+    answers = {lesson_id: [] for lesson_id in todo}
+    failed = {}
+    if calls:
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(calls)))) as pool:
+            futures = [
+                (lesson_id, pool.submit(_generate_in_thread, chunk, retries, backoff))
+                for lesson_id, chunk in calls
+            ]
+            # in submission order, so a lesson's questions keep the order of its text
+            for lesson_id, future in futures:
+                try:
+                    answers[lesson_id].append(future.result())
+                except Exception as e:
+                    failed.setdefault(lesson_id, e)
+                if heartbeat is not None:
+                    heartbeat()
+
+    rows = [
+        LessonQuestions(lesson_id=lesson_id, content_hash=key, generator=made_by,
+                        result=merge_results(answers[lesson_id]), chunks=len(chunks))
+        for lesson_id, (key, chunks) in todo.items()
+        if lesson_id not in failed
+    ]
+    if rows:
+        kwargs = {'update_conflicts': True, 'update_fields': ['content_hash', 'generator', 'result', 'chunks', 'updated_at']}
+        # MySQL's ON DUPLICATE KEY UPDATE has no conflict target
+        if connection.features.supports_update_conflicts_with_target:
+            kwargs['unique_fields'] = ['lesson']
+        LessonQuestions.objects.bulk_create(rows, **kwargs)
+        stored.update((row.lesson_id, row) for row in rows)
+
+    if failed:
+        lesson_id, error = next(iter(failed.items()))
+        raise RuntimeError(f'{len(failed)} of {len(lessons)} lessons failed, e.g. lesson {lesson_id}: {error}')
+    return _payload(course_id, lessons, stored)
@@ -0,0 +1,107 @@
+"""
+Resized copies of course images for catalog cards.
+
+Every uploaded course image gets WebP and JPEG versions at a few fixed
+widths, stored under a name derived from the hash of the original bytes
+(img_courses/derived/<hash>-<width>.<ext>). The same picture always maps to
+the same files, so they can be served with a far-future, immutable
+Cache-Control header - a new upload gets new names.
+
+Resizing is CPU heavy, so it never runs in a web request: `manage.py
+backfill_course_images --watch 30` keeps building derivatives for new uploads
+(courses show the original image until theirs are ready, srcset is null).
+
+In production the files are served by the web server, not Django, e.g. nginx:
+
+    location /media/img_courses/derived/ {
+        alias /srv/edulearn/media/img_courses/derived/;   # MEDIA_ROOT/img_courses/derived/
+        add_header Cache-Control "public, max-age=31536000, immutable";
+    }
+
+With DEBUG on, edulearn_backend/urls.py serves them (and the rest of
+MEDIA_ROOT) itself.
+"""
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+DERIVED_DIR = 'img_courses/derived/'
+
+# file extension -> Pillow format name
+FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+
+
+def derivative_widths():
+    return getattr(settings, 'COURSE_IMAGE_WIDTHS', (320, 640, 1280))
+
+
+def build_derivatives(name):
+    """
+    Write the resized copies of the stored image `name` (skipping files that
+    already exist) and return what Course.image_derivatives stores:
+    {'source': name, 'hash': ..., 'webp': {'320': path, ...}, 'jpeg': {...}}
+    """
+    from PIL import Image  # only needed here, keep it out of worker startup
+
+    with default_storage.open(name, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:20]
+
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    # never upscale; an image narrower than the largest width gets a copy at its own width instead
+    configured = derivative_widths()
+    widths = [w for w in configured if w < image.width]
+    widths.append(min(image.width, max(configured)))
+    widths = sorted(set(widths))
+
+    result = {'source': name, 'hash': digest}
+    for ext, pil_format in FORMATS.items():
+        result[ext] = {}
+        for width in widths:
+            path = f'{DERIVED_DIR}{digest}-{width}.{ext}'
+            if not default_storage.exists(path):
+                default_storage.save(path, ContentFile(_resize(image, width, pil_format)))
+            result[ext][str(width)] = path
+    return result
+
+
+def _resize(image, width, pil_format):
+    from PIL import Image
+
+    height = max(1, round(image.height * width / image.width))
+    resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image.copy()
+
+    if pil_format == 'JPEG' and resized.mode != 'RGB':
+        # no alpha in JPEG, flatten onto white
+        background = Image.new('RGB', resized.size, (255, 255, 255))
+        rgba = resized.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        resized = background
+
+    out = io.BytesIO()
+    resized.save(out, format=pil_format, quality=80, optimize=True)
+    return out.getvalue()
+
+
+def needs_derivatives(course):
+    if not course.course_image:
+        return False
+    return (course.image_derivatives or {}).get('source') != course.course_image.name
+
+
+def srcset(derivatives, ext, build_url):
+    """'url 320w, url 640w' for one format, or None."""
+    paths = (derivatives or {}).get(ext)
+    if not paths:
+        return None
+    return ', '.join(
+        f'{build_url(default_storage.url(path))} {width}w'
+        for width, path in sorted(paths.items(), key=lambda item: int(item[0]))
+    )
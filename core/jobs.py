@@ -0,0 +1,128 @@
+"""
+Background generate-questions jobs.
+
+The API only inserts a QuestionGenerationJob row (for one lesson_content, or
+for a whole course - see course_questions.py); `manage.py run_question_worker`
+claims pending rows with SELECT ... FOR UPDATE SKIP LOCKED (so any number of
+workers can poll the same table) and runs them through core.ai.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .ai import content_hash, generate_questions_for
+from .course_questions import course_job_hash, generate_course_questions
+from .models import QuestionGenerationJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_question_job(lesson_content, user=None):
+    """
+    Queue `lesson_content`, or return the job that is already working on the same content
+    for the same user - only the requester can read a lesson job (see views.generate_questions_job).
+    """
+    key = content_hash(lesson_content)
+    job = (
+        QuestionGenerationJob.objects
+        .filter(content_hash=key, status__in=('pending', 'running'), requested_by_id=user.id if user is not None else None)
+        .order_by('created_at')
+        .first()
+    )
+    if job is None:
+        job = QuestionGenerationJob.objects.create(
+            # request.user is usually a ClaimsUser (no model instance), see authentication.py
+            requested_by_id=user.id if user is not None else None,
+            lesson_content=lesson_content,
+            content_hash=key,
+        )
+    return job
+
+
+def enqueue_course_question_job(course_id, user=None):
+    """Queue question generation for every lesson of a course, one job per course at a time."""
+    key = course_job_hash(course_id)
+    job = (
+        QuestionGenerationJob.objects
+        .filter(content_hash=key, status__in=('pending', 'running'))
+        .order_by('created_at')
+        .first()
+    )
+    if job is None:
+        job = QuestionGenerationJob.objects.create(
+            requested_by_id=user.id if user is not None else None,
+            course_id=course_id,
+            content_hash=key,
+        )
+    return job
+
+
+def claim_jobs(limit):
+    """Mark up to `limit` of the oldest pending jobs as running and return them."""
+    with transaction.atomic():
+        ids = list(
+            QuestionGenerationJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='pending')
+            .order_by('created_at')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        QuestionGenerationJob.objects.filter(id__in=ids).update(
+            status='running',
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+    return list(QuestionGenerationJob.objects.filter(id__in=ids).order_by('created_at'))
+
+
+def heartbeat(job):
+    # started_at doubles as the last sign of life, requeue_stale_jobs() goes by it
+    QuestionGenerationJob.objects.filter(id=job.id, status='running').update(started_at=timezone.now())
+
+
+def run_job(job):
+    try:
+        if job.course_id is not None:
+            result = generate_course_questions(job.course_id, heartbeat=lambda: heartbeat(job))
+        else:
+            result = generate_questions_for(job.lesson_content)
+    except Exception as e:
+        logger.warning('question job %s failed (attempt %s): %s', job.id, job.attempts, e)
+        max_attempts = getattr(settings, 'QUESTION_JOB_MAX_ATTEMPTS', 3)
+        job.status = 'pending' if job.attempts < max_attempts else 'failed'
+        job.error = str(e)
+        job.finished_at = timezone.now() if job.status == 'failed' else None
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return job
+
+    job.status = 'done'
+    job.result = result
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'finished_at'])
+    return job
+
+
+def requeue_stale_jobs():
+    """
+    Put back jobs whose worker died while running them. Course jobs beat after
+    every chunk, but one chunk can still wait out retries and the global
+    throttle, so they get their own (longer) QUESTION_COURSE_JOB_TIMEOUT.
+    """
+    timeout = getattr(settings, 'QUESTION_JOB_TIMEOUT', None)
+    if not timeout:
+        return 0
+    course_timeout = getattr(settings, 'QUESTION_COURSE_JOB_TIMEOUT', None) or timeout
+    now = timezone.now()
+    max_attempts = getattr(settings, 'QUESTION_JOB_MAX_ATTEMPTS', 3)
+    stale = QuestionGenerationJob.objects.filter(
+        Q(course__isnull=True, started_at__lt=now - timeout) | Q(course__isnull=False, started_at__lt=now - course_timeout),
+        status='running',
+    )
+    stale.filter(attempts__gte=max_attempts).update(status='failed', error='Worker timed out.', finished_at=now)
+    return stale.filter(attempts__lt=max_attempts).update(status='pending')
@@ -0,0 +1,98 @@
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from core.cache import bump_version
+from core.images import build_derivatives, needs_derivatives
+from core.models import Course
+
+
+def _build(course_id, name):
+    # runs in a child process; only touches storage, never the database
+    try:
+        return course_id, build_derivatives(name), None
+    except Exception as e:
+        return course_id, None, str(e)
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the resized WebP/JPEG course images for courses that do not have them yet. '
+        'With --watch it keeps running and picks up new uploads, which is how they get resized.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--force', action='store_true', help='Rebuild even if derivatives exist.')
+        parser.add_argument('--batch-size', type=int, default=200, help='Rows per bulk_update.')
+        parser.add_argument(
+            '--watch', type=float, metavar='SECONDS',
+            help='Look for new course images every SECONDS instead of exiting.',
+        )
+
+    def handle(self, *args, **options):
+        self.failed = set()  # (course id, image name) that couldn't be resized, not retried until it changes
+        if not options['watch']:
+            if not self.backfill(options, force=options['force']):
+                self.stdout.write('All course images already have derivatives.')
+            return
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        force = options['force']
+        while not self.stopping:
+            close_old_connections()
+            self.backfill(options, force=force)
+            force = False
+            time.sleep(options['watch'])
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def backfill(self, options, force=False):
+        """Resize what is missing; returns how many course images there were to do."""
+        courses = (
+            Course.objects.exclude(course_image='').exclude(course_image__isnull=True)
+            .only('id', 'course_image', 'image_derivatives')
+        )
+        todo = [
+            (c.id, c.course_image.name) for c in courses
+            if (force or needs_derivatives(c)) and (c.id, c.course_image.name) not in self.failed
+        ]
+        if not todo:
+            return 0
+
+        started = time.perf_counter()
+        done, failed, pending = 0, 0, []
+
+        # don't hand open database connections to forked workers
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=max(1, min(options['workers'], len(todo)))) as pool:
+            futures = {pool.submit(_build, course_id, name): (course_id, name) for course_id, name in todo}
+            for future in as_completed(futures):
+                course_id, derivatives, error = future.result()
+                if error:
+                    failed += 1
+                    self.failed.add(futures[future])
+                    self.stderr.write(f'Course {course_id}: {error}')
+                    continue
+                pending.append(Course(id=course_id, image_derivatives=derivatives))
+                done += 1
+                if len(pending) >= options['batch_size']:
+                    Course.objects.bulk_update(pending, ['image_derivatives'])
+                    pending = []
+
+        if pending:
+            Course.objects.bulk_update(pending, ['image_derivatives'])
+        bump_version('course')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Resized {done} course image(s) in {elapsed:.1f}s, {failed} failed.'
+        ))
+        return len(todo)
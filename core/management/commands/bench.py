@@ -0,0 +1,257 @@
+import json
+import math
+import random
+import statistics
+import time
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from core.authentication import EduLearnTokenObtainPairSerializer
+from core.counters import refresh_course_counters
+from core.models import Course, CourseTag, Educator, Lesson, Student, SubscribedCourse, User, lesson_content_hash
+
+WORDS = (
+    'python web data design machine learning security cloud mobile testing '
+    'databases networks algorithms music writing finance marketing art history'
+).split()
+
+ENDPOINTS = ('courses', 'my_courses', 'my_course_lessons', 'recommended_courses', 'dashboard', 'subscribe')
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(samples)))
+    return samples[rank - 1]
+
+
+class QueryCounter:
+    """execute_wrapper that counts queries and the rows they report (cursor.rowcount)."""
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.rows_known = True
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        rowcount = getattr(context['cursor'], 'rowcount', -1)
+        if rowcount is None or rowcount < 0:
+            # e.g. SELECTs on SQLite, the driver can't tell before fetching
+            self.rows_known = False
+        else:
+            self.rows += rowcount
+        return result
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database with a synthetic catalog and time the core API '
+        'endpoints through the test client. Prints p50/p95/p99 latency, queries and rows '
+        'per request as JSON, to compare between commits.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=200)
+        parser.add_argument('--educators', type=int, default=20)
+        parser.add_argument('--courses', type=int, default=500)
+        parser.add_argument('--tags', type=int, default=40)
+        parser.add_argument('--tags-per-course', type=int, default=3)
+        parser.add_argument('--lessons-per-course', type=int, default=20)
+        parser.add_argument('--lesson-size', type=int, default=2000, help='Characters of content per lesson.')
+        parser.add_argument('--subscriptions-per-student', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per endpoint first.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, help='Only these (repeatable).')
+        parser.add_argument('--output', help='Write the JSON here instead of stdout.')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+
+        # never touch the real database or a shared cache
+        test_db = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=['testserver'],
+                QUESTION_GENERATION_BACKEND='core.ai.StubBackend',
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench'}},
+            ):
+                started = time.perf_counter()
+                dataset = self.seed(options)
+                seed_seconds = time.perf_counter() - started
+
+                results = {}
+                for name in options['endpoint'] or ENDPOINTS:
+                    self.stderr.write(f'{name}...')
+                    results[name] = self.run_endpoint(name, max(1, options['requests']), options['warmup'])
+        finally:
+            connection.creation.destroy_test_db(test_db, verbosity=0)
+
+        report = {
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'dataset': dataset,
+            'seed_seconds': round(seed_seconds, 2),
+            'endpoints': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    # --------------------- dataset -------------------------------
+
+    def seed(self, options):
+        rnd = self.random
+        password = make_password('bench-password')  # hashing is slow, do it once
+
+        users = [User(email=f'educator{i}@bench.test', role='educator', password=password)
+                 for i in range(options['educators'])]
+        users += [User(email=f'student{i}@bench.test', role='student', password=password)
+                  for i in range(options['students'])]
+        User.objects.bulk_create(users, batch_size=1000)
+        # MySQL doesn't hand back ids from bulk_create
+        user_ids = dict(User.objects.filter(email__endswith='@bench.test').values_list('email', 'id'))
+
+        Educator.objects.bulk_create([
+            Educator(user_id=user_ids[f'educator{i}@bench.test'], full_name=f'Educator {i}')
+            for i in range(options['educators'])
+        ], batch_size=1000)
+        Student.objects.bulk_create([
+            Student(user_id=user_ids[f'student{i}@bench.test'], full_name=f'Student {i}')
+            for i in range(options['students'])
+        ], batch_size=1000)
+        educator_ids = list(Educator.objects.values_list('id', flat=True))
+        self.student_users = list(User.objects.filter(role='student').order_by('id'))
+        student_ids = dict(Student.objects.values_list('user_id', 'id'))
+
+        CourseTag.objects.bulk_create([CourseTag(name=f'tag-{i}') for i in range(options['tags'])])
+        tag_ids = list(CourseTag.objects.values_list('id', flat=True))
+
+        Course.objects.bulk_create([
+            Course(
+                title=f'Course {i}: ' + ' '.join(rnd.sample(WORDS, 3)),
+                description=' '.join(rnd.choices(WORDS, k=40)),
+                category=rnd.choice(WORDS),
+                created_by_id=rnd.choice(educator_ids) if educator_ids else None,
+            )
+            for i in range(options['courses'])
+        ], batch_size=1000)
+        course_ids = list(Course.objects.order_by('id').values_list('id', flat=True))
+
+        through = Course.tags.through
+        through.objects.bulk_create([
+            through(course_id=course_id, coursetag_id=tag_id)
+            for course_id in course_ids
+            for tag_id in rnd.sample(tag_ids, min(options['tags_per_course'], len(tag_ids)))
+        ], batch_size=2000)
+
+        content = ('lorem ipsum dolor sit amet ' * (options['lesson_size'] // 27 + 1))[:options['lesson_size']]
+        content_sha256 = lesson_content_hash(content)
+        Lesson.objects.bulk_create([
+            Lesson(course_id=course_id, lesson_number=number, title=f'Lesson {number}', content=content,
+                   content_sha256=content_sha256)
+            for course_id in course_ids
+            for number in range(1, options['lessons_per_course'] + 1)
+        ], batch_size=2000)
+
+        # popularity is skewed like a real catalog: a few courses get most subscribers
+        weights = [1 / (rank + 1) for rank in range(len(course_ids))]
+        self.subscriptions = {}
+        rows = []
+        for user in self.student_users:
+            picked = set()
+            wanted = min(options['subscriptions_per_student'], len(course_ids))
+            while len(picked) < wanted:
+                picked.add(rnd.choices(course_ids, weights)[0])
+            self.subscriptions[user.id] = sorted(picked)
+            rows += [SubscribedCourse(student_id=student_ids[user.id], course_id=c) for c in picked]
+        SubscribedCourse.objects.bulk_create(rows, batch_size=2000)
+        refresh_course_counters(course_ids)
+
+        self.course_ids = course_ids
+        self.clients = {}
+        return {
+            'students': options['students'],
+            'educators': options['educators'],
+            'courses': len(course_ids),
+            'tags': len(tag_ids),
+            'lessons': len(course_ids) * options['lessons_per_course'],
+            'subscriptions': len(rows),
+        }
+
+    def client_for(self, user):
+        if user.id not in self.clients:
+            token = EduLearnTokenObtainPairSerializer.get_token(user).access_token
+            self.clients[user.id] = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return self.clients[user.id]
+
+    # --------------------- requests -------------------------------
+
+    def next_request(self, name):
+        """(client, method, path) for the next request to `name`."""
+        user = self.random.choice(self.student_users)
+        client = self.client_for(user)
+        if name == 'courses':
+            return client, 'get', '/api/courses/'
+        if name == 'my_courses':
+            return client, 'get', '/api/my-courses/'
+        if name == 'my_course_lessons':
+            return client, 'get', f'/api/my-courses/{self.random.choice(self.subscriptions[user.id])}/lessons/'
+        if name == 'recommended_courses':
+            return client, 'get', '/api/recommended-courses/'
+        if name == 'dashboard':
+            return client, 'get', '/api/dashboard/'
+        if name == 'subscribe':
+            subscribed = self.subscriptions[user.id]
+            for _ in range(10):  # look for a course the student doesn't have yet
+                course_id = self.random.choice(self.course_ids)
+                if course_id not in subscribed:
+                    break
+            subscribed.append(course_id)
+            return client, 'post', f'/api/subscribe/{course_id}/'
+        raise ValueError(name)
+
+    def run_endpoint(self, name, requests, warmup):
+        for _ in range(warmup):
+            client, method, path = self.next_request(name)
+            getattr(client, method)(path)
+
+        timings, queries, rows, statuses = [], [], [], {}
+        rows_known = True
+        for _ in range(requests):
+            client, method, path = self.next_request(name)
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                response = getattr(client, method)(path)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(counter.queries)
+            rows.append(counter.rows)
+            rows_known = rows_known and counter.rows_known
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+        timings.sort()
+        return {
+            'requests': requests,
+            'status_codes': statuses,
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'queries_per_request': round(statistics.fmean(queries), 2),
+            'max_queries': max(queries),
+            # None when the driver doesn't report row counts for SELECTs
+            'rows_per_request': round(statistics.fmean(rows), 2) if rows_known else None,
+        }
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import cooccurrence
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the "students also took" neighbours from subscriptions. Counts only the '
+        'subscriptions added since the last run unless --full is given; run --full now '
+        'and then (e.g. nightly) so unsubscribes are reflected.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recount every subscription.')
+        parser.add_argument('--top-k', type=int, default=10, help='Neighbours kept per course.')
+        parser.add_argument('--min-support', type=int, default=2, help='Students two courses must share.')
+        parser.add_argument('--max-basket', type=int, default=200, help='Most recent subscriptions counted per student.')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options['top_k'] < 1 or options['min_support'] < 1 or options['max_basket'] < 2:
+            raise CommandError('--top-k and --min-support must be at least 1, --max-basket at least 2.')
+        settings = dict(top_k=options['top_k'], min_support=options['min_support'], max_basket=options['max_basket'])
+        started = time.perf_counter()
+
+        if options['full']:
+            pairs, courses = cooccurrence.build_full(batch_size=options['batch_size'], **settings)
+            message = f'Counted {pairs} course pairs, {courses} courses have neighbours'
+        else:
+            new, courses = cooccurrence.update(**settings)
+            if new is None:
+                message = f'No previous build, built from scratch: {courses} courses have neighbours'
+            else:
+                message = f'{new} new subscriptions, re-ranked {courses} courses'
+
+        self.stdout.write(self.style.SUCCESS(f'{message} ({time.perf_counter() - started:.1f}s).'))
@@ -0,0 +1,212 @@
+import csv
+import json
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.cache import bump_version
+from core.counters import refresh_course_counters
+from core.models import Course, CourseTag, Educator, Lesson, SearchDocument, lesson_content_hash
+from core.recommendations import invalidate_recommendation_index
+from core.search import index_courses, index_lessons
+
+
+def lesson_number(value, where):
+    """`value` as an int, or a CommandError naming the row."""
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    raise CommandError(f'{where}: lesson_number must be a whole number, got {value!r}')
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise CommandError(f'{path}:{line_number}: {e}')
+            if isinstance(record, dict):
+                for lesson in record.get('lessons') or ():
+                    lesson['lesson_number'] = lesson_number(lesson.get('lesson_number'), f'{path}:{line_number}')
+            yield record
+
+
+def read_csv(path):
+    """
+    Columns: title, description, category, tags (separated by ';') and, optionally,
+    lesson_number, lesson_title, lesson_content - one lesson per row, rows of the
+    same course repeat its title.
+    """
+    with open(path, encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            record = {
+                'title': row['title'],
+                'description': row.get('description', ''),
+                'category': row.get('category', ''),
+                'tags': (row.get('tags') or '').split(';'),
+                'lessons': [],
+            }
+            if (row.get('lesson_number') or '').strip():
+                record['lessons'].append({
+                    'lesson_number': lesson_number(row['lesson_number'], f'{path}:{reader.line_num}'),
+                    'title': row.get('lesson_title', ''),
+                    'content': row.get('lesson_content', ''),
+                })
+            yield record
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Import courses, tags and lessons from a CSV or JSONL file in batches. '
+        'Courses are matched by title, so running it twice does not duplicate anything.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='.jsonl or .csv file')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--created-by', help='Email of the educator to set as course creator.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        records = read_csv(path) if fmt == 'csv' else read_jsonl(path)
+
+        educator_id = None
+        if options['created_by']:
+            educator_id = (
+                Educator.objects.filter(user__email=options['created_by']).values_list('id', flat=True).first()
+            )
+            if educator_id is None:
+                raise CommandError(f"No educator with email {options['created_by']}.")
+
+        self.totals = dict(rows=0, courses=0, tags=0, lessons=0, course_tags=0)
+        started = time.perf_counter()
+
+        for batch in chunked(records, max(1, options['batch_size'])):
+            with transaction.atomic():
+                self.import_batch(batch, educator_id)
+            self.totals['rows'] += len(batch)
+
+        # bulk_create doesn't send signals, so invalidate by hand
+        for name in ('course', 'lesson', 'coursetag'):
+            bump_version(name)
+        invalidate_recommendation_index()
+
+        elapsed = time.perf_counter() - started
+        rate = self.totals['rows'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {rows} rows in {elapsed:.2f}s ({rate:.0f} rows/sec): '
+            '{courses} new courses, {lessons} new lessons, {tags} new tags, '
+            '{course_tags} new course tags.'.format(elapsed=elapsed, rate=rate, **self.totals)
+        ))
+
+    def import_batch(self, batch, educator_id):
+        # merge rows of the same course (CSV has one row per lesson)
+        courses = {}
+        for record in batch:
+            title = (record.get('title') or '').strip()
+            if not title:
+                raise CommandError(f'Row without a title: {record!r}')
+            course = courses.setdefault(title, {
+                'description': record.get('description', ''),
+                'category': record.get('category', ''),
+                'tags': set(),
+                'lessons': {},
+            })
+            course['tags'].update(name.strip() for name in record.get('tags') or () if name.strip())
+            for lesson in record.get('lessons') or ():
+                course['lessons'][lesson['lesson_number']] = lesson
+
+        tag_ids = self.resolve_tags({name for course in courses.values() for name in course['tags']})
+        course_ids = self.resolve_courses(courses, educator_id)
+
+        through = Course.tags.through
+        links = [
+            through(course_id=course_ids[title], coursetag_id=tag_ids[name])
+            for title, course in courses.items()
+            for name in course['tags']
+        ]
+        existing_links = set(
+            through.objects.filter(course_id__in=course_ids.values()).values_list('course_id', 'coursetag_id')
+        )
+        links = [link for link in links if (link.course_id, link.coursetag_id) not in existing_links]
+        through.objects.bulk_create(links, ignore_conflicts=True)
+        self.totals['course_tags'] += len(links)
+
+        existing_lessons = set(
+            Lesson.objects.filter(course_id__in=course_ids.values()).values_list('course_id', 'lesson_number')
+        )
+        lessons = [
+            Lesson(
+                course_id=course_ids[title],
+                lesson_number=number,
+                title=lesson.get('title', ''),
+                content=lesson.get('content', ''),
+                content_sha256=lesson_content_hash(lesson.get('content', '')),
+            )
+            for title, course in courses.items()
+            for number, lesson in course['lessons'].items()
+            if (course_ids[title], number) not in existing_lessons
+        ]
+        Lesson.objects.bulk_create(lessons)
+        self.totals['lessons'] += len(lessons)
+        if lessons:
+            refresh_course_counters({lesson.course_id for lesson in lessons}, ['lesson_count'])
+
+        # bulk_create skips the signals that keep the search index current
+        index_courses(course_ids.values())
+        if lessons:
+            index_lessons(
+                Lesson.objects.filter(course_id__in=course_ids.values())
+                .exclude(id__in=SearchDocument.objects.filter(doc_type='lesson').values('object_id'))
+                .values_list('id', flat=True)
+            )
+
+    def resolve_tags(self, names):
+        """name -> id, creating the missing tags."""
+        tag_ids = dict(CourseTag.objects.filter(name__in=names).values_list('name', 'id'))
+        missing = names - tag_ids.keys()
+        if missing:
+            CourseTag.objects.bulk_create([CourseTag(name=name) for name in missing], ignore_conflicts=True)
+            # MySQL doesn't hand back ids from bulk_create
+            tag_ids.update(CourseTag.objects.filter(name__in=missing).values_list('name', 'id'))
+            self.totals['tags'] += len(missing)
+        return tag_ids
+
+    def resolve_courses(self, courses, educator_id):
+        """title -> id, creating the missing courses."""
+        course_ids = {}
+        for title, course_id in (
+            Course.objects.filter(title__in=courses.keys()).order_by('-id').values_list('title', 'id')
+        ):
+            course_ids[title] = course_id  # oldest one wins if a title is duplicated
+
+        missing = [title for title in courses if title not in course_ids]
+        if missing:
+            Course.objects.bulk_create([
+                Course(
+                    title=title,
+                    description=courses[title]['description'],
+                    category=courses[title]['category'],
+                    created_by_id=educator_id,
+                )
+                for title in missing
+            ])
+            course_ids.update(Course.objects.filter(title__in=missing).values_list('title', 'id'))
+            self.totals['courses'] += len(missing)
+        return course_ids
@@ -0,0 +1,60 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.passwords import PasswordHasherPool
+from core.registration import read_rows, register_users
+
+
+class Command(BaseCommand):
+    help = (
+        'Register users (a cohort of students, a batch of educators) from a CSV or JSONL file. '
+        'Columns/keys: email, password, role, full_name and optionally profile_image. Passwords '
+        'are hashed on a pool of processes and users are written in chunked transactions; rows '
+        'that fail (invalid, duplicate email) are reported and skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='.jsonl or .csv file')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='Defaults to the file extension.')
+        parser.add_argument('--role', choices=['student', 'educator'], help='Role for rows without one.')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Processes hashing passwords (default: one per CPU, 0 = none).',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--output', help='Write one JSON result per row to this file.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        try:
+            with open(path, encoding='utf-8', newline='') as f:
+                rows = list(read_rows(f, fmt))
+        except OSError as e:
+            raise CommandError(e)
+        if options['role']:
+            for row in rows:
+                if isinstance(row, dict):
+                    row.setdefault('role', options['role'])
+
+        started = time.perf_counter()
+        with PasswordHasherPool(options['workers']) as hasher:
+            results = register_users(rows, hasher=hasher, chunk_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                for result in results:
+                    f.write(json.dumps(result) + '\n')
+
+        failed = [result for result in results if result['status'] != 'created']
+        for result in failed[:20]:
+            self.stderr.write(f"row {result['row']} ({result.get('email') or '-'}): {json.dumps(result['errors'])}")
+        if len(failed) > 20:
+            self.stderr.write(f'... and {len(failed) - 20} more')
+        self.stdout.write(self.style.SUCCESS(
+            f'Registered {len(results) - len(failed)} users, {len(failed)} failed, in {elapsed:.1f}s.'
+        ))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Course, Lesson, SearchDocument, SearchPosting, SearchTerm
+from core.search import DOC_COUNT_KEY, TOKEN_COUNT_KEY, course_documents, index_documents, lesson_documents, reweight_postings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from all courses and lessons.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        batch_size = max(1, options['batch_size'])
+
+        with transaction.atomic():
+            SearchPosting.objects.all().delete()
+            SearchDocument.objects.all().delete()
+            SearchTerm.objects.all().delete()
+        cache.delete_many([DOC_COUNT_KEY, TOKEN_COUNT_KEY])
+
+        total = 0
+        for model, build in ((Course, course_documents), (Lesson, lesson_documents)):
+            last_id = 0
+            while True:
+                ids = list(
+                    model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+                )
+                if not ids:
+                    break
+                index_documents(build(ids))
+                total += len(ids)
+                last_id = ids[-1]
+
+        # weights were computed against a growing average length, settle them
+        reweight_postings()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} documents in {elapsed:.1f}s.'))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from core.cache import bump_version
+from core.counters import COUNTED, actual_count, refresh_course_counters
+from core.models import Course
+
+
+class Command(BaseCommand):
+    help = 'Recount Course.subscriber_count and Course.lesson_count and fix the courses that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift.')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        drifted = checked = 0
+        last_id = 0
+
+        while True:
+            # walk the primary key so each batch is an index range scan
+            ids = list(
+                Course.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            checked += len(ids)
+
+            wrong = (
+                Course.objects.filter(id__in=ids)
+                .annotate(**{f'actual_{field}': actual_count(field) for field in COUNTED})
+                .filter(Q(*[~Q(**{field: F(f'actual_{field}')}) for field in COUNTED], _connector=Q.OR))
+                .values_list('id', *COUNTED, *[f'actual_{field}' for field in COUNTED])
+            )
+            wrong_ids = []
+            for course_id, *counts in wrong:
+                wrong_ids.append(course_id)
+                if options['verbosity'] > 1:
+                    stored, actual = counts[:len(COUNTED)], counts[len(COUNTED):]
+                    self.stdout.write(f'Course {course_id}: stored {stored}, actual {actual}')
+            drifted += len(wrong_ids)
+            if wrong_ids and not options['dry_run']:
+                refresh_course_counters(wrong_ids)
+
+        if drifted and not options['dry_run']:
+            bump_version('course')
+        verb = 'would fix' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} courses, {verb} {drifted}.'))
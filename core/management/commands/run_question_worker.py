@@ -0,0 +1,88 @@
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from core.ai import evict_questions
+from core.jobs import claim_jobs, requeue_stale_jobs, run_job
+
+
+def _run_in_thread(job):
+    try:
+        return run_job(job)
+    finally:
+        # every pool thread has its own connection, don't leave it open
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Run queued generate-questions jobs with bounded concurrency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int,
+            default=getattr(settings, 'QUESTION_WORKER_CONCURRENCY', 4),
+            help='Maximum number of model calls running at once.',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to sleep when there is nothing to claim.',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the queue is empty instead of polling forever.',
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        self.stdout.write(f'Question worker started (concurrency={concurrency}).')
+        running = set()
+        processed = 0
+        last_housekeeping = 0
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while not self.stopping:
+                close_old_connections()
+
+                if time.monotonic() - last_housekeeping > 60:
+                    requeued = requeue_stale_jobs()
+                    if requeued:
+                        self.stdout.write(f'Requeued {requeued} stale job(s).')
+                    evicted = evict_questions()
+                    if evicted:
+                        self.stdout.write(f'Evicted {evicted} cached question set(s).')
+                    last_housekeeping = time.monotonic()
+
+                free = concurrency - len(running)
+                jobs = claim_jobs(free) if free else []
+                for job in jobs:
+                    running.add(pool.submit(_run_in_thread, job))
+
+                if running:
+                    done, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job = future.result()
+                        processed += 1
+                        self.stdout.write(f'Job {job.id}: {job.status}')
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll_interval'])
+
+            # finish what was already claimed, don't leave rows stuck in 'running'
+            for future in running:
+                future.result()
+                processed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Question worker stopped after {processed} job(s).'))
+
+    def _stop(self, signum, frame):
+        self.stdout.write('Stopping after the running jobs finish...')
+        self.stopping = True
@@ -0,0 +1,62 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.passwords import PasswordHasherPool
+from core.registration import claim_registration_job, fail_stale_registration_jobs, run_registration_job
+
+
+class Command(BaseCommand):
+    help = 'Run queued bulk registrations (uploads too big for one request), one at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=getattr(settings, 'PASSWORD_HASH_WORKERS', 2),
+            help='Processes hashing passwords, started once for the life of the worker (0 = none).',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to sleep when there is nothing to claim.',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the queue is empty instead of polling forever.',
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        self.stdout.write(f"Registration worker started (workers={options['workers']}).")
+        processed = 0
+        last_housekeeping = 0
+
+        with PasswordHasherPool(options['workers']) as hasher:
+            while not self.stopping:
+                close_old_connections()
+
+                if time.monotonic() - last_housekeeping > 60:
+                    failed = fail_stale_registration_jobs()
+                    if failed:
+                        self.stdout.write(f'Failed {failed} stale job(s).')
+                    last_housekeeping = time.monotonic()
+
+                job = claim_registration_job()
+                if job is not None:
+                    job = run_registration_job(job, hasher=hasher)
+                    processed += 1
+                    self.stdout.write(f'Job {job.id}: {job.status}')
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll_interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Registration worker stopped after {processed} job(s).'))
+
+    def _stop(self, signum, frame):
+        self.stdout.write('Stopping after the running job finishes...')
+        self.stopping = True
@@ -0,0 +1,95 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# "import time:       412 |       1874 |     rest_framework.serializers"
+IMPORT_LINE_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+def parse_importtime(output):
+    """[(module, self_us, cumulative_us, depth)] from the stderr of `python -X importtime`."""
+    rows = []
+    for line in output.splitlines():
+        match = IMPORT_LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            # nested imports are indented by two more spaces per level
+            rows.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Start a fresh interpreter the way a worker boots (django.setup(), the WSGI app and '
+        'its middleware, the URLconf and so every view module) under `python -X importtime`, '
+        'and break the cold-start cost down per top-level package and per module.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=25, help='Rows per table.')
+        parser.add_argument(
+            '--import', dest='modules', action='append', default=[],
+            help='Also import this module (repeatable), e.g. core.ai.',
+        )
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        wsgi_module = settings.WSGI_APPLICATION.rsplit('.', 1)[0]
+        modules = [wsgi_module, settings.ROOT_URLCONF, *options['modules']]
+        code = '; '.join(f'import {module}' for module in modules)
+
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)}
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            env=env, cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        wall = time.perf_counter() - started
+
+        rows = parse_importtime(result.stderr)
+        if result.returncode != 0:
+            errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+            raise CommandError('Startup failed:\n' + '\n'.join(errors[-20:]))
+
+        packages = {}
+        for module, self_us, _, _ in rows:
+            package = module.split('.')[0]
+            total, count = packages.get(package, (0, 0))
+            packages[package] = (total + self_us, count + 1)
+
+        limit = options['limit']
+        report = {
+            'imported': modules,
+            'wall_ms': round(wall * 1000, 1),
+            'import_ms': round(sum(self_us for _, self_us, _, _ in rows) / 1000, 1),
+            'modules': len(rows),
+            'packages': [
+                {'package': package, 'self_ms': round(total / 1000, 1), 'modules': count}
+                for package, (total, count) in sorted(packages.items(), key=lambda item: -item[1][0])[:limit]
+            ],
+            'slowest': [
+                {'module': module, 'cumulative_ms': round(cumulative / 1000, 1), 'self_ms': round(self_us / 1000, 1)}
+                for module, self_us, cumulative, _ in sorted(rows, key=lambda row: -row[2])[:limit]
+            ],
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            f"Cold start of {', '.join(modules)}: {report['wall_ms']}ms wall, "
+            f"{report['import_ms']}ms importing {report['modules']} modules\n"
+        )
+        self.stdout.write('By top-level package (own import time):')
+        for row in report['packages']:
+            self.stdout.write(f"  {row['self_ms']:>9.1f}ms  {row['modules']:>4} modules  {row['package']}")
+        self.stdout.write('\nSlowest modules (including what they import):')
+        for row in report['slowest']:
+            self.stdout.write(f"  {row['cumulative_ms']:>9.1f}ms  (self {row['self_ms']:.1f}ms)  {row['module']}")
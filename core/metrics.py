@@ -0,0 +1,238 @@
+"""
+Per-request timings and process-wide histograms.
+
+MetricsMiddleware (middleware.py) opens a RequestTimings for every request
+and stores it in a context variable. While it is open:
+  - every SQL query is counted and timed (connection.execute_wrapper),
+  - `with timed('phase'):` blocks add to that phase - auth, serialize and ai
+    are instrumented in authentication.py, TimedSerializerMixin/TimedJSONRenderer
+    and ai.py.
+At the end the timings go out as a Server-Timing header and into per-route
+histograms, rendered in the Prometheus text format by the /metrics view.
+Outside a request (worker commands, shell) timed() does nothing.
+
+run_parallel() (parallel.py) hands the same RequestTimings to its threads,
+so it takes a lock around every update.
+
+The histograms are per process: with several workers, scrape each of them
+(or sum in the query).
+"""
+import bisect
+import contextvars
+import heapq
+import threading
+import time
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from rest_framework.renderers import JSONRenderer
+
+# seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('auth', 'db', 'serialize', 'ai', 'view')
+TOP_QUERIES = 5
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.depth = dict.fromkeys(PHASES, 0)
+        self.queries = 0
+        self.slowest = []  # min-heap of (seconds, n, sql), the TOP_QUERIES slowest
+        self.lock = threading.Lock()  # parallel.py threads share this request's timings
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.queries += 1
+                self.phases['db'] += elapsed
+                entry = (elapsed, self.queries, sql)
+                if len(self.slowest) < TOP_QUERIES:
+                    heapq.heappush(self.slowest, entry)
+                elif elapsed > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, entry)
+
+    def top_queries(self):
+        return [(seconds, sql) for seconds, _, sql in sorted(self.slowest, reverse=True)]
+
+    def server_timing(self, total):
+        parts = [f'db;dur={self.phases["db"] * 1000:.1f};desc="{self.queries} queries"']
+        parts += [
+            f'{phase};dur={self.phases[phase] * 1000:.1f}'
+            for phase in PHASES if phase != 'db' and self.phases[phase]
+        ]
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def start_request():
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+@contextmanager
+def instrument_connections():
+    """Count this thread's queries towards the current request too (see parallel.py)."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timings))
+        yield
+
+
+@asynccontextmanager
+async def ainstrument_connections():
+    """
+    instrument_connections() for async requests. Connections are per thread and
+    the async ORM runs its queries in the request's sync thread, so that's where
+    the wrappers go.
+    """
+    stack = ExitStack()
+    await sync_to_async(stack.enter_context)(instrument_connections())
+    try:
+        yield
+    finally:
+        await sync_to_async(stack.close)()
+
+
+@contextmanager
+def timed(phase):
+    """
+    Add the time spent in the block to `phase` of the current request; nested
+    blocks, and blocks overlapping in parallel threads, count once.
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.lock:
+        outermost = not timings.depth[phase]
+        if outermost:
+            timings.depth[phase] += 1
+    if not outermost:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with timings.lock:
+            timings.phases[phase] += time.perf_counter() - started
+            timings.depth[phase] -= 1
+
+
+class TimedSerializerMixin:
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    # JSON encoding is the other half of serializing
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('serialize'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+# --------------------- aggregation -------------------------------
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_lock = threading.Lock()
+_durations = {}  # (route, method) -> Histogram
+_phases = {}     # (route, method, phase) -> Histogram
+_requests = {}   # (route, method, status) -> count
+_queries = {}    # (route, method) -> count
+
+
+def record(route, method, status, total, timings):
+    with _lock:
+        key = (route, method)
+        _durations.setdefault(key, Histogram()).observe(total)
+        for phase, seconds in timings.phases.items():
+            if seconds:
+                _phases.setdefault((route, method, phase), Histogram()).observe(seconds)
+        status_key = (route, method, str(status))
+        _requests[status_key] = _requests.get(status_key, 0) + 1
+        _queries[key] = _queries.get(key, 0) + timings.queries
+
+
+def _labels(names, values):
+    escaped = (
+        str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        for value in values
+    )
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+def _histogram_lines(name, label_names, histograms):
+    for values, histogram in sorted(histograms.items()):
+        labels = _labels(label_names, values)
+        cumulative = 0
+        for bound, count in zip((*BUCKETS, '+Inf'), histogram.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {histogram.sum}'
+        yield f'{name}_count{{{labels}}} {histogram.count}'
+
+
+def render_prometheus():
+    with _lock:
+        durations = {key: _copy(h) for key, h in _durations.items()}
+        phases = {key: _copy(h) for key, h in _phases.items()}
+        requests = dict(_requests)
+        queries = dict(_queries)
+
+    lines = [
+        '# HELP edulearn_request_duration_seconds Time from the first middleware to the response.',
+        '# TYPE edulearn_request_duration_seconds histogram',
+        *_histogram_lines('edulearn_request_duration_seconds', ('route', 'method'), durations),
+        '# HELP edulearn_request_phase_seconds Time per request spent in auth, db, serialize, ai and the view.',
+        '# TYPE edulearn_request_phase_seconds histogram',
+        *_histogram_lines('edulearn_request_phase_seconds', ('route', 'method', 'phase'), phases),
+        '# HELP edulearn_requests_total Requests by route and status.',
+        '# TYPE edulearn_requests_total counter',
+        *(f'edulearn_requests_total{{{_labels(("route", "method", "status"), key)}}} {count}'
+          for key, count in sorted(requests.items())),
+        '# HELP edulearn_db_queries_total SQL queries run while serving requests.',
+        '# TYPE edulearn_db_queries_total counter',
+        *(f'edulearn_db_queries_total{{{_labels(("route", "method"), key)}}} {count}'
+          for key, count in sorted(queries.items())),
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def _copy(histogram):
+    copy = Histogram()
+    copy.counts = list(histogram.counts)
+    copy.sum = histogram.sum
+    copy.count = histogram.count
+    return copy
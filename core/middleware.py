@@ -0,0 +1,141 @@
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+from . import metrics, routers
+
+slow_logger = logging.getLogger('core.slow_requests')
+
+
+class MetricsMiddleware:
+    """
+    Times the request (see core/metrics.py), adds a Server-Timing header and
+    feeds the /metrics histograms. Requests slower than SLOW_REQUEST_MS are
+    logged with their slowest SQL statements.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'METRICS_SERVER_TIMING', True)
+        self.slow_seconds = getattr(settings, 'SLOW_REQUEST_MS', 1000) / 1000
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings, token = metrics.start_request()
+        try:
+            with metrics.instrument_connections():
+                response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings, token = metrics.start_request()
+        try:
+            async with metrics.ainstrument_connections():
+                response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        if getattr(request, 'view_started', None) is not None:
+            timings.phases['view'] = time.perf_counter() - request.view_started
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else 'unmatched'
+        metrics.record(route, request.method, response.status_code, total, timings)
+
+        if self.server_timing:
+            response['Server-Timing'] = timings.server_timing(total)
+        if self.slow_seconds and total >= self.slow_seconds:
+            self.log_slow(request, response, total, timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.view_started = time.perf_counter()
+
+    def log_slow(self, request, response, total, timings):
+        lines = [
+            f'{seconds * 1000:.1f}ms {" ".join(sql.split())[:500]}'
+            for seconds, sql in timings.top_queries()
+        ]
+        slow_logger.warning(
+            'slow request %s %s -> %s in %.0fms (%s queries, %.0fms db)\n%s',
+            request.method, request.get_full_path(), response.status_code, total * 1000,
+            timings.queries, timings.phases['db'] * 1000, '\n'.join(lines),
+        )
+
+
+class ReplicaMiddleware:
+    """Sends reads of opted-in views to a replica, see core/routers.py."""
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.replicas = routers.replica_aliases()
+        self.enabled = bool(self.replicas)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        token = getattr(request, 'replica_token', None)
+        if token is not None:
+            routers.reset_replica(token)
+        if self.should_pin(request, response):
+            routers.pin_to_primary(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if getattr(request, 'replica_token', None) is not None:
+            # process_view ran in a thread (sync_to_async) and its token belongs to
+            # that copy of the context; the request's own context just ends here
+            routers.use_replica(None)
+        if self.should_pin(request, response):
+            await sync_to_async(routers.pin_to_primary)(request)
+        return response
+
+    def should_pin(self, request, response):
+        return self.enabled and request.method not in self.SAFE_METHODS and response.status_code < 400
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            self.enabled
+            and request.method in self.SAFE_METHODS
+            and routers.wants_replica(view_func)
+            and not routers.is_pinned(request)
+        ):
+            # one replica for the whole request, so its reads agree with each other
+            request.replica_token = routers.use_replica(random.choice(self.replicas))
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware (which skips small bodies and clients that don't send
+    Accept-Encoding: gzip), minus partial responses: Content-Range counts bytes
+    of the uncompressed body, so a 206 has to go out as is.
+    """
+
+    def process_response(self, request, response):
+        if response.status_code == 206:
+            return response
+        return super().process_response(request, response)
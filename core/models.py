@@ -1,3 +1,6 @@
+import hashlib
+import uuid
+
 from django.db import models
 
 # Create your models here.
@@ -92,25 +95,70 @@ class Course(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     # course_image = models.URLField(null=True, blank=True)  # New field for image URL
     course_image = models.ImageField(upload_to='img_courses/', null=True, blank=True)
+    # resized WebP/JPEG copies of course_image, see core/images.py
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    # denormalized, only ever changed with F() updates - see core/counters.py
+    subscriber_count = models.PositiveIntegerField(default=0, editable=False)
+    lesson_count = models.PositiveIntegerField(default=0, editable=False)
+
+    COUNTER_FIELDS = ('subscriber_count', 'lesson_count')
+
+    class Meta:
+        indexes = [
+            # keyset pagination: WHERE (created_at, id) > (...) ORDER BY created_at, id
+            models.Index(fields=['created_at', 'id'], name='course_created_id_idx'),
+            # /api/courses/popular/: ORDER BY subscriber_count DESC, id DESC LIMIT n
+            models.Index(fields=['-subscriber_count', '-id'], name='course_popular_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save_edits(self):
+        """
+        Save an edit of an existing course: every column but the counters, which
+        would otherwise be written back as they were loaded, over concurrent F()
+        updates. Used by the API and the admin; a plain save() writes everything.
+        """
+        self.save(update_fields=[
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.name not in self.COUNTER_FIELDS
+        ])
+
+def lesson_content_hash(content):
+    # whitespace differences don't count, like for the question cache (core/ai.py)
+    return hashlib.sha256(' '.join(content.split()).encode('utf-8')).hexdigest()
+
+
 class Lesson(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='lessons')
     title = models.CharField(max_length=255)
     content = models.TextField()
     lesson_number = models.PositiveIntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # lesson_content_hash(content), kept with it so "did it change" is a column comparison
+    # (core/course_questions.py); bulk_create() callers have to fill it in themselves
+    content_sha256 = models.CharField(max_length=64, blank=True, editable=False)
 
     class Meta:
         ordering = ['lesson_number']  # Optional: always fetch lessons in order
+        indexes = [
+            # keyset pagination over (course_id, lesson_number, id) - InnoDB appends the pk to every index
+            models.Index(fields=['course', 'lesson_number'], name='lesson_course_number_idx'),
+        ]
 
     # def __str__(self):
     #     return f"{self.title} ({self.course.title})"
     def __str__(self):
         return f"Lesson {self.lesson_number}: {self.title} ({self.course.title})"
 
+    def save(self, *args, **kwargs):
+        self.content_sha256 = lesson_content_hash(self.content)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'content_sha256'}
+        super().save(*args, **kwargs)
+
 
 class SubscribedCourse(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='subscriptions')
@@ -119,7 +167,197 @@ class SubscribedCourse(models.Model):
 
     class Meta:
         unique_together = ('student', 'course')  # Prevent duplicate subscriptions
+        indexes = [
+            # a student's subscriptions, paginated by (subscribed_at, id)
+            models.Index(fields=['student', 'subscribed_at', 'id'], name='sub_student_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student.full_name} subscribed to {self.course.title}"
 
+
+# where a student is in a lesson: one row per (student, lesson), written in
+# batches by core/progress.py rather than one row per client event
+class LessonProgress(models.Model):
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='lesson_progress')
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name='progress')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='+')  # copy of lesson.course
+    percent = models.PositiveSmallIntegerField(default=0)  # furthest point read, 0-100
+    opened_at = models.DateTimeField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'lesson'], name='progress_student_lesson_uniq'),
+        ]
+        indexes = [
+            # completion of one course: WHERE student_id = ? AND course_id = ? [AND completed_at IS NOT NULL]
+            models.Index(fields=['student', 'course', 'completed_at'], name='progress_student_course_idx'),
+        ]
+
+    def __str__(self):
+        return f"student {self.student_id} at {self.percent}% of lesson {self.lesson_id}"
+
+
+
+# "students also took", built by `manage.py build_cooccurrence` (core/cooccurrence.py)
+
+# how many students are subscribed to both courses; stored once per pair, course_a < course_b
+class CoursePairCount(models.Model):
+    course_a = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='+')
+    course_b = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course_a', 'course_b'], name='pair_courses_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['course_b'], name='pair_course_b_idx'),
+        ]
+
+
+# top-K most similar courses of each course, read by /api/courses/<id>/also-took/
+class CourseNeighbor(models.Model):
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()  # cosine similarity of the two subscriber sets
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'rank'], name='neighbor_course_rank_uniq'),
+        ]
+
+
+# single row: subscriptions up to this id are counted in CoursePairCount
+class CooccurrenceState(models.Model):
+    last_subscription_id = models.BigIntegerField(default=0)
+    built_at = models.DateTimeField(null=True, blank=True)
+
+
+# cached model output for generate-questions, keyed by a hash of backend + prompt version + lesson content
+class GeneratedQuestionSet(models.Model):
+    content_hash = models.CharField(max_length=64, unique=True)
+    prompt_version = models.PositiveIntegerField()
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.content_hash
+
+
+# a queued generate-questions request, picked up by `manage.py run_question_worker`
+class QuestionGenerationJob(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # either one piece of lesson content, or every lesson of a course (see core/course_questions.py)
+    lesson_content = models.TextField(blank=True)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, null=True, blank=True, related_name='question_jobs')
+    content_hash = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)  # course jobs refresh it as they go
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # workers claim the oldest pending jobs
+            models.Index(fields=['status', 'created_at'], name='qjob_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.id} ({self.status})"
+
+
+# a bulk registration too big for one request, run by `manage.py run_registration_worker`
+class RegistrationJob(models.Model):
+    STATUS_CHOICES = QuestionGenerationJob.STATUS_CHOICES
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    allowed_roles = models.JSONField(default=list)
+    # the uploaded rows, passwords included - emptied as soon as the job has run or expired
+    # (see core/registration.py), and kept out of the admin
+    rows = models.JSONField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='regjob_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.id} ({self.status})"
+
+
+# merged questions/MCQs of one lesson; regenerated when the lesson's content_sha256 or the
+# backend/prompt (see core/course_questions.py) changes
+class LessonQuestions(models.Model):
+    lesson = models.OneToOneField(Lesson, on_delete=models.CASCADE, related_name='generated_questions')
+    content_hash = models.CharField(max_length=64)  # the lesson's content_sha256 it was made from
+    generator = models.CharField(max_length=100, default='')  # "<backend>:<prompt version>"
+    result = models.JSONField()
+    chunks = models.PositiveSmallIntegerField(default=1)  # model calls it took
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"questions for lesson {self.lesson_id}"
+
+
+# --------------------- full-text search index (see core/search.py) ---------------------
+
+class SearchTerm(models.Model):
+    term = models.CharField(max_length=64, unique=True)
+    document_frequency = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.term
+
+
+class SearchDocument(models.Model):
+    DOC_TYPE_CHOICES = (
+        ('course', 'Course'),
+        ('lesson', 'Lesson'),
+    )
+    doc_type = models.CharField(max_length=10, choices=DOC_TYPE_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    # no cascade: the signals remove documents themselves so term frequencies stay right
+    course = models.ForeignKey(Course, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    title = models.CharField(max_length=255)
+    length = models.PositiveIntegerField()  # in tokens
+
+    class Meta:
+        unique_together = ('doc_type', 'object_id')
+
+    def __str__(self):
+        return f"{self.doc_type} {self.object_id}: {self.title}"
+
+
+class SearchPosting(models.Model):
+    term = models.CharField(max_length=64)
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='postings')
+    frequency = models.PositiveIntegerField()
+    doc_length = models.PositiveIntegerField()  # copy of document.length, so weights can be recomputed without a join
+    weight = models.FloatField()
+
+    class Meta:
+        indexes = [
+            # a query reads the best postings of each term first
+            models.Index(fields=['term', '-weight'], name='posting_term_weight_idx'),
+        ]
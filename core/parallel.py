@@ -0,0 +1,65 @@
+"""
+Run a few independent, query-bound functions of one request side by side.
+
+The threads live in a shared pool and keep their own database connections,
+checked the same way Django checks the request thread's connection
+(close_old_connections, so CONN_MAX_AGE applies). Each call runs in a copy
+of the caller's context, so the replica routing and request metrics of the
+request follow it into the thread.
+
+Inside a transaction the functions run one after another on the caller's
+connection instead - another thread would not see uncommitted rows. So they do
+without persistent connections (CONN_MAX_AGE=0): a pool thread would open and
+close a connection per call, and the handshakes cost more than a couple of
+indexed queries take. Check with `manage.py bench --endpoint dashboard` before
+raising DASHBOARD_CONCURRENCY.
+
+The first function always runs in the calling thread, so a request needs one
+pool thread less, and keeps going while the pool is busy with other requests.
+"""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from . import metrics
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=max(1, getattr(settings, 'DASHBOARD_CONCURRENCY', 1)),
+                    thread_name_prefix='request-parallel',
+                )
+    return _pool
+
+
+def _run(fn):
+    close_old_connections()
+    try:
+        with metrics.instrument_connections():
+            return fn()
+    finally:
+        close_old_connections()
+
+
+def run_parallel(*fns):
+    """Call each function and return their results in order."""
+    if (
+        len(fns) < 2
+        or connection.in_atomic_block
+        or getattr(settings, 'DASHBOARD_CONCURRENCY', 1) < 2
+        or connection.settings_dict.get('CONN_MAX_AGE', 0) == 0
+    ):
+        return [fn() for fn in fns]
+    pool = _get_pool()
+    futures = [pool.submit(contextvars.copy_context().run, _run, fn) for fn in fns[1:]]
+    return [fns[0]()] + [future.result() for future in futures]
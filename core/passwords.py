@@ -0,0 +1,72 @@
+"""
+Password hashing on a pool of processes, for bulk registration (core/registration.py).
+
+Hashing is CPU bound on purpose, so threads would only take turns on the GIL.
+The pool uses the "spawn" start method, which is safe to start from a
+threaded web worker; the workers unpickle their functions from this module,
+which is why it imports nothing that needs the app registry.
+
+Spawning and setting up the worker processes costs more than hashing a
+request's worth of passwords, so web workers share one long-lived pool per
+process (shared_pool()) instead of starting one per request.
+"""
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+
+
+def hash_all(passwords):
+    return [make_password(password) for password in passwords]
+
+
+def _init_worker():
+    # spawned processes start from scratch
+    import django
+    django.setup()
+
+
+class PasswordHasherPool:
+    """hash(passwords) -> hashes in the same order, on `workers` processes (0 = in this one)."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = None
+        if workers > 0:
+            self.pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker,
+            )
+
+    def hash(self, passwords):
+        if self.pool is None:
+            return hash_all(passwords)
+        # a few slices per worker: little pickling, and the load still evens out
+        size = max(1, -(-len(passwords) // (self.workers * 4)))
+        slices = [passwords[start:start + size] for start in range(0, len(passwords), size)]
+        return [hashed for part in self.pool.map(hash_all, slices) for hashed in part]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_pool():
+    """This process's PasswordHasherPool of settings.PASSWORD_HASH_WORKERS processes, started on first use."""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                pool = PasswordHasherPool(getattr(settings, 'PASSWORD_HASH_WORKERS', 2))
+                atexit.register(pool.__exit__, None, None, None)
+                _shared = pool
+    return _shared
@@ -0,0 +1,227 @@
+"""
+Lesson progress ingestion.
+
+Clients report progress every few seconds. Instead of writing a row per
+event, events are merged per (student, lesson) in a process-local buffer
+and written in one batch when the buffer holds PROGRESS_BUFFER_SIZE
+entries or its oldest entry is PROGRESS_FLUSH_SECONDS old (a timer thread
+covers quiet periods, and the buffer is flushed at exit).
+
+A flush writes the batch with a single INSERT ... ON CONFLICT/ON DUPLICATE
+KEY UPDATE (per 1000 rows) whose UPDATE merges with the stored row in SQL
+(furthest percent, first opened_at, first completed_at), so workers flushing
+the same (student, lesson) at the same time can't overwrite each other.
+
+The buffer belongs to one process. A reader only sees the events buffered by
+the process serving it (course_progress flushes those first); events still
+buffered in another worker show up within PROGRESS_FLUSH_SECONDS.
+Events still in the buffer are lost if the process dies, at most a few
+seconds of progress, which the next event from the client repeats anyway.
+
+A batch that fails on a foreign key (its lesson or student was deleted after
+the request was checked) is written again without those rows. Any other
+failure keeps the batch for the next flush, PROGRESS_FLUSH_RETRIES times and
+up to PROGRESS_BUFFER_MAX rows; past that progress is dropped rather than
+piling up in memory.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, connection
+from django.utils import timezone
+
+from .models import Lesson, LessonProgress, Student
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ['student', 'lesson', 'course', 'percent', 'opened_at', 'completed_at', 'updated_at']
+
+
+def merge(old, new):
+    """Combine two progress states of the same (student, lesson)."""
+    return {
+        'course_id': new['course_id'],
+        'percent': max(old['percent'], new['percent']),
+        'opened_at': min(old['opened_at'], new['opened_at']),
+        'completed_at': min(
+            (at for at in (old['completed_at'], new['completed_at']) if at is not None), default=None
+        ),
+        'updated_at': max(old['updated_at'], new['updated_at']),
+    }
+
+
+def event_state(course_id, percent, completed, at):
+    if completed:
+        percent = 100
+    return {
+        'course_id': course_id,
+        'percent': percent,
+        'opened_at': at,
+        'completed_at': at if percent >= 100 else None,
+        'updated_at': at,
+    }
+
+
+def upsert_sql(rows):
+    """
+    INSERT for `rows` rows of COLUMNS that, for rows already stored, does what
+    merge() does in SQL. bulk_create(update_conflicts=True) can only overwrite.
+    """
+    qn = connection.ops.quote_name
+    fields = [LessonProgress._meta.get_field(name) for name in COLUMNS]
+    table = qn(LessonProgress._meta.db_table)
+    row = '(%s)' % ', '.join(['%s'] * len(fields))
+    greatest, least = ('MAX', 'MIN') if connection.vendor == 'sqlite' else ('GREATEST', 'LEAST')
+    if connection.vendor == 'mysql':
+        # no conflict target, the unique (student, lesson) is the only one besides the pk
+        conflict, incoming = 'ON DUPLICATE KEY UPDATE', 'VALUES({})'
+    else:
+        conflict = 'ON CONFLICT ({}, {}) DO UPDATE SET'.format(*(qn(field.column) for field in fields[:2]))
+        incoming = 'EXCLUDED.{}'
+
+    def merged(name, sql):
+        column = qn(LessonProgress._meta.get_field(name).column)
+        return f'{column} = ' + sql.format(f'{table}.{column}', incoming.format(column))
+
+    return 'INSERT INTO {} ({}) VALUES {} {} {}'.format(
+        table,
+        ', '.join(qn(field.column) for field in fields),
+        ', '.join([row] * rows),
+        conflict,
+        ', '.join([
+            merged('percent', greatest + '({}, {})'),
+            merged('opened_at', least + '({}, {})'),
+            merged('completed_at', 'COALESCE({}, {})'),
+            merged('updated_at', greatest + '({}, {})'),
+        ]),
+    )
+
+
+def write_progress(states):
+    """Write {(student_id, lesson_id): state} with one upsert per 1000 rows, merged with what is stored."""
+    fields = [LessonProgress._meta.get_field(name) for name in COLUMNS]
+    rows = [
+        [
+            field.get_db_prep_save(value, connection)
+            for field, value in zip(fields, (
+                student_id, lesson_id, state['course_id'], state['percent'],
+                state['opened_at'], state['completed_at'], state['updated_at'],
+            ))
+        ]
+        for (student_id, lesson_id), state in states.items()
+    ]
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), 1000):
+            batch = rows[start:start + 1000]
+            cursor.execute(upsert_sql(len(batch)), [value for row in batch for value in row])
+
+
+def existing(states):
+    """The part of `states` whose student and lesson are still there."""
+    students = set(Student.objects.filter(id__in={key[0] for key in states}).values_list('id', flat=True))
+    lessons = set(Lesson.objects.filter(id__in={key[1] for key in states}).values_list('id', flat=True))
+    return {key: state for key, state in states.items() if key[0] in students and key[1] in lessons}
+
+
+class ProgressBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time, adds keep going meanwhile
+        self._pending = {}
+        self._oldest = None
+        self._timer = None
+        self._failures = 0  # flushes failed in a row
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'PROGRESS_BUFFER_SIZE', 500)
+
+    @property
+    def max_age(self):
+        return getattr(settings, 'PROGRESS_FLUSH_SECONDS', 5)
+
+    @property
+    def max_pending(self):
+        return getattr(settings, 'PROGRESS_BUFFER_MAX', self.max_size * 10)
+
+    def add(self, student_id, events):
+        """events: [(lesson_id, course_id, percent, completed)], all happening now."""
+        now = timezone.now()
+        with self._lock:
+            for lesson_id, course_id, percent, completed in events:
+                key = (student_id, lesson_id)
+                state = event_state(course_id, percent, completed, now)
+                old = self._pending.get(key)
+                self._pending[key] = merge(old, state) if old else state
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            due = len(self._pending) >= self.max_size or time.monotonic() - self._oldest >= self.max_age
+            if not due:
+                self._schedule()
+        if due:
+            self.flush()
+
+    def has_pending(self, student_id):
+        with self._lock:
+            return any(key[0] == student_id for key in self._pending)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending, self._oldest = self._pending, {}, None
+            if not batch:
+                return 0
+            try:
+                try:
+                    write_progress(batch)
+                except IntegrityError:
+                    kept = existing(batch)
+                    if len(kept) == len(batch):
+                        raise
+                    logger.warning('dropping %s lesson progress rows of deleted lessons or students', len(batch) - len(kept))
+                    batch = kept
+                    write_progress(batch)
+            except Exception:
+                self._failures += 1
+                if self._failures > getattr(settings, 'PROGRESS_FLUSH_RETRIES', 5):
+                    logger.exception('could not write %s lesson progress rows %s times, dropping them',
+                                     len(batch), self._failures)
+                    self._failures = 0
+                    return 0
+                logger.exception('could not write %s lesson progress rows, keeping them for the next flush', len(batch))
+                with self._lock:
+                    if len(self._pending) + len(batch) > self.max_pending:
+                        logger.error('lesson progress buffer full, dropping %s rows', len(batch))
+                        return 0
+                    for key, state in batch.items():
+                        newer = self._pending.get(key)
+                        self._pending[key] = merge(state, newer) if newer else state
+                    if self._oldest is None:
+                        self._oldest = time.monotonic()
+                    self._schedule()
+                return 0
+            self._failures = 0
+            return len(batch)
+
+    def _schedule(self):
+        # caller holds self._lock
+        if self._timer is None or not self._timer.is_alive():
+            self._timer = threading.Timer(self.max_age, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None  # adds during the flush schedule the next one
+        try:
+            self.flush()
+        finally:
+            # a fresh thread each time, don't leave its connection open
+            connection.close()
+
+
+progress_buffer = ProgressBuffer()
+atexit.register(progress_buffer.flush)
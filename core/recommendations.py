@@ -0,0 +1,215 @@
+"""
+In-memory index used by the recommended_courses endpoint.
+
+Every course is kept as a (category, tag bitmask) pair in flat arrays, so
+scoring a student's subscriptions against the whole catalog is a pass over
+a few arrays instead of one query per candidate course.
+"""
+import heapq
+import threading
+import time
+from array import array
+
+from django.conf import settings
+
+from .models import Course
+
+
+class RecommendationIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.built_at = None
+        self._ids = array('q')            # course id per slot (0 = removed)
+        self._categories = array('l')     # category code per slot
+        self._tag_masks = []              # int bitmask of tags per slot
+        self._popularity = array('l')     # subscriber count per slot
+        self._slots = {}                  # course id -> slot
+        self._category_codes = {}         # category name -> code
+        self._category_slots = {}         # category code -> [slots], in id order
+        self._tag_bits = {}               # tag id -> bit position
+
+    # ---------------------------------------------------------------- build
+
+    def build(self):
+        """Load the whole catalog in two queries."""
+        courses = Course.objects.order_by('id').values_list('id', 'category', 'subscriber_count')
+        through = Course.tags.through.objects.values_list('course_id', 'coursetag_id')
+
+        with self._lock:
+            self._reset()
+            for course_id, category, subscribers in courses:
+                self._add_course(course_id, category)
+                self._popularity[self._slots[course_id]] = subscribers
+            for course_id, tag_id in through:
+                slot = self._slots.get(course_id)
+                if slot is not None:
+                    self._tag_masks[slot] |= self._bit(tag_id)
+            self.built_at = time.monotonic()
+
+    def is_stale(self):
+        if self.built_at is None:
+            return True
+        ttl = getattr(settings, 'RECOMMENDATION_INDEX_TTL', 300)
+        return ttl is not None and time.monotonic() - self.built_at > ttl
+
+    def invalidate(self):
+        with self._lock:
+            self.built_at = None
+
+    # -------------------------------------------------------- incremental
+
+    def _bit(self, tag_id):
+        bit = self._tag_bits.get(tag_id)
+        if bit is None:
+            bit = self._tag_bits[tag_id] = len(self._tag_bits)
+        return 1 << bit
+
+    def _category_code(self, category):
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self._category_codes)
+            self._category_slots[code] = []
+        return code
+
+    def _add_course(self, course_id, category):
+        code = self._category_code(category)
+        slot = len(self._ids)
+        self._ids.append(course_id)
+        self._categories.append(code)
+        self._tag_masks.append(0)
+        self._popularity.append(0)
+        self._slots[course_id] = slot
+        self._category_slots[code].append(slot)
+
+    def upsert_course(self, course_id, category):
+        with self._lock:
+            if self.built_at is None:
+                return
+            slot = self._slots.get(course_id)
+            if slot is None:
+                self._add_course(course_id, category)
+                return
+            code = self._category_code(category)
+            old_code = self._categories[slot]
+            if code != old_code:
+                self._category_slots[old_code].remove(slot)
+                # keep each bucket in id order so ties rank like the old query did
+                bucket = self._category_slots[code]
+                bucket.append(slot)
+                bucket.sort(key=self._ids.__getitem__)
+                self._categories[slot] = code
+
+    def remove_course(self, course_id):
+        with self._lock:
+            slot = self._slots.pop(course_id, None)
+            if slot is None:
+                return
+            self._category_slots[self._categories[slot]].remove(slot)
+            self._ids[slot] = 0
+            self._tag_masks[slot] = 0
+            self._popularity[slot] = 0
+
+    def set_course_tags(self, course_id, tag_ids, added=True):
+        with self._lock:
+            slot = self._slots.get(course_id)
+            if slot is None:
+                return
+            mask = 0
+            for tag_id in tag_ids:
+                mask |= self._bit(tag_id)
+            if added:
+                self._tag_masks[slot] |= mask
+            else:
+                self._tag_masks[slot] &= ~mask
+
+    def clear_course_tags(self, course_id):
+        with self._lock:
+            slot = self._slots.get(course_id)
+            if slot is not None:
+                self._tag_masks[slot] = 0
+
+    def remove_tag(self, tag_id):
+        with self._lock:
+            bit = self._tag_bits.get(tag_id)
+            if bit is None:
+                return
+            mask = ~(1 << bit)
+            self._tag_masks = [m & mask for m in self._tag_masks]
+
+    def add_subscribers(self, course_id, delta):
+        with self._lock:
+            slot = self._slots.get(course_id)
+            if slot is not None:
+                self._popularity[slot] = max(0, self._popularity[slot] + delta)
+
+    def set_subscribers(self, counts):
+        """counts: {course_id: subscriber_count}, e.g. fresh from the database."""
+        with self._lock:
+            for course_id, subscribers in counts.items():
+                slot = self._slots.get(course_id)
+                if slot is not None:
+                    self._popularity[slot] = subscribers
+
+    # ------------------------------------------------------------- query
+
+    def recommend(self, subscribed_ids, limit=5, per_course=4):
+        """
+        Return up to `limit` course ids for a student subscribed to `subscribed_ids`.
+
+        For every subscribed course, the best `per_course` courses of the same
+        category (by number of shared tags) are picked; the rest is filled
+        with the most popular courses the student doesn't have yet.
+        """
+        with self._lock:
+            excluded = set(subscribed_ids)
+            picked = []
+            seen = set()
+
+            for course_id in subscribed_ids:
+                slot = self._slots.get(course_id)
+                if slot is None:
+                    continue
+                mask = self._tag_masks[slot]
+                scored = [
+                    ((mask & self._tag_masks[s]).bit_count(), self._ids[s])
+                    for s in self._category_slots[self._categories[slot]]
+                    if self._ids[s] not in excluded
+                ]
+                # stable sort keeps id order between equal scores
+                scored.sort(key=lambda pair: pair[0], reverse=True)
+                for _, candidate in scored[:per_course]:
+                    if candidate not in seen:
+                        seen.add(candidate)
+                        picked.append(candidate)
+
+            if len(picked) < limit:
+                excluded |= seen
+                popular = heapq.nsmallest(
+                    limit - len(picked),
+                    (s for s in range(len(self._ids)) if self._ids[s] and self._ids[s] not in excluded),
+                    key=lambda s: (-self._popularity[s], self._ids[s]),
+                )
+                picked += [self._ids[s] for s in popular]
+
+            return picked[:limit]
+
+
+_index = RecommendationIndex()
+
+
+def get_recommendation_index():
+    # rebuilt lazily on first use and after RECOMMENDATION_INDEX_TTL seconds, so
+    # other workers' writes (which only update their own copy) show up eventually
+    if _index.is_stale():
+        with _index._lock:
+            if _index.is_stale():
+                _index.build()
+    return _index
+
+
+def invalidate_recommendation_index():
+    # for bulk writes that bypass signals; the next request rebuilds it
+    _index.invalidate()
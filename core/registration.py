@@ -0,0 +1,247 @@
+"""
+Bulk registration of a whole cohort: POST /api/auth/register/bulk/ and
+`manage.py import_users`.
+
+Registering users one at a time is dominated by password hashing, which is
+slow on purpose (a few hundred ms of CPU each with Django's PBKDF2). Here
+rows are validated up front (one query per chunk for emails already taken),
+passwords are hashed on a process pool (core/passwords.py) and each chunk of
+users is written in its own transaction with two bulk_create()s, the users
+and then their Student/Educator rows. Every input row gets a result.
+
+The API registers up to BULK_REGISTRATION_MAX_ROWS users in the request.
+Bigger uploads (up to BULK_REGISTRATION_JOB_MAX_ROWS) become a
+RegistrationJob that `manage.py run_registration_worker` runs, so a cohort
+doesn't hold a web worker for the minutes its hashing takes. Until then the
+job's rows hold plaintext passwords: a job nobody picked up within
+REGISTRATION_JOB_PENDING_TTL is failed and its rows wiped, by the worker's
+housekeeping and by every new upload, so they don't pile up without a worker.
+"""
+import csv
+import io
+import json
+import logging
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import Educator, RegistrationJob, Student, User
+from .passwords import hash_all
+
+logger = logging.getLogger(__name__)
+
+CSV_COLUMNS = ('email', 'password', 'role', 'full_name', 'profile_image')
+
+PROFILE_MODELS = {'student': Student, 'educator': Educator}
+
+
+class BulkUserSerializer(serializers.Serializer):
+    # RegisterSerializer's fields, minus its per-row uniqueness query (checked per chunk instead)
+    email = serializers.EmailField(max_length=254)
+    password = serializers.CharField(max_length=128)
+    role = serializers.ChoiceField(choices=User.ROLE_CHOICES)
+    full_name = serializers.CharField(max_length=255)
+    profile_image = serializers.URLField(required=False, allow_blank=True, allow_null=True)
+
+
+def read_rows(f, fmt):
+    """Rows of a text file: CSV with a header (see CSV_COLUMNS) or JSONL, one object per line."""
+    if fmt == 'csv':
+        for row in csv.DictReader(f):
+            yield {key: value for key, value in row.items() if key in CSV_COLUMNS and value != ''}
+        return
+    for line in f:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {'_error': f'invalid JSON: {e}'}
+
+
+def read_upload(upload, fmt=None):
+    """Rows of an uploaded .csv/.jsonl file."""
+    fmt = fmt or ('csv' if upload.name.lower().endswith('.csv') else 'jsonl')
+    return list(read_rows(io.TextIOWrapper(upload, encoding='utf-8', newline=''), fmt))
+
+
+def validate_rows(rows, allowed_roles):
+    """[(row number, validated data or None, result)] - result is set for rows that already failed."""
+    checked, seen = [], set()
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict) or '_error' in row:
+            error = row.get('_error') if isinstance(row, dict) else 'expected an object'
+            checked.append((number, None, {'row': number, 'status': 'error', 'errors': {'row': [error]}}))
+            continue
+        serializer = BulkUserSerializer(data=row)
+        if not serializer.is_valid():
+            checked.append((number, None, {
+                'row': number, 'email': row.get('email'), 'status': 'error', 'errors': serializer.errors,
+            }))
+            continue
+        data = serializer.validated_data
+        data['email'] = User.objects.normalize_email(data['email'])
+        error = None
+        if data['role'] not in allowed_roles:
+            error = {'role': [f"You can't register {data['role']}s."]}
+        elif data['email'] in seen:
+            error = {'email': ['Appears earlier in this file.']}
+        seen.add(data['email'])
+        if error:
+            checked.append((number, None, {'row': number, 'email': data['email'], 'status': 'error', 'errors': error}))
+        else:
+            checked.append((number, data, None))
+    return checked
+
+
+def _profile(data, user_id):
+    return PROFILE_MODELS[data['role']](
+        user_id=user_id, full_name=data['full_name'], profile_image=data.get('profile_image') or None,
+    )
+
+
+def _user(data, password_hash):
+    return User(email=data['email'], password=password_hash, role=data['role'])
+
+
+def _write_chunk(rows):
+    """rows: [(number, data, password hash)]. Returns {number: result}."""
+    with transaction.atomic():
+        User.objects.bulk_create([_user(data, password_hash) for _, data, password_hash in rows])
+        # MySQL doesn't hand back ids from bulk_create
+        ids = dict(User.objects.filter(email__in=[data['email'] for _, data, _ in rows]).values_list('email', 'id'))
+        for model in PROFILE_MODELS.values():
+            profiles = [_profile(data, ids[data['email']]) for _, data, _ in rows if PROFILE_MODELS[data['role']] is model]
+            if profiles:
+                model.objects.bulk_create(profiles)
+    return {
+        number: {'row': number, 'email': data['email'], 'status': 'created', 'id': ids[data['email']]}
+        for number, data, _ in rows
+    }
+
+
+def _write_rows_one_by_one(rows):
+    # the chunk collided with a concurrent registration: find out which rows
+    results = {}
+    for number, data, password_hash in rows:
+        try:
+            with transaction.atomic():
+                user = _user(data, password_hash)
+                user.save()
+                _profile(data, user.id).save()
+        except IntegrityError:
+            results[number] = {
+                'row': number, 'email': data['email'], 'status': 'error',
+                'errors': {'email': ['A user with this email already exists.']},
+            }
+        else:
+            results[number] = {'row': number, 'email': data['email'], 'status': 'created', 'id': user.id}
+    return results
+
+
+def register_users(rows, hasher=None, chunk_size=500, allowed_roles=('student', 'educator')):
+    """
+    Register `rows` (dicts with BulkUserSerializer's fields); one result per row, in input order.
+    Passwords are hashed on `hasher` (a PasswordHasherPool), or in this process without one.
+    """
+    checked = validate_rows(rows, allowed_roles)
+    results = {number: result for number, data, result in checked if result is not None}
+    valid = [(number, data) for number, data, result in checked if result is None]
+
+    iterator = iter(valid)
+    while chunk := list(islice(iterator, chunk_size)):
+        emails = [data['email'] for _, data in chunk]
+        taken = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+        fresh = []
+        for number, data in chunk:
+            if data['email'] in taken:
+                results[number] = {
+                    'row': number, 'email': data['email'], 'status': 'error',
+                    'errors': {'email': ['A user with this email already exists.']},
+                }
+            else:
+                fresh.append((number, data))
+        if not fresh:
+            continue
+
+        passwords = [data['password'] for _, data in fresh]
+        hashes = hasher.hash(passwords) if hasher is not None else hash_all(passwords)
+        to_write = [(number, data, password_hash) for (number, data), password_hash in zip(fresh, hashes)]
+        try:
+            results.update(_write_chunk(to_write))
+        except IntegrityError:
+            results.update(_write_rows_one_by_one(to_write))
+
+    return [results[number] for number in sorted(results)]
+
+
+def summary(results):
+    created = sum(1 for result in results if result['status'] == 'created')
+    return {'created': created, 'failed': len(results) - created, 'results': results}
+
+
+# --------------------- jobs -------------------------------
+
+def enqueue_registration_job(rows, allowed_roles, user=None):
+    fail_stale_registration_jobs()
+    return RegistrationJob.objects.create(
+        requested_by_id=user.id if user is not None else None,
+        allowed_roles=list(allowed_roles),
+        rows=rows,
+    )
+
+
+def claim_registration_job():
+    """Mark the oldest pending job as running and return it, or None."""
+    with transaction.atomic():
+        job = (
+            RegistrationJob.objects.select_for_update(skip_locked=True)
+            .filter(status='pending').order_by('created_at').first()
+        )
+        if job is None:
+            return None
+        job.status = 'running'
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+    return job
+
+
+def run_registration_job(job, hasher=None):
+    try:
+        result = summary(register_users(job.rows, hasher=hasher, allowed_roles=job.allowed_roles))
+    except Exception as e:
+        logger.exception('registration job %s failed', job.id)
+        job.status, job.error = 'failed', str(e)
+    else:
+        job.status, job.result = 'done', result
+    # either way the passwords don't stay in the table; rows already written stay registered
+    job.rows = None
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'rows', 'finished_at'])
+    return job
+
+
+def fail_stale_registration_jobs():
+    """
+    Jobs whose worker died while running them, and jobs no worker picked up in
+    time. They aren't retried - part of the users may be registered already
+    and would come back as duplicates - and either way their passwords go.
+    """
+    now = timezone.now()
+    failed = 0
+    timeout = getattr(settings, 'REGISTRATION_JOB_TIMEOUT', None)
+    if timeout:
+        failed += RegistrationJob.objects.filter(status='running', started_at__lt=now - timeout).update(
+            status='failed', error='Worker stopped while registering, some users may be registered.',
+            rows=None, finished_at=now,
+        )
+    pending_ttl = getattr(settings, 'REGISTRATION_JOB_PENDING_TTL', None)
+    if pending_ttl:
+        failed += RegistrationJob.objects.filter(status='pending', created_at__lt=now - pending_ttl).update(
+            status='failed', error='No worker picked this upload up in time, nobody was registered.',
+            rows=None, finished_at=now,
+        )
+    return failed
@@ -0,0 +1,89 @@
+"""
+Reads from replicas for the views that opt in.
+
+ReplicaMiddleware (middleware.py) turns replica reads on for GET/HEAD/OPTIONS
+requests whose view has `use_read_replica = True` (viewsets) or is wrapped in
+@read_replica (function views). Everything else - writes, and every read
+outside those views - goes to `default`.
+
+A client that has just written something (any successful unsafe request) is
+pinned to `default` for REPLICA_PIN_SECONDS, so it reads its own writes
+while the replicas catch up. The pin lives in the default cache, keyed by
+the client's Authorization header or, without one, its IP.
+
+The replica is picked once per request, when the middleware turns replica
+reads on, and every read of that request goes to it: replicas lag by
+different amounts, and a course read from one with its lessons prefetched
+from another could come from two points in time.
+
+Replicas are the DATABASES aliases starting with "replica" (see
+DATABASE_REPLICA_HOSTS in settings); without any, this router does nothing.
+"""
+import contextvars
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+_replica = contextvars.ContextVar('replica', default=None)
+
+PIN_KEY = 'replica:pin:%s'
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+def read_replica(view):
+    """Mark a function view (put it above @api_view) as safe to serve from a replica."""
+    view.use_read_replica = True
+    return view
+
+
+def wants_replica(view_func):
+    # viewsets/API views carry the flag on their class, @read_replica views on the function
+    return getattr(view_func, 'use_read_replica', False) or getattr(
+        getattr(view_func, 'cls', None), 'use_read_replica', False
+    )
+
+
+def use_replica(alias):
+    """Send the current request's reads to replica `alias` (None = default); returns a token for reset_replica()."""
+    return _replica.set(alias)
+
+
+def reset_replica(token):
+    _replica.reset(token)
+
+
+def _client_key(request):
+    identity = request.META.get('HTTP_AUTHORIZATION') or request.META.get('REMOTE_ADDR', '')
+    return PIN_KEY % hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]
+
+
+def pin_to_primary(request):
+    cache.set(_client_key(request), 1, getattr(settings, 'REPLICA_PIN_SECONDS', 10))
+
+
+def is_pinned(request):
+    return cache.get(_client_key(request)) is not None
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.replicas = replica_aliases()
+
+    def db_for_read(self, model, **hints):
+        if self.replicas:
+            return _replica.get()
+        return None  # default (or the db of the instance in hints)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
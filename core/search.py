@@ -0,0 +1,263 @@
+"""
+Full-text search over courses (title, description, tag names) and lessons
+(title, content), ranked with BM25.
+
+The inverted index lives in three tables:
+  SearchTerm       term -> number of documents containing it (for idf)
+  SearchDocument   one row per indexed course/lesson, with its length in tokens
+  SearchPosting    (term, document) with the term's BM25 term-frequency weight
+
+A query reads the postings of each query term in weight order (index on
+(term, -weight)) and only the top SEARCH_POSTINGS_PER_TERM of them, so its
+cost doesn't grow with the size of the catalog and there is no
+LIKE '%term%' scan. Signals (signals.py) keep the index current;
+`manage.py rebuild_search_index` rebuilds it from scratch.
+
+Reindexing a document locks its SearchDocument row first, so two saves of
+the same course serialize instead of both counting the old postings. Two
+saves of a document that isn't indexed yet can still collide on the
+(doc_type, object_id) unique key (or deadlock on MySQL's gap locks); the
+signal hooks retry that once and otherwise log it, see signals.py.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import Course, Lesson, SearchDocument, SearchPosting, SearchTerm
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+TITLE_BOOST = 2  # title tokens are counted this many times
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 10
+DOC_COUNT_KEY = 'search:doc_count'
+TOKEN_COUNT_KEY = 'search:token_count'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+STOP_WORDS = frozenset('''
+    a an and are as at be but by for from has have in into is it its of on or
+    that the their then there these this to was were will with you your
+'''.split())
+
+
+def tokenize(text):
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in TOKEN_RE.findall((text or '').lower())
+        if len(token) > 1 and token not in STOP_WORDS
+    ]
+
+
+def term_weight(frequency, length, avg_length):
+    """BM25 term-frequency part; the idf is applied at query time."""
+    norm = K1 * (1 - B + B * length / avg_length) if avg_length else K1
+    return frequency * (K1 + 1) / (frequency + norm)
+
+
+def get_stats():
+    """(number of documents, average document length)."""
+    counts = cache.get_many([DOC_COUNT_KEY, TOKEN_COUNT_KEY])
+    if len(counts) < 2:
+        row = SearchDocument.objects.aggregate(total=Count('id'), tokens=Sum('length'))
+        counts = {DOC_COUNT_KEY: row['total'] or 0, TOKEN_COUNT_KEY: row['tokens'] or 0}
+        # kept up to date by _adjust_stats, the timeout only resyncs drift now and then
+        cache.set_many(counts, 24 * 3600)
+    total = counts[DOC_COUNT_KEY]
+    return total, (counts[TOKEN_COUNT_KEY] / total if total > 0 else 0.0)
+
+
+def _adjust_stats(documents, tokens):
+    def adjust():
+        try:
+            cache.incr(DOC_COUNT_KEY, documents)
+            cache.incr(TOKEN_COUNT_KEY, tokens)
+        except ValueError:
+            # not cached right now, get_stats() counts from scratch
+            cache.delete_many([DOC_COUNT_KEY, TOKEN_COUNT_KEY])
+    transaction.on_commit(adjust)
+
+
+# --------------------- building documents -------------------------------
+
+def course_documents(course_ids):
+    """(doc_type, object_id, course_id, title, token counts) for the given courses."""
+    docs = []
+    for course in Course.objects.filter(id__in=course_ids).prefetch_related('tags'):
+        tokens = Counter(tokenize(course.title) * TITLE_BOOST)
+        tokens.update(tokenize(course.description))
+        for tag in course.tags.all():
+            tokens.update(tokenize(tag.name))
+        docs.append(('course', course.id, course.id, course.title, tokens))
+    return docs
+
+
+def lesson_documents(lesson_ids):
+    docs = []
+    lessons = Lesson.objects.filter(id__in=lesson_ids).only('id', 'course_id', 'title', 'content')
+    for lesson in lessons:
+        tokens = Counter(tokenize(lesson.title) * TITLE_BOOST)
+        tokens.update(tokenize(lesson.content))
+        docs.append(('lesson', lesson.id, lesson.course_id, lesson.title, tokens))
+    return docs
+
+
+# --------------------- writing the index -------------------------------
+
+def _change_document_frequencies(deltas):
+    # one UPDATE per distinct delta, which is a handful even for big batches
+    by_delta = defaultdict(list)
+    for term, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(term)
+    for delta, terms in by_delta.items():
+        SearchTerm.objects.filter(term__in=terms).update(document_frequency=F('document_frequency') + delta)
+
+
+def _lock(doc_type, object_ids):
+    # first statement of the transaction: a concurrent reindex of the same documents waits
+    # here until the other one commits, and then reads its postings instead of stale ones
+    list(
+        SearchDocument.objects.select_for_update()
+        .filter(doc_type=doc_type, object_id__in=object_ids)
+        .values_list('id', flat=True)
+    )
+
+
+def _remove(doc_type, object_ids):
+    docs = SearchDocument.objects.filter(doc_type=doc_type, object_id__in=object_ids)
+    old_terms = Counter(
+        SearchPosting.objects.filter(document__in=docs).values_list('term', flat=True)
+    )
+    removed = docs.aggregate(total=Count('id'), tokens=Sum('length'))
+    if removed['total']:
+        docs.delete()  # postings go with them
+        _adjust_stats(-removed['total'], -(removed['tokens'] or 0))
+    return old_terms
+
+
+def index_documents(docs):
+    """(Re)index documents built by course_documents()/lesson_documents()."""
+    if not docs:
+        return
+    _, avg_length = get_stats()
+
+    with transaction.atomic():
+        by_type = defaultdict(list)
+        for doc in docs:
+            by_type[doc[0]].append(doc[1])
+        for doc_type, object_ids in by_type.items():
+            _lock(doc_type, object_ids)
+
+        deltas = Counter()
+        for doc_type, object_ids in by_type.items():
+            deltas.subtract(_remove(doc_type, object_ids))
+
+        SearchDocument.objects.bulk_create([
+            SearchDocument(
+                doc_type=doc_type, object_id=object_id, course_id=course_id,
+                title=title[:255], length=sum(tokens.values()),
+            )
+            for doc_type, object_id, course_id, title, tokens in docs
+        ])
+        # MySQL doesn't hand back ids from bulk_create
+        doc_ids = {
+            (doc_type, object_id): doc_id
+            for doc_id, doc_type, object_id in SearchDocument.objects.filter(
+                object_id__in=[doc[1] for doc in docs]
+            ).values_list('id', 'doc_type', 'object_id')
+        }
+
+        postings = []
+        for doc_type, object_id, _, _, tokens in docs:
+            length = sum(tokens.values())
+            for term, frequency in tokens.items():
+                deltas[term] += 1
+                postings.append(SearchPosting(
+                    term=term,
+                    document_id=doc_ids[(doc_type, object_id)],
+                    frequency=frequency,
+                    doc_length=length,
+                    weight=term_weight(frequency, length, avg_length or length),
+                ))
+
+        new_terms = [term for term, delta in deltas.items() if delta > 0]
+        SearchTerm.objects.bulk_create(
+            [SearchTerm(term=term, document_frequency=0) for term in new_terms],
+            ignore_conflicts=True,
+        )
+        _change_document_frequencies(deltas)
+        SearchPosting.objects.bulk_create(postings, batch_size=2000)
+        _adjust_stats(len(docs), sum(sum(doc[4].values()) for doc in docs))
+
+
+def remove_documents(doc_type, object_ids):
+    with transaction.atomic():
+        _lock(doc_type, object_ids)
+        deltas = Counter()
+        deltas.subtract(_remove(doc_type, object_ids))
+        _change_document_frequencies(deltas)
+
+
+def index_courses(course_ids):
+    index_documents(course_documents(course_ids))
+
+
+def index_lessons(lesson_ids):
+    index_documents(lesson_documents(lesson_ids))
+
+
+def reweight_postings():
+    """Recompute every posting weight against the current average document length."""
+    cache.delete_many([DOC_COUNT_KEY, TOKEN_COUNT_KEY])
+    _, avg_length = get_stats()
+    if not avg_length:
+        return
+    norm = K1 * (1 - B) + K1 * B * F('doc_length') / avg_length
+    SearchPosting.objects.update(weight=F('frequency') * (K1 + 1) / (F('frequency') + norm))
+
+
+# --------------------- querying -------------------------------
+
+def search(query, doc_type=None, limit=20):
+    """[{'type', 'id', 'course_id', 'title', 'score'}, ...] best first."""
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return []
+
+    total, _ = get_stats()
+    frequencies = dict(
+        SearchTerm.objects.filter(term__in=terms, document_frequency__gt=0)
+        .values_list('term', 'document_frequency')
+    )
+    per_term = getattr(settings, 'SEARCH_POSTINGS_PER_TERM', 1000)
+
+    scores = defaultdict(float)
+    for term, df in frequencies.items():
+        idf = math.log(1 + (max(total, df) - df + 0.5) / (df + 0.5))
+        postings = SearchPosting.objects.filter(term=term)
+        if doc_type:
+            postings = postings.filter(document__doc_type=doc_type)
+        for document_id, weight in postings.order_by('-weight').values_list('document_id', 'weight')[:per_term]:
+            scores[document_id] += idf * weight
+
+    best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+    docs = SearchDocument.objects.in_bulk([document_id for document_id, _ in best])
+    return [
+        {
+            'type': docs[document_id].doc_type,
+            'id': docs[document_id].object_id,
+            'course_id': docs[document_id].course_id,
+            'title': docs[document_id].title,
+            'score': round(score, 4),
+        }
+        for document_id, score in best
+        if document_id in docs
+    ]
@@ -1,17 +1,87 @@
 from rest_framework import serializers
 from .models import Course, Lesson, CourseTag, SubscribedCourse
+from .images import srcset
+from .metrics import TimedSerializerMixin
 
-class CourseTagSerializer(serializers.ModelSerializer):
+
+def query_param_set(request, name):
+    """?fields=id,title -> {'id', 'title'}; None when the param isn't given or is empty."""
+    if request is None:
+        return None
+    # DRF requests have query_params, the plain Django ones (async views) GET
+    params = getattr(request, 'query_params', request.GET)
+    # an empty ?fields= means no filter - the same for the prefetching and the serializers
+    return {value.strip() for value in params.get(name, '').split(',') if value.strip()} or None
+
+
+def course_image_srcset(serializer, course):
+    """{"webp": "url 320w, url 640w, ...", "jpeg": "..."} for <img srcset>, None until resized."""
+    if not course.image_derivatives:
+        return None
+    request = serializer.context.get('request')
+    build_url = request.build_absolute_uri if request is not None else (lambda url: url)
+    return {
+        'webp': srcset(course.image_derivatives, 'webp', build_url),
+        'jpeg': srcset(course.image_derivatives, 'jpeg', build_url),
+    }
+
+
+class DynamicFieldsMixin:
+    """
+    Sparse fieldsets for read requests:
+      ?fields=id,title      only return these fields
+      ?expand=lessons       swap a field for its heavier version (see expandable_fields)
+    Only the top-level serializer reacts, nested ones are left alone.
+    """
+    expandable_fields = {}
+
+    def _is_top_level(self):
+        root = self.root
+        return self is root or (isinstance(root, serializers.ListSerializer) and self is root.child)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method != 'GET' or not self._is_top_level():
+            return fields
+
+        for name in query_param_set(request, 'expand') or ():
+            if name in self.expandable_fields and name in fields:
+                fields[name] = self.expandable_fields[name]()
+
+        wanted = query_param_set(request, 'fields')
+        if wanted:
+            for name in set(fields) - wanted:
+                fields.pop(name)
+        return fields
+
+class CourseTagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = CourseTag
         fields = ['id', 'name']
 
-class LessonSerializer(serializers.ModelSerializer):
+class LessonSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     course = serializers.PrimaryKeyRelatedField(queryset=Course.objects.all())
     class Meta:
         model = Lesson
         fields = ['id', 'title', 'content', 'lesson_number', 'course', 'created_at']
 
+# table of contents for lesson lists; the body is fetched from /api/lessons/<id>/content/
+# (or the whole list with ?expand=content). Needs lesson_summaries() annotations.
+class LessonSummarySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    content_length = serializers.IntegerField(read_only=True)
+    content_hash = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Lesson
+        fields = ['id', 'title', 'lesson_number', 'course', 'content_length', 'content_hash', 'created_at']
+
+# lessons as listed inside a course - no content, ask for ?expand=lessons to get it
+class LessonOutlineSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Lesson
+        fields = ['id', 'title', 'lesson_number']
+
 # class CourseSerializer(serializers.ModelSerializer):
 #     lessons = LessonSerializer(many=True, read_only=True)
 #     tags = CourseTagSerializer(many=True)
@@ -21,22 +91,64 @@ class LessonSerializer(serializers.ModelSerializer):
 #         fields = ['id', 'title', 'description', 'category', 'tags', 'lessons', 'created_by', 'created_at']
 #         read_only_fields = ['created_by']
 
-class CourseSerializer(serializers.ModelSerializer):
-    lessons = LessonSerializer(many=True, read_only=True)
+class CourseSerializer(TimedSerializerMixin, DynamicFieldsMixin, serializers.ModelSerializer):
+    lessons = LessonOutlineSerializer(many=True, read_only=True)
     tags = serializers.PrimaryKeyRelatedField(
         many=True,
         queryset=CourseTag.objects.all()
     )
+    # {"webp": "url 320w, url 640w, ...", "jpeg": "..."} for <img srcset>, null until resized
+    course_image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Course
-        fields = ['id', 'title', 'description', 'category', 'tags', 'lessons', 'course_image', 'created_by', 'created_at']
+        fields = ['id', 'title', 'description', 'category', 'tags', 'lessons', 'lesson_count', 'subscriber_count', 'course_image', 'course_image_srcset', 'created_by', 'created_at']
         read_only_fields = ['created_by']
 
+    def get_course_image_srcset(self, course):
+        return course_image_srcset(self, course)
+
+    def update(self, instance, validated_data):
+        # ModelSerializer.update, but saved with save_edits() so the counters are left alone
+        tags = validated_data.pop('tags', None)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save_edits()
+        if tags is not None:
+            instance.tags.set(tags)
+        return instance
+
+    expandable_fields = {
+        'lessons': lambda: LessonSerializer(many=True, read_only=True),
+    }
 
-class SubscribedCourseSerializer(serializers.ModelSerializer):
+
+class SubscribedCourseSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = SubscribedCourse
         fields = ['id', 'student', 'course', 'subscribed_at']
         read_only_fields = ['student', 'subscribed_at']
 
+
+# --------------------- dashboard -------------------------------
+
+# a course as a card on the student dashboard: no description, tags or lessons
+class CourseCardSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    course_image_srcset = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Course
+        fields = ['id', 'title', 'category', 'lesson_count', 'subscriber_count', 'course_image', 'course_image_srcset']
+
+    def get_course_image_srcset(self, course):
+        return course_image_srcset(self, course)
+
+
+# expects the subscribed_at/completed_lessons/next_lesson attributes set by the dashboard view
+class SubscribedCourseCardSerializer(CourseCardSerializer):
+    subscribed_at = serializers.DateTimeField(read_only=True)
+    completed_lessons = serializers.IntegerField(read_only=True)
+    next_lesson = serializers.DictField(read_only=True, allow_null=True)
+
+    class Meta(CourseCardSerializer.Meta):
+        fields = CourseCardSerializer.Meta.fields + ['subscribed_at', 'completed_lessons', 'next_lesson']
@@ -0,0 +1,204 @@
+import logging
+
+from django.db import DatabaseError, transaction
+from django.db.models.signals import post_save, post_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+
+from .models import Course, CourseTag, Lesson, SubscribedCourse
+from . import recommendations
+from .cache import bump_version
+from . import search
+from .counters import change_counter
+
+logger = logging.getLogger(__name__)
+
+
+def _index():
+    # only touch the index if this process has already built it; an unbuilt
+    # index reads everything fresh on first use anyway
+    return recommendations._index
+
+
+# --------------------- recommendation index -------------------------------
+
+@receiver(post_save, sender=Course)
+def course_saved(sender, instance, **kwargs):
+    course_id, category = instance.id, instance.category
+    transaction.on_commit(lambda: _index().upsert_course(course_id, category))
+
+
+@receiver(post_delete, sender=Course)
+def course_deleted(sender, instance, **kwargs):
+    course_id = instance.id
+    transaction.on_commit(lambda: _index().remove_course(course_id))
+
+
+@receiver(post_delete, sender=CourseTag)
+def tag_deleted(sender, instance, **kwargs):
+    tag_id = instance.id
+    transaction.on_commit(lambda: _index().remove_tag(tag_id))
+
+
+@receiver(m2m_changed, sender=Course.tags.through)
+def course_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    index = _index()
+
+    if action == 'post_clear':
+        if reverse:
+            # tag.courses.clear() doesn't tell us which courses lost the tag
+            transaction.on_commit(index.invalidate)
+        else:
+            course_id = instance.id
+            transaction.on_commit(lambda: index.clear_course_tags(course_id))
+        return
+
+    added = action == 'post_add'
+    pks = set(pk_set or ())
+    if reverse:
+        tag_id = instance.id
+        transaction.on_commit(lambda: [index.set_course_tags(course_id, [tag_id], added) for course_id in pks])
+    else:
+        course_id = instance.id
+        transaction.on_commit(lambda: index.set_course_tags(course_id, pks, added))
+
+
+@receiver(post_save, sender=SubscribedCourse)
+def subscription_saved(sender, instance, created, **kwargs):
+    if created:
+        course_id = instance.course_id
+        transaction.on_commit(lambda: _index().add_subscribers(course_id, 1))
+
+
+@receiver(post_delete, sender=SubscribedCourse)
+def subscription_deleted(sender, instance, **kwargs):
+    course_id = instance.course_id
+    transaction.on_commit(lambda: _index().add_subscribers(course_id, -1))
+
+
+# --------------------- course counters -------------------------------------
+# not deferred to on_commit: the F() update belongs to the same transaction as the row
+
+@receiver(post_save, sender=SubscribedCourse)
+def count_subscription_saved(sender, instance, created, **kwargs):
+    if created:
+        change_counter(instance.course_id, 'subscriber_count', 1)
+
+
+@receiver(post_delete, sender=SubscribedCourse)
+def count_subscription_deleted(sender, instance, **kwargs):
+    change_counter(instance.course_id, 'subscriber_count', -1)
+
+
+@receiver(pre_save, sender=Lesson)
+def count_lesson_moving(sender, instance, update_fields=None, **kwargs):
+    if not instance._state.adding and (update_fields is None or 'course' in update_fields):
+        instance._counted_course_id = (
+            Lesson.objects.filter(pk=instance.pk).values_list('course_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Lesson)
+def count_lesson_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_counted_course_id', None)
+    if created:
+        change_counter(instance.course_id, 'lesson_count', 1)
+    elif previous is not None and previous != instance.course_id:
+        change_counter(previous, 'lesson_count', -1)
+        change_counter(instance.course_id, 'lesson_count', 1)
+    instance._counted_course_id = instance.course_id
+
+
+@receiver(post_delete, sender=Lesson)
+def count_lesson_deleted(sender, instance, **kwargs):
+    change_counter(instance.course_id, 'lesson_count', -1)
+
+
+# --------------------- catalog response cache -----------------------------
+
+# model -> cache versions that change with it (see CatalogCacheMixin.cache_dependencies)
+CATALOG_VERSIONS = {
+    Course: ('course',),
+    Lesson: ('lesson',),
+    CourseTag: ('coursetag',),
+}
+
+
+def _bump_catalog(*names):
+    transaction.on_commit(lambda: [bump_version(name) for name in names])
+
+
+def catalog_row_changed(sender, **kwargs):
+    _bump_catalog(*CATALOG_VERSIONS[sender])
+
+
+for _model in CATALOG_VERSIONS:
+    post_save.connect(catalog_row_changed, sender=_model, dispatch_uid=f'catalog_save_{_model.__name__}')
+    post_delete.connect(catalog_row_changed, sender=_model, dispatch_uid=f'catalog_delete_{_model.__name__}')
+
+
+@receiver(m2m_changed, sender=Course.tags.through)
+def catalog_course_tags_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _bump_catalog('course')
+
+
+# --------------------- search index ---------------------------------------
+
+def _search_on_commit(func, *args):
+    # the request's own write has committed by now, so a lost indexing race (see search.py)
+    # must not turn it into a 500: try once more against the committed state, then log
+    def run():
+        for attempt in range(2):
+            try:
+                func(*args)
+                return
+            except DatabaseError:
+                if attempt:
+                    logger.exception('search index update %s%r failed', func.__name__, args)
+    transaction.on_commit(run)
+
+
+@receiver(post_save, sender=Course)
+def search_course_saved(sender, instance, **kwargs):
+    _search_on_commit(search.index_courses, [instance.id])
+
+
+@receiver(post_delete, sender=Course)
+def search_course_deleted(sender, instance, **kwargs):
+    _search_on_commit(search.remove_documents, 'course', [instance.id])
+
+
+@receiver(post_save, sender=Lesson)
+def search_lesson_saved(sender, instance, **kwargs):
+    _search_on_commit(search.index_lessons, [instance.id])
+
+
+@receiver(post_delete, sender=Lesson)
+def search_lesson_deleted(sender, instance, **kwargs):
+    _search_on_commit(search.remove_documents, 'lesson', [instance.id])
+
+
+@receiver(post_save, sender=CourseTag)
+def search_tag_saved(sender, instance, created, **kwargs):
+    if not created:
+        # renamed: courses with this tag index its name
+        _search_on_commit(search.index_courses, list(instance.courses.values_list('id', flat=True)))
+
+
+@receiver(m2m_changed, sender=Course.tags.through)
+def search_course_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # remember the courses before the rows are gone
+        instance._search_course_ids = list(instance.courses.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        course_ids = [instance.id]
+    elif action == 'post_clear':
+        course_ids = getattr(instance, '_search_course_ids', [])
+    else:
+        course_ids = list(pk_set or ())
+    _search_on_commit(search.index_courses, course_ids)
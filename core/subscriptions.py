@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .models import Course, SubscribedCourse
+from . import recommendations
+from .counters import refresh_course_counters
+
+SUBSCRIBED = 'subscribed'
+ALREADY_SUBSCRIBED = 'already_subscribed'
+NOT_FOUND = 'not_found'
+
+
+def subscribe_student(student_id, course_ids):
+    """
+    Subscribe a student to several courses: one SELECT and one INSERT, whatever
+    the number of courses. Returns {course_id: SUBSCRIBED | ALREADY_SUBSCRIBED | NOT_FOUND}.
+
+    The insert ignores conflicts on (student, course), so a double click or
+    two tabs racing each other can't blow up on the unique constraint.
+    """
+    course_ids = list(dict.fromkeys(course_ids))
+    found = dict(
+        Course.objects.filter(id__in=course_ids)
+        .annotate(subscribed=Exists(
+            SubscribedCourse.objects.filter(student_id=student_id, course_id=OuterRef('pk'))
+        ))
+        .values_list('id', 'subscribed')
+    )
+
+    results = {}
+    new_ids = []
+    for course_id in course_ids:
+        if course_id not in found:
+            results[course_id] = NOT_FOUND
+        elif found[course_id]:
+            results[course_id] = ALREADY_SUBSCRIBED
+        else:
+            results[course_id] = SUBSCRIBED
+            new_ids.append(course_id)
+
+    if new_ids:
+        SubscribedCourse.objects.bulk_create(
+            [SubscribedCourse(student_id=student_id, course_id=course_id) for course_id in new_ids],
+            ignore_conflicts=True,
+        )
+        # recount rather than +1: a racing request may have inserted some of these rows
+        refresh_course_counters(new_ids, ['subscriber_count'])
+        # bulk_create sends no post_save, keep the recommendation popularity in step by hand -
+        # with the recounted totals, as the insert doesn't say which rows it actually added
+        counts = dict(Course.objects.filter(id__in=new_ids).values_list('id', 'subscriber_count'))
+        index = recommendations._index
+        transaction.on_commit(lambda: index.set_subscribers(counts))
+
+    return results
@@ -1,3 +1,1420 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.db.models import Value
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .ai import StubBackend, evict_questions, generate_questions_for
+from .authentication import EduLearnTokenObtainPairSerializer
+from .course_questions import chunk_text, generate_course_questions, merge_results, stored_course_questions
+from .images import DERIVED_DIR, build_derivatives
+from .jobs import claim_jobs, enqueue_course_question_job, enqueue_question_job, requeue_stale_jobs, run_job
+from .management.commands.bench import QueryCounter, percentile
+from .management.commands.startup_profile import parse_importtime
+from .middleware import ReplicaMiddleware
+from .models import Course, CourseNeighbor, CourseTag, Educator, GeneratedQuestionSet, Lesson, LessonProgress, LessonQuestions, QuestionGenerationJob, RegistrationJob, SearchDocument, SearchTerm, Student, SubscribedCourse, User, lesson_content_hash
+from .progress import progress_buffer
+from .registration import claim_registration_job, enqueue_registration_job, fail_stale_registration_jobs, register_users, run_registration_job
+from .recommendations import RecommendationIndex, invalidate_recommendation_index
+from .serializers import CourseCardSerializer
+from .subscriptions import subscribe_student
+from . import ai, cooccurrence, metrics, parallel, progress, recommendations, roster, routers, search, throttling
+
+# the real hashers are slow on purpose, tests create a lot of users
+fast_hashing = override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+
+
+def make_user(email, role='student', password='pw', **extra):
+    user = User.objects.create_user(email=email, password=password, role=role, **extra)
+    profile_model = Student if role == 'student' else Educator
+    profile_model.objects.create(user=user, full_name=email.split('@')[0])
+    return user
+
+
+def make_course(title, category='programming', tags=(), created_by=None, description=None, **extra):
+    course = Course.objects.create(title=title, description=description or f'About {title}.', category=category,
+                                   created_by=created_by, **extra)
+    if tags:
+        course.tags.add(*tags)
+    return course
+
+
+@fast_hashing
+class APITestBase(APITestCase):
+    """Clears the process-wide caches every test would otherwise share."""
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        invalidate_recommendation_index()
+
+    def authenticate(self, user):
+        token = EduLearnTokenObtainPairSerializer.get_token(user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token.access_token}')
+
+
+# --------------------- user-001: recommendations -------------------------------
+
+class RecommendationIndexTests(TestCase):
+    def setUp(self):
+        self.python, self.django, self.css = (CourseTag.objects.create(name=name) for name in ('python', 'django', 'css'))
+        self.intro = make_course('Intro', tags=[self.python])
+        self.web = make_course('Web', tags=[self.python, self.django])
+        self.more_web = make_course('More web', tags=[self.python, self.django])
+        self.other = make_course('Other', tags=[self.python])
+        self.design = make_course('Design', category='design', tags=[self.css])
+        self.index = RecommendationIndex()
+        self.index.build()
+
+    def test_same_category_ranked_by_shared_tags(self):
+        self.assertEqual(self.index.recommend([self.web.id], limit=2), [self.more_web.id, self.intro.id])
+
+    def test_topped_up_with_popular_courses(self):
+        self.index.add_subscribers(self.design.id, 5)
+        recommended = self.index.recommend([self.intro.id], limit=5, per_course=1)
+        self.assertEqual(recommended[:2], [self.web.id, self.design.id])
+        self.assertNotIn(self.intro.id, recommended)
+
+    def test_incremental_updates(self):
+        self.index.set_course_tags(self.other.id, [self.django.id])
+        self.assertEqual(self.index.recommend([self.web.id], limit=1), [self.more_web.id])
+        self.index.remove_course(self.more_web.id)
+        self.assertEqual(self.index.recommend([self.web.id], limit=1), [self.other.id])
+        self.index.upsert_course(self.design.id, 'programming')
+        self.assertIn(self.design.id, self.index.recommend([self.web.id], limit=5))
+
+
+class RecommendedCoursesViewTests(APITestBase):
+    def test_recommends_similar_courses(self):
+        python = CourseTag.objects.create(name='python')
+        taken = make_course('Taken', tags=[python])
+        similar = make_course('Similar', tags=[python])
+        make_course('Elsewhere', category='design')
+        student = make_user('s@example.com')
+        SubscribedCourse.objects.create(student=student.student, course=taken)
+        self.authenticate(student)
+
+        response = self.client.get('/api/recommended-courses/')
+        self.assertEqual(response.status_code, 200)
+        ids = [course['id'] for course in response.data]
+        self.assertEqual(ids[0], similar.id)
+        self.assertNotIn(taken.id, ids)
+
+    def test_requires_subscriptions(self):
+        self.authenticate(make_user('s@example.com'))
+        self.assertEqual(self.client.get('/api/recommended-courses/').status_code, 404)
+
+
+# --------------------- user-002: ?fields= / ?expand= -------------------------------
+
+class CourseFieldsTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.tag = CourseTag.objects.create(name='python')
+        for number in range(3):
+            self.add_course(number)
+
+    def add_course(self, number):
+        course = make_course(f'Course {number}', tags=[self.tag])
+        Lesson.objects.create(course=course, title='One', content='lesson body', lesson_number=1)
+        return course
+
+    def count_queries(self, url):
+        for cache in caches.all():
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.data['results']
+
+    def test_sparse_fieldset(self):
+        _, results = self.count_queries('/api/courses/?fields=id,title')
+        self.assertEqual({frozenset(course) for course in results}, {frozenset({'id', 'title'})})
+
+    def test_expand_lessons_includes_content(self):
+        _, results = self.count_queries('/api/courses/?expand=lessons')
+        self.assertEqual(results[0]['lessons'][0]['content'], 'lesson body')
+        _, results = self.count_queries('/api/courses/')
+        self.assertNotIn('content', results[0]['lessons'][0])
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        for url in ('/api/courses/', '/api/courses/?fields=', '/api/courses/?fields=%20,', '/api/courses/?expand=lessons'):
+            with self.subTest(url=url):
+                before, _ = self.count_queries(url)
+                extra = [self.add_course(10 + number) for number in range(3)]
+                after, results = self.count_queries(url)
+                self.assertEqual(before, after)
+                self.assertIn('tags', results[0])
+                Course.objects.filter(id__in=[course.id for course in extra]).delete()
+
+
+# --------------------- user-003: keyset pagination -------------------------------
+
+class KeysetPaginationTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.courses = [make_course(f'Course {number}') for number in range(5)]
+        # ties on created_at must be broken by id
+        Course.objects.filter(id__in=[course.id for course in self.courses[1:4]]).update(
+            created_at=self.courses[1].created_at
+        )
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_walks_every_row_once_forwards_and_back(self):
+        seen, pages = [], []
+        page = self.get('/api/courses/?page_size=2&fields=id')
+        while True:
+            pages.append(page)
+            seen += [course['id'] for course in page['results']]
+            if not page['next']:
+                break
+            page = self.get(page['next'])
+        self.assertEqual(seen, [course.id for course in self.courses])
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['previous'])
+
+        back = self.get(pages[-1]['previous'])
+        self.assertEqual(back['results'], pages[1]['results'])
+        self.assertIsNotNone(back['next'])
+
+    def test_page_size_is_capped(self):
+        with override_settings(PAGINATION_MAX_PAGE_SIZE=3):
+            self.assertEqual(len(self.get('/api/courses/?page_size=50')['results']), 3)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/courses/?cursor=garbage').status_code, 404)
+
+
+# --------------------- user-004: catalog cache -------------------------------
+
+class CatalogCacheTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.course = make_course('Cached')
+
+    def test_etag_and_304(self):
+        for url in ('/api/courses/', f'/api/courses/{self.course.id}/'):
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                self.assertEqual(first.status_code, 200)
+                etag = first['ETag']
+                with self.assertNumQueries(0):
+                    second = self.client.get(url, HTTP_IF_NONE_MATCH=f'W/{etag}')
+                self.assertEqual(second.status_code, 304)
+                self.assertEqual(second['ETag'], etag)
+
+    def test_write_makes_entries_unreachable(self):
+        url = f'/api/courses/{self.course.id}/'
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Course.objects.filter(id=self.course.id).update(title='Renamed')
+            self.course.refresh_from_db()
+            self.course.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Renamed')
+
+    def test_authenticated_reads_bypass_the_cache(self):
+        self.client.get('/api/courses/')
+        self.authenticate(make_user('s@example.com'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/courses/').status_code, 200)
+        self.assertGreater(len(queries), 0)
+
+
+# --------------------- user-005: question cache -------------------------------
+
+class CountingBackend(StubBackend):
+    name = 'counting'
+    calls = 0
+
+    def generate(self, prompt):
+        CountingBackend.calls += 1
+        return super().generate(prompt)
+
+
+@override_settings(QUESTION_GENERATION_BACKEND='core.tests.CountingBackend')
+class QuestionCacheTests(TestCase):
+    def setUp(self):
+        CountingBackend.calls = 0
+
+    def test_same_content_is_generated_once(self):
+        first = generate_questions_for('Photosynthesis   turns light\ninto sugar.')
+        second = generate_questions_for('Photosynthesis turns light into sugar.')
+        self.assertEqual(first, second)
+        self.assertEqual(len(first['questions']), 3)
+        self.assertEqual(CountingBackend.calls, 1)
+        generate_questions_for('Something else.')
+        self.assertEqual(CountingBackend.calls, 2)
+
+    def test_expired_entries_are_regenerated(self):
+        generate_questions_for('Old content.')
+        GeneratedQuestionSet.objects.update(created_at=timezone.now() - timedelta(days=365))
+        generate_questions_for('Old content.')
+        self.assertEqual(CountingBackend.calls, 2)
+
+    @override_settings(QUESTION_CACHE_MAX_ENTRIES=2)
+    def test_eviction_drops_least_recently_used(self):
+        for number in range(4):
+            generate_questions_for(f'Lesson {number}.')
+        self.assertEqual(GeneratedQuestionSet.objects.count(), 4)  # stores don't count the table
+        now = timezone.now()
+        for number, entry in enumerate(GeneratedQuestionSet.objects.order_by('id')):
+            GeneratedQuestionSet.objects.filter(pk=entry.pk).update(last_used_at=now - timedelta(hours=number))
+
+        self.assertEqual(evict_questions(), 2)
+        self.assertEqual(evict_questions(), 0)
+        generate_questions_for('Lesson 0.')
+        generate_questions_for('Lesson 1.')
+        self.assertEqual(CountingBackend.calls, 4)
+
+
+# --------------------- user-006: question jobs -------------------------------
+
+class FailingBackend(StubBackend):
+    name = 'failing'
+
+    def generate(self, prompt):
+        raise RuntimeError('model unavailable')
+
+
+@override_settings(QUESTION_GENERATION_BACKEND='core.tests.CountingBackend', THROTTLES={})
+class QuestionJobTests(APITestBase):
+    def test_queued_job_is_run_by_a_worker(self):
+        response = self.client.post('/api/generate-questions/', {'lesson_content': 'Cells divide.'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        again = self.client.post('/api/generate-questions/', {'lesson_content': 'Cells  divide.'}, format='json')
+        self.assertEqual(again.json()['job_id'], job_id)
+
+        [job] = claim_jobs(5)
+        self.assertEqual((job.status, job.attempts), ('running', 1))
+        self.assertEqual(claim_jobs(5), [])
+        run_job(job)
+
+        status_response = self.client.get(f'/api/generate-questions/{job_id}/')
+        self.assertEqual(status_response.data['status'], 'done')
+        self.assertEqual(len(status_response.data['result']['mcqs']), 3)
+        # answered from the cache from now on
+        cached = self.client.post('/api/generate-questions/', {'lesson_content': 'Cells divide.'}, format='json')
+        self.assertEqual(cached.status_code, 200)
+
+    def test_only_the_requester_reads_a_lesson_job(self):
+        self.authenticate(make_user('a@example.com'))
+        job_id = self.client.post('/api/generate-questions/', {'lesson_content': 'Mine.'}, format='json').json()['job_id']
+        self.assertEqual(self.client.get(f'/api/generate-questions/{job_id}/').status_code, 200)
+
+        self.authenticate(make_user('b@example.com'))
+        self.assertEqual(self.client.get(f'/api/generate-questions/{job_id}/').status_code, 404)
+        # the same content gets a job of its own
+        other = self.client.post('/api/generate-questions/', {'lesson_content': 'Mine.'}, format='json').json()['job_id']
+        self.assertNotEqual(other, job_id)
+        self.client.credentials()
+        self.assertEqual(self.client.get(f'/api/generate-questions/{job_id}/').status_code, 404)
+
+    def test_lesson_content_is_required(self):
+        self.assertEqual(self.client.post('/api/generate-questions/', {}, format='json').status_code, 400)
+
+    @override_settings(QUESTION_GENERATION_BACKEND='core.tests.FailingBackend', QUESTION_JOB_MAX_ATTEMPTS=2)
+    def test_failed_jobs_are_retried_then_given_up(self):
+        job = enqueue_question_job('Broken.')
+        with self.assertLogs('core.jobs', 'WARNING'):
+            run_job(claim_jobs(1)[0])
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+        with self.assertLogs('core.jobs', 'WARNING'):
+            run_job(claim_jobs(1)[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('failed', 'model unavailable'))
+
+    @override_settings(QUESTION_JOB_TIMEOUT=timedelta(minutes=5))
+    def test_stale_running_jobs_are_requeued(self):
+        job = enqueue_question_job('Stuck.')
+        claim_jobs(1)
+        QuestionGenerationJob.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+
+
+# --------------------- user-007: import_catalog -------------------------------
+
+class ImportCatalogTests(TestCase):
+    def write(self, suffix, text):
+        f = tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8')
+        with f:
+            f.write(text)
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def test_jsonl_import_is_idempotent(self):
+        path = self.write('.jsonl', '\n'.join(json.dumps(record) for record in [
+            {'title': 'Algebra', 'category': 'math', 'tags': ['math', 'basics'],
+             'lessons': [{'lesson_number': 1, 'title': 'Sums', 'content': 'adding numbers'}]},
+            {'title': 'Geometry', 'category': 'math', 'tags': ['math'], 'lessons': []},
+        ]))
+        call_command('import_catalog', path, batch_size=1, stdout=io.StringIO())
+        call_command('import_catalog', path, stdout=io.StringIO())
+
+        self.assertEqual(Course.objects.count(), 2)
+        self.assertEqual(CourseTag.objects.count(), 2)
+        algebra = Course.objects.get(title='Algebra')
+        self.assertEqual(algebra.lessons.count(), 1)
+        self.assertEqual(algebra.lesson_count, 1)
+        self.assertEqual({tag.name for tag in algebra.tags.all()}, {'math', 'basics'})
+        self.assertEqual(search.search('adding')[0]['id'], algebra.lessons.get().id)
+
+    def test_csv_rows_of_one_course_are_merged(self):
+        path = self.write('.csv', (
+            'title,description,category,tags,lesson_number,lesson_title,lesson_content\n'
+            'Chemistry,atoms,science,lab;science,1,Atoms,protons\n'
+            'Chemistry,atoms,science,lab;science,2,Bonds,electrons\n'
+        ))
+        call_command('import_catalog', path, stdout=io.StringIO())
+        course = Course.objects.get()
+        self.assertEqual(list(course.lessons.values_list('lesson_number', flat=True)), [1, 2])
+        self.assertEqual(course.lesson_count, 2)
+
+    def test_bad_lesson_numbers_name_their_row(self):
+        path = self.write('.csv', (
+            'title,lesson_number,lesson_title,lesson_content\n'
+            'Chemistry,1,Atoms,protons\n'
+            'Chemistry,two,Bonds,electrons\n'
+        ))
+        with self.assertRaisesMessage(CommandError, f"{path}:3: lesson_number must be a whole number, got 'two'"):
+            call_command('import_catalog', path, stdout=io.StringIO())
+
+        path = self.write('.jsonl', '{"title": "X", "lessons": [{"lesson_number": null}]}\n')
+        with self.assertRaisesMessage(CommandError, f'{path}:1: lesson_number'):
+            call_command('import_catalog', path, stdout=io.StringIO())
+
+    def test_unknown_creator(self):
+        path = self.write('.jsonl', '{"title": "X"}\n')
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', path, created_by='nobody@example.com', stdout=io.StringIO())
+
+
+# --------------------- user-008: batch subscribe -------------------------------
+
+class SubscribeTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.student = make_user('s@example.com')
+        self.courses = [make_course(f'Course {number}') for number in range(3)]
+        self.authenticate(self.student)
+
+    def test_batch_subscribe(self):
+        ids = [course.id for course in self.courses]
+        SubscribedCourse.objects.create(student=self.student.student, course=self.courses[0])
+        with self.assertNumQueries(4):  # lookup, insert, counter refresh, read back for the index
+            response = self.client.post('/api/subscribe/', {'course_ids': ids[1:] + [ids[0], 999999, ids[1]]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {
+            'subscribed': ids[1:], 'already_subscribed': [ids[0]], 'not_found': [999999],
+        })
+        self.assertEqual(SubscribedCourse.objects.filter(student=self.student.student).count(), 3)
+
+        again = self.client.post('/api/subscribe/', {'course_ids': ids}, format='json')
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data['already_subscribed'], ids)
+
+    def test_single_subscribe(self):
+        url = f'/api/subscribe/{self.courses[0].id}/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.client.post('/api/subscribe/999999/').status_code, 404)
+
+    def test_validation_and_roles(self):
+        self.assertEqual(self.client.post('/api/subscribe/', {'course_ids': []}, format='json').status_code, 400)
+        self.authenticate(make_user('e@example.com', role='educator'))
+        self.assertEqual(self.client.post('/api/subscribe/', {'course_ids': [1]}, format='json').status_code, 403)
+
+
+# --------------------- user-009: claims authentication -------------------------------
+
+@override_settings(THROTTLES={})
+class ClaimsAuthenticationTests(APITestBase):
+    def login(self, email, password='pw'):
+        response = self.client.post('/api/auth/login/', {'email': email, 'password': password}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def profile(self, access):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        return self.client.get('/api/auth/profile/')
+
+    def test_requests_are_authenticated_from_the_claims(self):
+        user = make_user('ada@example.com')
+        tokens = self.login('ada@example.com')
+        with self.assertNumQueries(0):
+            response = self.profile(tokens['access'])
+        self.assertEqual(response.json(), {'id': user.id, 'email': 'ada@example.com', 'name': 'ada', 'role': 'student'})
+
+    def test_refresh_reloads_the_claims(self):
+        user = make_user('ada@example.com')
+        tokens = self.login('ada@example.com')
+        Student.objects.filter(user=user).update(full_name='Ada Lovelace')
+
+        self.client.credentials()
+        refreshed = self.client.post('/api/auth/token/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(refreshed.status_code, 200)
+        self.assertEqual(self.profile(refreshed.data['access']).json()['name'], 'Ada Lovelace')
+        # the rotated refresh token carries the new claims too
+        self.assertEqual(RefreshToken(refreshed.data['refresh'])['name'], 'Ada Lovelace')
+        # and the old one was blacklisted by the rotation
+        reused = self.client.post('/api/auth/token/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(reused.status_code, 401)
+
+    def test_refresh_for_a_deleted_user(self):
+        user = make_user('ada@example.com')
+        tokens = self.login('ada@example.com')
+        user.delete()
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_tokens_without_claims_fall_back_to_the_database(self):
+        user = make_user('ada@example.com')
+        token = RefreshToken.for_user(user)
+        response = self.client.get('/api/my-courses/', HTTP_AUTHORIZATION=f'Bearer {token.access_token}')
+        self.assertEqual(response.status_code, 200)
+
+
+# --------------------- user-010: course image derivatives -------------------------------
+
+def png_upload(name='cover.png', size=(800, 400)):
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new('RGBA', size, (200, 30, 30, 128)).save(out, format='PNG')
+    return SimpleUploadedFile(name, out.getvalue(), content_type='image/png')
+
+
+class CourseImageTests(TransactionTestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        overrider = override_settings(MEDIA_ROOT=media_root, COURSE_IMAGE_WIDTHS=(320, 640, 1280))
+        overrider.enable()
+        self.addCleanup(overrider.disable)
+
+    def test_build_derivatives(self):
+        name = default_storage.save('img_courses/cover.png', png_upload())
+        derivatives = build_derivatives(name)
+        # never upscaled: 320 and 640, plus a copy at the image's own width
+        self.assertEqual(sorted(derivatives['webp'], key=int), ['320', '640', '800'])
+        self.assertEqual(derivatives, build_derivatives(name))  # same bytes, same names
+        for path in [*derivatives['webp'].values(), *derivatives['jpeg'].values()]:
+            self.assertTrue(path.startswith(DERIVED_DIR + derivatives['hash']))
+            self.assertTrue(default_storage.exists(path))
+
+    def test_upload_is_resized_by_the_backfill_not_the_request(self):
+        course = make_course('Pictured', course_image=png_upload())
+        course.refresh_from_db()
+        self.assertEqual(course.image_derivatives, {})
+
+        call_command('backfill_course_images', workers=1, stdout=io.StringIO())
+        course.refresh_from_db()
+        self.assertEqual(course.image_derivatives['source'], course.course_image.name)
+        srcset = CourseCardSerializer(course).data['course_image_srcset']
+        self.assertIn('-320.webp 320w', srcset['webp'])
+
+        out = io.StringIO()
+        call_command('backfill_course_images', workers=1, stdout=out)
+        self.assertIn('already have derivatives', out.getvalue())
+
+
+# --------------------- user-011: BM25 search -------------------------------
+
+class SearchTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.python = make_course('Python basics', description='Learn programming step by step.')
+            self.cooking = make_course('Cooking', description='Python is mentioned once in passing.')
+            self.lesson = Lesson.objects.create(course=self.cooking, title='Knives', content='Sharpen knives weekly.',
+                                                lesson_number=1)
+
+    def document_frequency(self, term):
+        return SearchTerm.objects.filter(term=term).values_list('document_frequency', flat=True).first()
+
+    def test_title_matches_rank_first(self):
+        response = self.client.get('/api/search/', {'q': 'python'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([hit['id'] for hit in response.data['results']], [self.python.id, self.cooking.id])
+        lessons = self.client.get('/api/search/', {'q': 'knives', 'type': 'lesson'}).data['results']
+        self.assertEqual([(hit['type'], hit['id'], hit['course_id']) for hit in lessons],
+                         [('lesson', self.lesson.id, self.cooking.id)])
+        self.assertEqual(self.client.get('/api/search/').status_code, 400)
+
+    def test_saves_and_deletes_keep_the_index_current(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cooking.description = 'Only food here.'
+            self.cooking.save()
+        self.assertEqual(self.document_frequency('python'), 1)
+        self.assertEqual([hit['id'] for hit in search.search('food')], [self.cooking.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.python.delete()
+        self.assertEqual(self.document_frequency('python'), 0)
+        self.assertEqual(search.search('python'), [])
+        # reindexing twice changes nothing
+        search.index_courses([self.cooking.id])
+        search.index_courses([self.cooking.id])
+        self.assertEqual(self.document_frequency('food'), 1)
+        self.assertEqual(SearchDocument.objects.filter(doc_type='course').count(), 1)
+
+    def test_failed_index_update_does_not_fail_the_write(self):
+        with mock.patch.object(search, 'index_courses', side_effect=[IntegrityError('race'), None]) as index:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.cooking.save()
+        self.assertEqual(index.call_count, 2)  # retried once
+
+        with mock.patch.object(search, 'index_courses', side_effect=IntegrityError('race')) as index:
+            index.__name__ = 'index_courses'
+            with self.assertLogs('core.signals', 'ERROR'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.cooking.save()
+
+
+# --------------------- user-012: lesson summaries / lesson content -------------------------------
+
+class LessonContentTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.course = make_course('Long reads')
+        self.body = 'Lesson text, é included. ' * 200
+        self.lesson = Lesson.objects.create(course=self.course, title='One', content=self.body, lesson_number=1)
+        self.url = f'/api/lessons/{self.lesson.id}/content/'
+        self.encoded = self.body.encode('utf-8')
+
+    def test_lists_are_summaries_unless_expanded(self):
+        student = make_user('s@example.com')
+        SubscribedCourse.objects.create(student=student.student, course=self.course)
+        self.authenticate(student)
+
+        for url in ('/api/lessons/', f'/api/my-courses/{self.course.id}/lessons/'):
+            data = self.client.get(url).json()
+            lesson = (data['results'] if isinstance(data, dict) else data)[0]
+            self.assertNotIn('content', lesson)
+            self.assertEqual(lesson['content_length'], len(self.body))
+            self.assertEqual(lesson['content_hash'], hashlib.md5(self.encoded).hexdigest())
+
+            data = self.client.get(url, {'expand': 'content'}).json()
+            self.assertEqual((data['results'] if isinstance(data, dict) else data)[0]['content'], self.body)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-99')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, self.encoded[:100])
+        self.assertEqual(response['Content-Range'], f'bytes 0-99/{len(self.encoded)}')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(response.content, self.encoded[-10:])
+        # resuming against an older copy gets the whole body again
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, response.content), (200, self.encoded))
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.encoded)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.encoded)}')
+
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_full_bodies_are_compressed_ranges_are_not(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.encoded)
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_RANGE='bytes=0-9')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, self.encoded[:10])
+
+
+# --------------------- user-013: manage.py bench -------------------------------
+
+class BenchHelpersTests(TestCase):
+    # the command itself makes its own test database, so only its pieces run here
+    def test_percentile_is_nearest_rank(self):
+        samples = list(range(1, 101))
+        self.assertEqual([percentile(samples, pct) for pct in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_query_counter(self):
+        make_course('Counted')
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            list(Course.objects.all())
+            Course.objects.update(category='design')
+        self.assertEqual(counter.queries, 2)
+        self.assertGreaterEqual(counter.rows, 1)
+
+
+# --------------------- user-014: request timings / metrics -------------------------------
+
+class MetricsTests(APITestBase):
+    def test_server_timing_and_histograms(self):
+        make_course('Timed')
+        response = self.client.get('/api/courses/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries".*total;dur=')
+        with override_settings(METRICS_TOKEN='secret'):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response.content.decode(),
+                         r'edulearn_request_duration_seconds_count\{route="api/courses/\$?",method="GET"\} [1-9]')
+
+    def test_metrics_are_closed_by_default(self):
+        with override_settings(METRICS_TOKEN='', DEBUG=False):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(METRICS_TOKEN='', DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+
+    def test_timings_shared_between_threads(self):
+        timings, token = metrics.start_request()
+        try:
+            def work():
+                for _ in range(500):
+                    timings(lambda *args: None, 'SELECT 1', (), False, {})
+                    with metrics.timed('serialize'):
+                        pass
+
+            threads = [threading.Thread(target=contextvars.copy_context().run, args=(work,)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            metrics.end_request(token)
+        self.assertEqual(timings.queries, 4000)
+        self.assertEqual(timings.depth['serialize'], 0)
+        self.assertEqual(len(timings.top_queries()), metrics.TOP_QUERIES)
+
+
+# --------------------- user-015: read replicas -------------------------------
+
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def middleware(self, view, response_status=200):
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            self.routed_to = router.db_for_read(Course)
+            return HttpResponse(status=response_status)
+
+        with mock.patch.object(routers, 'replica_aliases', return_value=['replica1']):
+            router = routers.ReplicaRouter()
+            middleware = ReplicaMiddleware(get_response)
+        self.router = router
+        return middleware
+
+    def test_router(self):
+        with mock.patch.object(routers, 'replica_aliases', return_value=['replica1', 'replica2']):
+            router = routers.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Course))
+        token = routers.use_replica('replica2')
+        try:
+            self.assertEqual({router.db_for_read(Course) for _ in range(20)}, {'replica2'})
+            self.assertEqual(router.db_for_read(Lesson), 'replica2')
+            self.assertEqual(router.db_for_write(Course), 'default')
+        finally:
+            routers.reset_replica(token)
+        self.assertIsNone(router.db_for_read(Course))
+        self.assertFalse(router.allow_migrate('replica1', 'core'))
+
+    def test_opted_in_reads_go_to_a_replica_until_the_client_writes(self):
+        view = routers.read_replica(lambda request: None)
+        middleware = self.middleware(view)
+        middleware(self.factory.get('/api/courses/', HTTP_AUTHORIZATION='Bearer a'))
+        self.assertEqual(self.routed_to, 'replica1')
+        self.assertIsNone(self.router.db_for_read(Course))  # reset after the response
+
+        middleware(self.factory.get('/api/courses/', HTTP_AUTHORIZATION='Bearer a'))
+        middleware(self.factory.post('/api/subscribe/1/', HTTP_AUTHORIZATION='Bearer a'))
+        # pinned: this client reads its own write from default, others still use the replica
+        middleware(self.factory.get('/api/courses/', HTTP_AUTHORIZATION='Bearer a'))
+        self.assertIsNone(self.routed_to)
+        middleware(self.factory.get('/api/courses/', HTTP_AUTHORIZATION='Bearer b'))
+        self.assertEqual(self.routed_to, 'replica1')
+
+    def test_one_replica_per_request(self):
+        def get_response(request):
+            middleware.process_view(request, routers.read_replica(lambda request: None), (), {})
+            self.routed_to = {router.db_for_read(model) for model in (Course, Lesson, Course)}
+            return HttpResponse()
+
+        with mock.patch.object(routers, 'replica_aliases', return_value=['replica1', 'replica2', 'replica3']):
+            router = routers.ReplicaRouter()
+            middleware = ReplicaMiddleware(get_response)
+        for _ in range(10):
+            middleware(self.factory.get('/api/courses/'))
+            self.assertEqual(len(self.routed_to), 1)
+
+    def test_failed_writes_and_other_views_stay_on_default(self):
+        self.middleware(routers.read_replica(lambda request: None), response_status=400)(
+            self.factory.post('/api/subscribe/1/', HTTP_AUTHORIZATION='Bearer a'))
+        self.assertFalse(routers.is_pinned(self.factory.get('/', HTTP_AUTHORIZATION='Bearer a')))
+        self.middleware(lambda request: None)(self.factory.get('/api/my-courses/'))
+        self.assertIsNone(self.routed_to)
+
+
+# --------------------- user-016: course counters -------------------------------
+
+class CourseCounterTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.educator = make_user('e@example.com', role='educator')
+        self.course = make_course('Counted', created_by=self.educator.educator)
+        self.student = make_user('s@example.com')
+
+    def test_signals_keep_counters_current(self):
+        subscription = SubscribedCourse.objects.create(student=self.student.student, course=self.course)
+        lesson = Lesson.objects.create(course=self.course, title='One', content='...', lesson_number=1)
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.subscriber_count, self.course.lesson_count), (1, 1))
+        subscription.delete()
+        lesson.delete()
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.subscriber_count, self.course.lesson_count), (0, 0))
+
+    def test_edits_leave_counters_alone(self):
+        stale = Course.objects.get(id=self.course.id)
+        SubscribedCourse.objects.create(student=self.student.student, course=self.course)
+        stale.title = 'Renamed'
+        stale.save_edits()
+        self.assertEqual(Course.objects.values_list('subscriber_count', flat=True).get(id=self.course.id), 1)
+        self.authenticate(self.educator)
+        response = self.client.patch(f'/api/courses/{self.course.id}/', {'description': 'New.'}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.title, self.course.description, self.course.subscriber_count),
+                         ('Renamed', 'New.', 1))
+
+    def test_plain_save_still_writes_the_whole_row(self):
+        course = Course.objects.get(id=self.course.id)
+        Course.objects.filter(id=course.id).delete()
+        course.save()  # re-inserted, like any other model
+        self.assertTrue(Course.objects.filter(id=course.id).exists())
+
+    def test_batch_subscribe_sets_popularity_from_the_recount(self):
+        index = recommendations.get_recommendation_index()
+        # another request got there first: the insert adds nothing, the count stays 1
+        SubscribedCourse.objects.create(student=self.student.student, course=self.course)
+        with mock.patch('core.subscriptions.Exists', return_value=Value(False)):
+            with self.captureOnCommitCallbacks(execute=True):
+                results = subscribe_student(self.student.student.id, [self.course.id])
+        self.assertEqual(results, {self.course.id: 'subscribed'})
+        self.assertEqual(index._popularity[index._slots[self.course.id]], 1)
+
+    def test_reconcile_command(self):
+        SubscribedCourse.objects.create(student=self.student.student, course=self.course)
+        Course.objects.filter(id=self.course.id).update(subscriber_count=7, lesson_count=3)
+        call_command('reconcile_course_counters', stdout=io.StringIO())
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.subscriber_count, self.course.lesson_count), (1, 0))
+
+
+# --------------------- user-017: student dashboard -------------------------------
+
+class DashboardTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.student = make_user('s@example.com')
+        self.course = make_course('Started')
+        self.lessons = [
+            Lesson.objects.create(course=self.course, title=f'Lesson {number}', content='...', lesson_number=number)
+            for number in (1, 2, 3)
+        ]
+        self.other = make_course('Other')
+        SubscribedCourse.objects.create(student=self.student.student, course=self.course)
+        now = timezone.now()
+        LessonProgress.objects.create(student=self.student.student, lesson=self.lessons[0], course=self.course,
+                                      percent=100, opened_at=now, completed_at=now, updated_at=now)
+        self.authenticate(self.student)
+
+    def test_one_response_in_three_queries(self):
+        recommendations.get_recommendation_index()  # built once per process, not per request
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['profile']['email'], 's@example.com')
+        [course] = response.data['courses']
+        self.assertEqual((course['id'], course['lesson_count'], course['completed_lessons']), (self.course.id, 3, 1))
+        self.assertEqual(course['next_lesson'], {'id': self.lessons[1].id, 'title': 'Lesson 2', 'lesson_number': 2})
+        self.assertEqual([card['id'] for card in response.data['recommendations']], [self.other.id])
+
+    def test_parts_run_side_by_side_only_with_persistent_connections(self):
+        def thread():
+            return threading.current_thread().name
+
+        with override_settings(DASHBOARD_CONCURRENCY=4):
+            self.assertEqual(set(parallel.run_parallel(thread, thread)), {threading.current_thread().name})
+            # outside the test's transaction, as in a request
+            with mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=60), \
+                    mock.patch.object(connection, 'in_atomic_block', False):
+                caller, other = parallel.run_parallel(thread, thread)
+        self.assertEqual(caller, threading.current_thread().name)
+        self.assertTrue(other.startswith('request-parallel'))
+
+    def test_students_only(self):
+        self.authenticate(make_user('e@example.com', role='educator'))
+        self.assertEqual(self.client.get('/api/dashboard/').status_code, 403)
+        self.client.credentials()
+        self.assertEqual(self.client.get('/api/dashboard/').status_code, 401)
+
+
+# --------------------- user-018: lesson progress -------------------------------
+
+@override_settings(PROGRESS_FLUSH_SECONDS=3600, PROGRESS_BUFFER_SIZE=500)
+class ProgressTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.student = make_user('s@example.com').student
+        self.course = make_course('Read')
+        self.lessons = [
+            Lesson.objects.create(course=self.course, title=f'Lesson {number}', content='...', lesson_number=number)
+            for number in (1, 2)
+        ]
+        self.earlier = timezone.now() - timedelta(hours=1)
+        self.later = timezone.now()
+
+    def tearDown(self):
+        progress_buffer.flush()
+        if progress_buffer._timer is not None:
+            progress_buffer._timer.cancel()
+
+    def stored(self, lesson):
+        return LessonProgress.objects.values('percent', 'opened_at', 'completed_at', 'updated_at').get(
+            student=self.student, lesson=lesson)
+
+    def test_merge_keeps_the_furthest_and_the_first(self):
+        first = progress.event_state(self.course.id, 100, False, self.earlier)
+        second = progress.event_state(self.course.id, 30, True, self.later)
+        self.assertEqual(progress.merge(first, second), {
+            'course_id': self.course.id, 'percent': 100, 'opened_at': self.earlier,
+            'completed_at': self.earlier, 'updated_at': self.later,
+        })
+        self.assertIsNone(progress.merge(progress.event_state(self.course.id, 20, False, self.earlier),
+                                         progress.event_state(self.course.id, 50, False, self.later))['completed_at'])
+
+    def test_write_merges_with_the_stored_row(self):
+        key = (self.student.id, self.lessons[0].id)
+        progress.write_progress({key: progress.event_state(self.course.id, 100, False, self.earlier)})
+        # a flush from another worker with an older, lower state doesn't undo it
+        progress.write_progress({key: progress.event_state(self.course.id, 40, False, self.later)})
+        self.assertEqual(self.stored(self.lessons[0]), {
+            'percent': 100, 'opened_at': self.earlier, 'completed_at': self.earlier, 'updated_at': self.later,
+        })
+        progress.write_progress({(self.student.id, self.lessons[1].id): progress.event_state(self.course.id, 10, False, self.later)})
+        self.assertEqual(LessonProgress.objects.count(), 2)
+        self.assertIsNone(self.stored(self.lessons[1])['completed_at'])
+
+    def test_events_are_buffered_until_read(self):
+        SubscribedCourse.objects.create(student=self.student, course=self.course)
+        self.authenticate(self.student.user)
+        response = self.client.post('/api/progress/', {'events': [
+            {'lesson_id': self.lessons[0].id, 'percent': 40},
+            {'lesson_id': self.lessons[0].id, 'completed': True},
+            {'lesson_id': 999999, 'percent': 10},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data, {'accepted': 2, 'rejected': [999999]})
+        self.assertFalse(LessonProgress.objects.exists())
+
+        response = self.client.get(f'/api/my-courses/{self.course.id}/progress/')
+        self.assertEqual((response.data['lesson_count'], response.data['completed_lessons']), (2, 1))
+        self.assertEqual(self.stored(self.lessons[0])['percent'], 100)
+
+    def test_rows_of_deleted_lessons_dont_block_the_batch(self):
+        progress_buffer.add(self.student.id, [(lesson.id, self.course.id, 50, False) for lesson in self.lessons])
+        self.lessons[1].delete()
+        written = []
+
+        def write(states):
+            # SQLite only checks foreign keys at commit, MySQL at the INSERT
+            written.append(states)
+            if len(written) == 1:
+                raise IntegrityError('fk')
+
+        with mock.patch('core.progress.write_progress', side_effect=write):
+            with self.assertLogs('core.progress', 'WARNING'):
+                self.assertEqual(progress_buffer.flush(), 1)
+        self.assertEqual(list(written[1]), [(self.student.id, self.lessons[0].id)])
+        self.assertFalse(progress_buffer.has_pending(self.student.id))
+
+    @override_settings(PROGRESS_FLUSH_RETRIES=1)
+    def test_failing_batches_are_dropped_eventually(self):
+        progress_buffer.add(self.student.id, [(self.lessons[0].id, self.course.id, 50, False)])
+        with mock.patch('core.progress.write_progress', side_effect=RuntimeError('database down')):
+            with self.assertLogs('core.progress', 'ERROR'):
+                progress_buffer.flush()
+                self.assertTrue(progress_buffer.has_pending(self.student.id))
+                progress_buffer.flush()
+        self.assertFalse(progress_buffer.has_pending(self.student.id))
+
+    @override_settings(PROGRESS_BUFFER_MAX=1)
+    def test_buffer_is_capped(self):
+        progress_buffer.add(self.student.id, [(lesson.id, self.course.id, 50, False) for lesson in self.lessons])
+        with mock.patch('core.progress.write_progress', side_effect=RuntimeError('database down')):
+            with self.assertLogs('core.progress', 'ERROR'):
+                progress_buffer.flush()
+        self.assertFalse(progress_buffer.has_pending(self.student.id))
+
+
+# --------------------- user-019: students also took -------------------------------
+
+class AlsoTookTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.a, self.b, self.c = (make_course(title) for title in 'ABC')
+        self.students = [make_user(f's{number}@example.com').student for number in range(3)]
+        self.subscribe(0, self.a, self.b)
+        self.subscribe(1, self.a, self.b, self.c)
+
+    def subscribe(self, student, *courses):
+        for course in courses:
+            SubscribedCourse.objects.create(student=self.students[student], course=course)
+
+    def neighbors(self):
+        return sorted(CourseNeighbor.objects.values_list('course_id', 'neighbor_id', 'rank'))
+
+    def test_incremental_update_matches_a_full_build(self):
+        cooccurrence.build_full(min_support=2)
+        self.assertEqual(self.neighbors(), [(self.a.id, self.b.id, 1), (self.b.id, self.a.id, 1)])
+
+        self.subscribe(2, self.a, self.c)
+        self.assertEqual(cooccurrence.update(min_support=2), (2, 2))
+        incremental = self.neighbors()
+        cooccurrence.build_full(min_support=2)
+        self.assertEqual(incremental, self.neighbors())
+        self.assertIn((self.a.id, self.c.id, 2), incremental)
+        self.assertEqual(cooccurrence.update(min_support=2), (0, 0))
+
+    def test_endpoint(self):
+        cooccurrence.build_full(min_support=2)
+        response = self.client.get(f'/api/courses/{self.a.id}/also-took/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(card['id'], card['score']) for card in response.data],
+                         [(self.b.id, 1.0)])  # both students of A took B
+        self.assertEqual(self.client.get(f'/api/courses/{self.c.id}/also-took/').data, [])
+        self.assertEqual(self.client.get('/api/courses/999999/also-took/').status_code, 404)
+
+
+# --------------------- user-020: async model calls -------------------------------
+
+class SlowBackend(StubBackend):
+    name = 'slow'
+
+    async def agenerate(self, prompt):
+        await asyncio.sleep(float(prompt.count('slow')))
+        return self.generate(prompt)
+
+
+@override_settings(QUESTION_GENERATION_BACKEND='core.tests.SlowBackend', THROTTLES={})
+class WaitForQuestionsTests(APITestBase):
+    def test_answers_inline_when_the_model_is_quick(self):
+        response = self.client.post('/api/generate-questions/?wait=5', {'lesson_content': 'Quick.'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['questions']), 3)
+        self.assertFalse(QuestionGenerationJob.objects.exists())
+
+    def test_slow_calls_are_cancelled_and_queued(self):
+        started = time.monotonic()
+        response = self.client.post('/api/generate-questions/?wait=0.1', {'lesson_content': 'slow ' * 30},
+                                    format='json')
+        self.assertLess(time.monotonic() - started, 5)  # not kept running in the request
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(QuestionGenerationJob.objects.get().status, 'pending')
+        self.assertFalse(ai._in_flight)
+
+    def test_only_transient_errors_fall_back_to_a_job(self):
+        with mock.patch.object(SlowBackend, 'agenerate', side_effect=ConnectionError('reset')):
+            response = self.client.post('/api/generate-questions/?wait=5', {'lesson_content': 'Flaky.'}, format='json')
+        self.assertEqual(response.status_code, 202)
+
+        with mock.patch.object(SlowBackend, 'agenerate', side_effect=ImproperlyConfigured('no key')):
+            with self.assertRaises(ImproperlyConfigured):
+                self.client.post('/api/generate-questions/?wait=5', {'lesson_content': 'Broken.'}, format='json')
+        self.assertEqual(QuestionGenerationJob.objects.count(), 1)
+
+
+# --------------------- user-021: startup cost -------------------------------
+
+class StartupTests(TestCase):
+    def test_parse_importtime(self):
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       622 |      12829 |   json.decoder',
+            'import time:       656 |        656 |     json.scanner',
+            'import time:       385 |      13869 | json',
+            'Traceback (most recent call last):',
+        ])
+        self.assertEqual(parse_importtime(output), [
+            ('json.decoder', 622, 12829, 1), ('json.scanner', 656, 656, 2), ('json', 385, 13869, 0),
+        ])
+
+    @override_settings(QUESTION_GENERATION_BACKEND='core.ai.GeminiBackend', GEMINI_API_KEY='')
+    def test_sdks_are_imported_on_first_use_only(self):
+        # getting the backend (what warm-up does) works without the SDK or an API key
+        with mock.patch.dict(ai._backends, clear=True):
+            self.assertIsNone(ai.get_backend()._genai)
+
+        code = 'import django; django.setup(); import sys, core.ai, core.urls; ' \
+               'print(sorted(m for m in ("google.generativeai", "httpx") if m in sys.modules))'
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=settings.BASE_DIR, env=os.environ)
+        self.assertEqual((result.returncode, result.stdout.strip()), (0, '[]'), result.stderr)
+
+
+# --------------------- user-022: whole-course questions -------------------------------
+
+class ChunkingTests(TestCase):
+    def test_chunk_text(self):
+        paragraphs = ['First sentence here. ' * 10, 'Second paragraph. ' * 10, 'word ' * 200]
+        text = '\n\n'.join(paragraphs)
+        chunks = chunk_text(text, max_tokens=60)
+        self.assertTrue(all(len(chunk) <= 60 * 4 for chunk in chunks))
+        self.assertEqual(' '.join(' '.join(chunks).split()), ' '.join(text.split()))  # nothing lost
+        self.assertEqual(chunk_text('Short.', max_tokens=60), ['Short.'])
+        self.assertEqual(chunk_text('x' * 500, max_tokens=50), ['x' * 200, 'x' * 200, 'x' * 100])
+
+    def test_merge_results_drops_repeated_questions(self):
+        merged = merge_results([
+            {'questions': [{'question': 'What is X?'}], 'mcqs': [{'question': 'Pick one', 'answer': 'A'}]},
+            {'questions': [{'question': 'what is x'}, {'question': 'Why?'}], 'mcqs': None},
+            {},
+        ])
+        self.assertEqual(merged, {
+            'questions': [{'question': 'What is X?'}, {'question': 'Why?'}],
+            'mcqs': [{'question': 'Pick one', 'answer': 'A'}],
+        })
+
+
+@fast_hashing
+@override_settings(QUESTION_GENERATION_BACKEND='core.tests.CountingBackend', QUESTION_CHUNK_TOKENS=20,
+                   QUESTION_CALL_RETRIES=0, QUESTION_COURSE_CONCURRENCY=1, THROTTLES={})
+class CourseQuestionsTests(APITransactionTestCase):
+    # the chunks are generated on a thread pool, whose connections can't see a test transaction;
+    # one thread, as concurrent writers to SQLite's shared in-memory database get "table is locked"
+    authenticate = APITestBase.authenticate
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        CountingBackend.calls = 0
+        self.course = make_course('Biology')
+        self.lessons = [
+            Lesson.objects.create(course=self.course, title=f'Lesson {number}', lesson_number=number,
+                                  content=f'Cells divide. ' * 10 + f'Lesson {number} ends.')
+            for number in (1, 2)
+        ]
+        self.authenticate(make_user('s@example.com'))
+        self.url = f'/api/courses/{self.course.id}/generate-questions/'
+
+    def test_generated_once_then_answered_from_the_store(self):
+        self.assertIsNone(stored_course_questions(self.course.id))
+        result = generate_course_questions(self.course.id)
+        self.assertEqual([lesson['lesson_number'] for lesson in result['lessons']], [1, 2])
+        calls = CountingBackend.calls
+        self.assertGreater(calls, 2)  # chunked
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, result)
+        self.assertFalse([q for q in queries.captured_queries if '"content"' in q['sql']])  # no lesson bodies read
+
+        lesson = self.lessons[1]
+        lesson.content += ' New.'
+        lesson.save()
+        self.assertEqual(self.client.post(self.url).status_code, 202)
+        generate_course_questions(self.course.id)
+        self.assertEqual(LessonQuestions.objects.get(lesson=self.lessons[0]).content_hash,
+                         self.lessons[0].content_sha256)
+        self.assertIsNotNone(stored_course_questions(self.course.id))
+
+    def test_bulk_created_lessons_are_hashed_by_the_job(self):
+        Lesson.objects.bulk_create([Lesson(course=self.course, title='Bulk', lesson_number=3, content='Imported.')])
+        generate_course_questions(self.course.id)
+        self.assertEqual(Lesson.objects.get(lesson_number=3).content_sha256, lesson_content_hash('Imported.'))
+        self.assertIsNotNone(stored_course_questions(self.course.id))
+
+    def test_another_backend_regenerates(self):
+        generate_course_questions(self.course.id)
+        with override_settings(QUESTION_GENERATION_BACKEND='core.ai.StubBackend'):
+            self.assertIsNone(stored_course_questions(self.course.id))
+
+    @override_settings(THROTTLES={'question_model_calls': [{'by': 'global', 'rate': '100/s', 'burst': 1}]})
+    def test_model_calls_share_a_global_bucket(self):
+        with mock.patch('core.course_questions.time.sleep') as sleep:
+            generate_course_questions(self.course.id, concurrency=1)
+        self.assertTrue(sleep.called)
+
+    @override_settings(QUESTION_JOB_TIMEOUT=timedelta(minutes=5), QUESTION_COURSE_JOB_TIMEOUT=timedelta(minutes=20))
+    def test_course_jobs_beat_and_get_a_longer_timeout(self):
+        beats = []
+        generate_course_questions(self.course.id, heartbeat=lambda: beats.append(1))
+        chunks = sum(len(chunk_text(lesson.content, settings.QUESTION_CHUNK_TOKENS)) for lesson in self.lessons)
+        self.assertEqual(len(beats), chunks)  # one per chunk
+
+        job = enqueue_course_question_job(self.course.id)
+        claim_jobs(1)
+        QuestionGenerationJob.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(requeue_stale_jobs(), 0)
+        QuestionGenerationJob.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(minutes=30))
+        self.assertEqual(requeue_stale_jobs(), 1)
+
+
+# --------------------- user-023: token-bucket throttling -------------------------------
+
+BUCKETS = {'scope': [{'by': 'ip', 'rate': '1/min', 'burst': 2}, {'by': 'global', 'rate': '3/min', 'burst': 3}]}
+
+
+@override_settings(THROTTLES=BUCKETS)
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        throttling.throttle_cache().clear()
+        self.factory = RequestFactory()
+
+    def request(self, ip='10.0.0.1', **extra):
+        return self.factory.post('/', REMOTE_ADDR=ip, **extra)
+
+    def test_parse_rate(self):
+        self.assertEqual([throttling.parse_rate(rate) for rate in ('10/min', '5/s', '30/h', '1/day')],
+                         [6000, 200, 120000, 86400000])
+
+    def test_burst_then_wait(self):
+        self.assertIsNone(throttling.check('scope', self.request()))
+        self.assertIsNone(throttling.check('scope', self.request()))
+        wait = throttling.check('scope', self.request())
+        self.assertTrue(0 < wait <= 60)
+        self.assertIsNone(throttling.check('unthrottled', self.request()))
+
+        # the bucket refills with time
+        later = time.time() + 61
+        with mock.patch('core.throttling.time.time', return_value=later):
+            self.assertIsNone(throttling.check('scope', self.request()))
+
+    def test_rejected_requests_give_tokens_back(self):
+        for _ in range(2):
+            throttling.check('scope', self.request())
+        self.assertIsNotNone(throttling.check('scope', self.request()))  # its global token is returned
+        self.assertIsNone(throttling.check('scope', self.request('10.0.0.2')))
+        self.assertIsNotNone(throttling.check('scope', self.request('10.0.0.3')))  # global bucket empty now
+
+    def test_forwarded_for_is_ignored_without_proxies(self):
+        for number in range(2):
+            throttling.check('scope', self.request(HTTP_X_FORWARDED_FOR=f'192.0.2.{number}'))
+        self.assertIsNotNone(throttling.check('scope', self.request(HTTP_X_FORWARDED_FOR='192.0.2.9')))
+
+    def test_forwarded_for_behind_a_proxy(self):
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            for _ in range(2):
+                throttling.check('scope', self.request(HTTP_X_FORWARDED_FOR='spoofed, 192.0.2.1'))
+            self.assertIsNotNone(throttling.check('scope', self.request(HTTP_X_FORWARDED_FOR='other, 192.0.2.1')))
+            self.assertIsNone(throttling.check('scope', self.request(HTTP_X_FORWARDED_FOR='192.0.2.2')))
+
+    @override_settings(THROTTLES={'login': [{'by': 'ip', 'rate': '1/min', 'burst': 1}]})
+    def test_login_answers_429(self):
+        client = APIClient()
+        client.post('/api/auth/login/', {'email': 'x@example.com', 'password': 'pw'}, format='json')
+        response = client.post('/api/auth/login/', {'email': 'x@example.com', 'password': 'pw'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(int(response['Retry-After']) > 0)
+
+
+# --------------------- user-024: bulk registration -------------------------------
+
+def student_rows(count, domain='example.com'):
+    return [
+        {'email': f'student{number}@{domain}', 'password': 'pw', 'role': 'student', 'full_name': f'Student {number}'}
+        for number in range(count)
+    ]
+
+
+class BulkRegisterTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.educator = make_user('e@example.com', role='educator')
+        self.authenticate(self.educator)
+
+    def test_registers_inline_with_a_result_per_row(self):
+        make_user('taken@example.com')
+        rows = student_rows(2) + [
+            {'email': 'taken@example.com', 'password': 'pw', 'role': 'student', 'full_name': 'Taken'},
+            {'email': 'other@example.com', 'password': 'pw', 'role': 'educator', 'full_name': 'Other'},
+            {'email': 'student0@example.com', 'password': 'pw', 'role': 'student', 'full_name': 'Again'},
+            {'email': 'not an email', 'password': 'pw', 'role': 'student', 'full_name': 'Broken'},
+        ]
+        response = self.client.post('/api/auth/register/bulk/', rows, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 4))
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['created', 'created', 'error', 'error', 'error', 'error'])
+        self.assertIn('role', response.data['results'][3]['errors'])
+        user = User.objects.get(email='student1@example.com')
+        self.assertTrue(user.check_password('pw'))
+        self.assertEqual(user.student.full_name, 'Student 1')
+
+    def test_csv_upload(self):
+        upload = SimpleUploadedFile('cohort.csv', b'email,password,role,full_name\na@example.com,pw,student,A\n')
+        response = self.client.post('/api/auth/register/bulk/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Student.objects.filter(user__email='a@example.com').exists())
+
+    def test_students_cannot_register(self):
+        self.authenticate(make_user('s@example.com'))
+        response = self.client.post('/api/auth/register/bulk/', student_rows(1), format='json')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(BULK_REGISTRATION_MAX_ROWS=2)
+    def test_bigger_uploads_become_a_job(self):
+        response = self.client.post('/api/auth/register/bulk/', {'users': student_rows(3)}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertFalse(User.objects.filter(email__startswith='student').exists())
+        status_url = response.data['status_url']
+
+        job = run_registration_job(claim_registration_job())
+        self.assertEqual(job.status, 'done')
+        self.assertIsNone(RegistrationJob.objects.get(id=job.id).rows)  # no passwords left behind
+        self.assertEqual(User.objects.filter(email__startswith='student').count(), 3)
+
+        response = self.client.get(status_url)
+        self.assertEqual((response.data['status'], response.data['created']), ('done', 3))
+
+        # only whoever sent the upload sees its results
+        self.authenticate(make_user('e2@example.com', role='educator'))
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+
+    @override_settings(BULK_REGISTRATION_MAX_ROWS=1, BULK_REGISTRATION_JOB_MAX_ROWS=2)
+    def test_too_big_for_a_job(self):
+        response = self.client.post('/api/auth/register/bulk/', student_rows(3), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(RegistrationJob.objects.exists())
+
+    @override_settings(THROTTLES={'bulk_register': [{'by': 'user', 'rate': '1/h', 'burst': 1}]})
+    def test_throttled(self):
+        self.client.post('/api/auth/register/bulk/', student_rows(1), format='json')
+        response = self.client.post('/api/auth/register/bulk/', student_rows(1, 'example.org'), format='json')
+        self.assertEqual(response.status_code, 429)
+
+
+@fast_hashing
+class RegistrationJobTests(TestCase):
+    def test_register_users_without_a_pool(self):
+        results = register_users(student_rows(3), chunk_size=2)
+        self.assertEqual([result['row'] for result in results], [1, 2, 3])
+        self.assertEqual(Student.objects.count(), 3)
+
+    @override_settings(REGISTRATION_JOB_TIMEOUT=timedelta(minutes=30))
+    def test_stale_jobs_fail_without_retry(self):
+        job = RegistrationJob.objects.create(allowed_roles=['student'], rows=student_rows(1))
+        self.assertEqual(claim_registration_job(), job)
+        self.assertIsNone(claim_registration_job())
+        RegistrationJob.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(fail_stale_registration_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNone(job.rows)
+
+    @override_settings(REGISTRATION_JOB_PENDING_TTL=timedelta(hours=1))
+    def test_unclaimed_jobs_expire_with_their_passwords(self):
+        old = RegistrationJob.objects.create(allowed_roles=['student'], rows=student_rows(1))
+        RegistrationJob.objects.filter(id=old.id).update(created_at=timezone.now() - timedelta(hours=2))
+        fresh = enqueue_registration_job(student_rows(1, 'example.org'), ['student'])  # expires the old one
+
+        old.refresh_from_db()
+        self.assertEqual((old.status, old.rows), ('failed', None))
+        self.assertEqual(claim_registration_job(), fresh)
+
+    def test_admin_hides_the_rows(self):
+        staff = User.objects.create_superuser(email='admin@example.com', password='pw')
+        job = RegistrationJob.objects.create(allowed_roles=['student'], rows=student_rows(1))
+        self.client.force_login(staff)
+        response = self.client.get(f'/admin/core/registrationjob/{job.id}/change/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'student0@example.com')
+
+
+# --------------------- user-025: roster export -------------------------------
+
+class RosterExportTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.educator = make_user('e@example.com', role='educator')
+        self.python = make_course('Python', created_by=self.educator.educator)
+        self.css = make_course('CSS', created_by=self.educator.educator)
+        self.elsewhere = make_course('Elsewhere', created_by=make_user('e2@example.com', role='educator').educator)
+        self.students = [make_user(f's{number}@example.com').student for number in range(3)]
+        for student in self.students:
+            SubscribedCourse.objects.create(student=student, course=self.python)
+            SubscribedCourse.objects.create(student=student, course=self.elsewhere)
+        SubscribedCourse.objects.create(student=self.students[0], course=self.css)
+        self.authenticate(self.educator)
+
+    def export(self, **params):
+        response = self.client.get('/api/educator/roster/export/', params)
+        return response, b''.join(response.streaming_content).decode() if response.streaming else None
+
+    def test_csv(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = body.splitlines()
+        self.assertEqual(lines[0], ','.join(roster.COLUMNS))
+        self.assertEqual(len(lines), 1 + 4)  # only the educator's own courses
+        self.assertTrue(lines[1].startswith(f'{self.python.id},Python,{self.students[0].id},s0,s0@example.com,'))
+
+    def test_jsonl_of_one_course(self):
+        response, body = self.export(output='jsonl', course=self.css.id)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([(row['course_title'], row['email']) for row in rows], [('CSS', 's0@example.com')])
+
+    @override_settings(ROSTER_EXPORT_BATCH_SIZE=2)
+    def test_batches_cover_every_row_once(self):
+        batches = list(roster.roster_batches(roster.roster_courses(self.educator.educator.id)))
+        self.assertEqual([len(batch) for batch in batches], [2, 1, 1])
+        self.assertEqual(sorted(row[2] for row in batches[0] + batches[1]), [student.id for student in self.students])
+
+    def test_rejects(self):
+        self.assertEqual(self.export(output='xml')[0].status_code, 400)
+        self.assertEqual(self.export(course='x')[0].status_code, 400)
+        self.assertEqual(self.export(course=self.elsewhere.id)[0].status_code, 404)
+        self.authenticate(self.students[0].user)
+        self.assertEqual(self.export()[0].status_code, 403)
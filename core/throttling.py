@@ -0,0 +1,122 @@
+"""
+Token-bucket throttling for the expensive endpoints - login (password
+hashing, also in bulk) and generate-questions (paid model calls) - so a burst on them
+can't take every worker away from the cheap catalog reads.
+
+settings.THROTTLES maps a scope to the buckets a request has to pass:
+    {'by': 'ip' | 'user' | 'global', 'rate': '10/min', 'burst': 5}
+`rate` refills the bucket, `burst` is its size. 'user' buckets are per user
+id (per IP for anonymous requests), 'global' is one bucket shared by every
+client. A scope without buckets isn't throttled. The IP is DRF's get_ident():
+REMOTE_ADDR, or behind REST_FRAMEWORK['NUM_PROXIES'] proxies the address the
+outermost one saw in X-Forwarded-For - never an entry the client wrote itself.
+
+Each bucket is a GCRA - the token bucket kept as one number, the
+"theoretical arrival time" (TAT, in ms). A request adds one refill interval
+to it with an atomic cache.incr and goes through while the TAT stays within
+`burst` intervals of now; a rejected request takes its interval back. The
+key expires once the TAT has passed, so a missing key is a full bucket.
+
+The state lives in THROTTLE_CACHE_ALIAS (the default cache): with CACHE_URL
+set that's Redis and the limits hold across workers, with the local-memory
+default they are per process.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+KEY = 'throttle:%s:%s:%s'  # scope, by, ident
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'10/min' -> milliseconds between two tokens."""
+    count, period = rate.split('/')
+    return max(1, int(PERIODS[period.strip()[0]] * 1000 / int(count)))
+
+
+def throttle_cache():
+    return caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+
+
+def _take(cache, key, interval, capacity, now):
+    """Take a token; returns 0, or how many ms until one is available."""
+    cache.add(key, now, timeout=math.ceil(capacity / 1000) + 1)
+    try:
+        tat = cache.incr(key, interval)
+    except ValueError:
+        # expired between add() and incr()
+        cache.add(key, now, timeout=math.ceil(capacity / 1000) + 1)
+        tat = cache.incr(key, interval)
+    if tat < now + interval:
+        # the key outlives its TAT by up to a second (whole-second expiry), catch up with the clock
+        tat = cache.incr(key, now + interval - tat)
+    if tat > now + capacity:
+        _give_back(cache, key, interval)
+        return tat - capacity - now
+    cache.touch(key, math.ceil((tat - now) / 1000))
+    return 0
+
+
+def _give_back(cache, key, interval):
+    try:
+        cache.decr(key, interval)
+    except ValueError:
+        pass  # expired meanwhile, the bucket is full anyway
+
+
+def check(scope, request, user=None):
+    """Take a token from every bucket of `scope`: None when the request may go on, else seconds to wait."""
+    buckets = getattr(settings, 'THROTTLES', {}).get(scope)
+    if not buckets:
+        return None
+
+    cache = throttle_cache()
+    now = int(time.time() * 1000)
+    taken = []
+    for bucket in buckets:
+        by = bucket['by']
+        if by == 'global':
+            ident = 'all'  # also what callers outside a request (request=None) can use
+        elif by == 'user' and user is not None and user.is_authenticated:
+            ident = f'user-{user.id}'
+        else:
+            ident = f'ip-{BaseThrottle().get_ident(request)}'
+        key = KEY % (scope, by, ident)
+        interval = parse_rate(bucket['rate'])
+        wait = _take(cache, key, interval, interval * bucket.get('burst', 1), now)
+        if wait:
+            # not let through after all, give back what the earlier buckets handed out
+            for earlier_key, earlier_interval in taken:
+                _give_back(cache, earlier_key, earlier_interval)
+            return wait / 1000
+        taken.append((key, interval))
+    return None
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """DRF throttle for the buckets of `scope` in settings.THROTTLES."""
+    scope = None
+
+    def allow_request(self, request, view):
+        self.wait_seconds = check(self.scope, request, request.user)
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class LoginThrottle(TokenBucketThrottle):
+    scope = 'login'
+
+
+class CourseQuestionsThrottle(TokenBucketThrottle):
+    scope = 'generate_course_questions'
+
+
+class BulkRegistrationThrottle(TokenBucketThrottle):
+    scope = 'bulk_register'
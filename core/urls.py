@@ -3,21 +3,30 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     CourseViewSet,
+    course_detail,
     LessonViewSet,
     CourseTagViewSet, 
     RegisterView, 
+    LoginView,
+    bulk_register,
+    bulk_register_job,
+    roster_export,
     SubscribedCourseViewSet, 
     my_courses, 
     subscribe_course, 
+    subscribe_courses,
     my_course_lessons,
     recommended_courses,
     user_profile,
-    generate_questions
+    generate_questions,
+    generate_questions_job,
+    generate_course_questions,
+    search_catalog,
+    dashboard,
+    record_progress,
+    course_progress,
     )
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-
-from django.conf import settings
-from django.conf.urls.static import static
+from rest_framework_simplejwt.views import TokenRefreshView
 
 router = DefaultRouter()
 router.register(r'courses', CourseViewSet)
@@ -26,19 +35,31 @@ router.register(r'tags', CourseTagViewSet)
 router.register(r'subscribed-courses', SubscribedCourseViewSet)
 
 urlpatterns = [
+    # async reads of a course, ahead of the router's courses/<pk>/ (which it hands writes back to)
+    path('courses/<int:pk>/', course_detail, name='course-detail-async'),
     path('', include(router.urls)),
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
 
 urlpatterns += [
     path('auth/register/', RegisterView.as_view(), name='register'),
-    path('auth/login/', TokenObtainPairView.as_view(), name='login'),
+    path('auth/register/bulk/', bulk_register, name='bulk-register'),
+    path('auth/register/bulk/<uuid:job_id>/', bulk_register_job, name='bulk-register-job'),
+    path('auth/login/', LoginView.as_view(), name='login'),
     path('auth/profile/', user_profile, name='user-profile'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('my-courses/', my_courses, name='my-courses'),
+    path('dashboard/', dashboard, name='dashboard'),
+    path('progress/', record_progress, name='record-progress'),
+    path('my-courses/<int:course_id>/progress/', course_progress, name='course-progress'),
+    path('subscribe/', subscribe_courses, name='subscribe-courses'),
     path('subscribe/<int:course_id>/', subscribe_course, name='subscribe-course'),
     path('my-courses/<int:course_id>/lessons/', my_course_lessons, name='my-course-lessons'),
     # 
     path('recommended-courses/', recommended_courses, name='recommended-courses'),
     path("generate-questions/", generate_questions, name="generate-questions"),
+    path("generate-questions/<uuid:job_id>/", generate_questions_job, name="generate-questions-job"),
+    path("courses/<int:course_id>/generate-questions/", generate_course_questions, name="generate-course-questions"),
+    path('search/', search_catalog, name='search'),
+    path('educator/roster/export/', roster_export, name='roster-export'),
 ]
 
@@ -1,44 +1,256 @@
 from django.shortcuts import render
 
+import asyncio
+import csv
+import hashlib
+import json
+import re
+
+from functools import partial
+
+from asgiref.sync import sync_to_async
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db import router as db_router
+from django.db.models import Count, Exists, IntegerField, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import MD5, Coalesce, Length
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.urls import reverse
+from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from django.views.static import serve
 from rest_framework import viewsets, permissions
 from .models import Course, Lesson, CourseTag, SubscribedCourse, Student
-from .serializers import CourseSerializer, LessonSerializer, CourseTagSerializer, SubscribedCourseSerializer
+from .serializers import CourseSerializer, LessonSerializer, LessonSummarySerializer, CourseTagSerializer, SubscribedCourseSerializer, query_param_set
+from .serializers import CourseCardSerializer, SubscribedCourseCardSerializer
 from .permissions import IsEducatorOrReadOnly
+from .recommendations import get_recommendation_index
+from .authentication import ClaimsJWTAuthentication
+from .cache import CatalogCacheMixin, aget_versions, catalog_cache, etag_matches, make_etag, response_cache_key
+from .metrics import TimedJSONRenderer
+from .routers import read_replica
+from .parallel import run_parallel
+from .progress import progress_buffer
 
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework import status
-from .models import User, Educator, Student
+from .models import User, Educator, Student, QuestionGenerationJob, LessonProgress, CourseNeighbor, RegistrationJob
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied, Throttled
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework import serializers
 
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action, api_view, parser_classes, permission_classes, throttle_classes
 
-from decouple import config
-import google.generativeai as genai
-import json
-import re
+from .ai import agenerate_questions_for, content_hash, get_cached_questions, is_transient
+from .jobs import enqueue_course_question_job, enqueue_question_job
+from .course_questions import stored_course_questions
+from . import images, metrics, passwords, registration, roster, search, throttling
+from .subscriptions import subscribe_student, SUBSCRIBED, ALREADY_SUBSCRIBED, NOT_FOUND
+
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+
+def course_queryset(request, queryset=None):
+    """
+    Courses with everything CourseSerializer renders fetched up front, so a
+    page of courses costs the same few queries whatever its length.
+    Honours ?fields= (skips unused prefetches) and ?expand=lessons.
+    """
+    if queryset is None:
+        queryset = Course.objects.all()
+
+    fields = query_param_set(request, 'fields')
+    expand = query_param_set(request, 'expand') or set()
+
+    if fields is None or 'tags' in fields:
+        queryset = queryset.prefetch_related('tags')
+    if fields is None or 'lessons' in fields:
+        if 'lessons' in expand:
+            lessons = Lesson.objects.all()
+        else:
+            # leave lesson bodies in the database unless the client asked for them
+            lessons = Lesson.objects.only('id', 'title', 'lesson_number', 'course_id')
+        queryset = queryset.prefetch_related(Prefetch('lessons', queryset=lessons))
+    return queryset
+
+
+def lesson_summaries(queryset):
+    """Lessons for LessonSummarySerializer: the content stays in the database, only its length/hash come back."""
+    return queryset.defer('content').annotate(content_length=Length('content'), content_hash=MD5('content'))
+
+
+def wants_lesson_content(request):
+    return 'content' in (query_param_set(request, 'expand') or ())
 
-from rest_framework.parsers import MultiPartParser, FormParser
 
-class CourseViewSet(viewsets.ModelViewSet):
+# --------------------- Async views -------------------------------
+# my_courses, my_course_lessons, user_profile, course reads and generate_questions
+# are native async views, so under ASGI they don't take a thread for the whole
+# request (and generate_questions can await the model). DRF's views are sync
+# only, so these are plain Django views that authenticate themselves and
+# render with the same JSON renderer.
+
+def api_response(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(TimedJSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+def not_authenticated(detail):
+    response = api_response(detail if isinstance(detail, dict) else {'detail': detail}, status.HTTP_401_UNAUTHORIZED)
+    response['WWW-Authenticate'] = ClaimsJWTAuthentication().authenticate_header(None)
+    return response
+
+
+async def async_user(request, required=True):
+    """(user, None) or (None, 401 response), like DRF's authentication + IsAuthenticated."""
+    try:
+        result = await ClaimsJWTAuthentication().aauthenticate(request)
+    except AuthenticationFailed as e:
+        return None, not_authenticated(e.detail)
+    if result is None:
+        if required:
+            return None, not_authenticated('Authentication credentials were not provided.')
+        return None, None
+    return result[0], None
+
+
+def throttled(wait):
+    # what DRF answers for a Throttled exception
+    exc = Throttled(wait)
+    response = api_response({'detail': exc.detail}, status.HTTP_429_TOO_MANY_REQUESTS)
+    response['Retry-After'] = '%d' % exc.wait
+    return response
+
+
+def request_data(request):
+    """The parsed JSON or form body; ValueError for broken JSON."""
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    return request.POST
+
+# ----------------------------------------------------------------------------
+
+
+BYTE_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_byte_range(header, size):
+    """
+    (start, end) inclusive for a single-range `Range: bytes=...` header,
+    None to send the whole body, or ValueError when the range can't be satisfied.
+    """
+    match = BYTE_RANGE_RE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None  # absent, malformed or multi-range: a full 200 is always allowed
+    first, last = match.groups()
+    if first == '':
+        # suffix range, the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError
+    return start, end
+
+
+class CourseViewSet(CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
     permission_classes = [IsEducatorOrReadOnly]
     parser_classes = (MultiPartParser, FormParser)
+    keyset_ordering = ('created_at', 'id')
+    cache_dependencies = ('course', 'lesson')
+    use_read_replica = True
+
+    def get_queryset(self):
+        return course_queryset(self.request, super().get_queryset())
 
     # automatically set the created_by field to the current user's educator
     def perform_create(self, serializer):
-        educator = self.request.user.educator
-        serializer.save(created_by=educator)
-
-    # ------+ manually added by mac - remove if it introduces inconsistencies
-    # order lessons by lesson_number
-        Course.objects.prefetch_related('lessons')
-    # -------+
+        serializer.save(created_by_id=self.request.user.educator_id)
+
+    # top courses by subscribers, read straight off course_popular_idx; ?limit= (default 10, max 50)
+    @action(detail=False, methods=['get'])
+    def popular(self, request):
+        return self.cached_response(self._popular, request)
+
+    # "students also took": precomputed neighbours (core/cooccurrence.py), one indexed read
+    @action(detail=True, methods=['get'], url_path='also-took')
+    def also_took(self, request, pk=None):
+        neighbors = list(
+            CourseNeighbor.objects.filter(course_id=pk)
+            .select_related('neighbor').defer('neighbor__description')
+            .order_by('rank')
+        )
+        if not neighbors and not Course.objects.filter(pk=pk).exists():
+            return Response({'detail': 'Course not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        data = CourseCardSerializer([n.neighbor for n in neighbors], many=True, context={'request': request}).data
+        for item, neighbor in zip(data, neighbors):
+            item['score'] = round(neighbor.score, 4)
+        return Response(data)
+
+    def _popular(self, request):
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            limit = 10
+        courses = self.get_queryset().order_by('-subscriber_count', '-id')[:limit]
+        return Response(self.get_serializer(courses, many=True).data)
+
+
+# writes (and OPTIONS) on /api/courses/<id>/ stay with the viewset
+course_detail_drf = CourseViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+})
+
+
+# async CourseViewSet.retrieve, sharing its cache entries (see CatalogCacheMixin)
+@read_replica
+@csrf_exempt
+async def course_detail(request, pk):
+    if request.method not in ('GET', 'HEAD'):
+        return await sync_to_async(course_detail_drf)(request, pk=pk)
+
+    user, error = await async_user(request, required=False)
+    if error:
+        return error
+
+    if 'HTTP_AUTHORIZATION' in request.META:
+        data = await course_detail_data(request, pk)
+        if data is None:
+            return api_response({'detail': 'No Course matches the given query.'}, status.HTTP_404_NOT_FOUND)
+        return api_response(data)
+
+    cache = catalog_cache()
+    key = response_cache_key(request, await aget_versions(CourseViewSet.cache_dependencies))
+    entry = await cache.aget(key)
+    if entry is None:
+        data = await course_detail_data(request, pk)
+        if data is None:
+            return api_response({'detail': 'No Course matches the given query.'}, status.HTTP_404_NOT_FOUND)
+        entry = {'data': data, 'etag': make_etag(data)}
+        await cache.aset(key, entry, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+
+    if etag_matches(request, entry['etag']):
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = api_response(entry['data'])
+    response['ETag'] = entry['etag']
+    return response
+
+
+async def course_detail_data(request, pk):
+    course = await course_queryset(request).filter(pk=pk).afirst()
+    if course is None:
+        return None
+    return CourseSerializer(course, context={'request': request}).data
 
 # class CourseViewSet(viewsets.ModelViewSet):
 #     queryset = Course.objects.all()
@@ -47,15 +259,75 @@ class CourseViewSet(viewsets.ModelViewSet):
 #     permission_classes = [AllowAny]  # ⚠️ TEMPORARY FOR TESTING ONLY
 
 
-class LessonViewSet(viewsets.ModelViewSet):
+class LessonViewSet(CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
     permission_classes = [IsEducatorOrReadOnly]
+    keyset_ordering = ('course', 'lesson_number', 'id')
+    cache_dependencies = ('lesson',)
+    use_read_replica = True
     # permission_classes = [AllowAny]  # ⚠️ TEMPORARY FOR TESTING ONLY
 
-class CourseTagViewSet(viewsets.ModelViewSet):
+    # lists are summaries unless ?expand=content, single lessons keep their content
+    def summary_mode(self):
+        return self.action == 'list' and not wants_lesson_content(self.request)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.summary_mode():
+            queryset = lesson_summaries(queryset)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.summary_mode():
+            return LessonSummarySerializer
+        return super().get_serializer_class()
+
+    @action(detail=True, methods=['get'])
+    def content(self, request, pk=None):
+        """
+        The lesson body as text/plain, with Range support so big lessons can be
+        fetched in pieces (and resumed). The ETag is the md5 also listed as
+        content_hash in lesson summaries.
+        """
+        lesson = self.get_object()
+        body = (lesson.content or '').encode('utf-8')
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if_range = request.META.get('HTTP_IF_RANGE')
+
+        if request.META.get('HTTP_IF_NONE_MATCH') and etag_matches(request, etag):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        elif if_range and if_range != etag:
+            # the client's copy is outdated, start over with the full body
+            response = HttpResponse(body, content_type='text/plain; charset=utf-8')
+        else:
+            try:
+                byte_range = parse_byte_range(request.META.get('HTTP_RANGE'), len(body))
+            except ValueError:
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = f'bytes */{len(body)}'
+                return response
+            if byte_range is None:
+                response = HttpResponse(body, content_type='text/plain; charset=utf-8')
+            else:
+                start, end = byte_range
+                response = HttpResponse(
+                    body[start:end + 1],
+                    status=status.HTTP_206_PARTIAL_CONTENT,
+                    content_type='text/plain; charset=utf-8',
+                )
+                response['Content-Range'] = f'bytes {start}-{end}/{len(body)}'
+
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        return response
+
+class CourseTagViewSet(CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = CourseTag.objects.all()
     serializer_class = CourseTagSerializer
+    keyset_ordering = ('id',)
+    cache_dependencies = ('coursetag',)
+    use_read_replica = True
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -95,209 +367,570 @@ class RegisterView(generics.CreateAPIView):
     serializer_class = RegisterSerializer
 
 
+# login hashes the password on every attempt, keep bursts of it off the workers
+class LoginView(TokenObtainPairView):
+    throttle_classes = [throttling.LoginThrottle]
+
+
+# Educators register their students, staff anyone. Takes a JSON list (or {"users": [...]})
+# of RegisterSerializer rows, or a .csv/.jsonl `file`; answers with a result per row, or
+# for more than BULK_REGISTRATION_MAX_ROWS rows with a job to poll (see core/registration.py).
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([JSONParser, MultiPartParser, FormParser])
+@throttle_classes([throttling.BulkRegistrationThrottle])
+def bulk_register(request):
+    # claims tokens carry no is_staff, ask the database
+    is_staff = User.objects.filter(id=request.user.id, is_staff=True).exists()
+    if is_staff:
+        allowed_roles = ('student', 'educator')
+    elif request.user.educator_id:
+        allowed_roles = ('student',)
+    else:
+        return Response({'detail': 'Only educators can register users.'}, status=status.HTTP_403_FORBIDDEN)
+
+    upload = request.FILES.get('file')
+    if upload is not None:
+        try:
+            rows = registration.read_upload(upload)
+        except (UnicodeDecodeError, csv.Error) as e:
+            return Response({'detail': f'Could not read the file: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    elif isinstance(request.data, list):
+        rows = request.data
+    else:
+        rows = request.data.get('users')
+    if not isinstance(rows, list) or not rows:
+        return Response({'detail': 'Send a list of users or a .csv/.jsonl file.'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(rows) > settings.BULK_REGISTRATION_JOB_MAX_ROWS:
+        return Response(
+            {'detail': f'At most {settings.BULK_REGISTRATION_JOB_MAX_ROWS} users per upload, use manage.py import_users for more.'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(rows) > settings.BULK_REGISTRATION_MAX_ROWS:
+        # too much hashing for one request, a worker (manage.py run_registration_worker) does it
+        job = registration.enqueue_registration_job(rows, allowed_roles, user=request.user)
+        return Response(registration_job_payload(request, job), status=status.HTTP_202_ACCEPTED)
+
+    # a pool only pays off once there's more than a handful of hashes to share out
+    hasher = passwords.shared_pool() if len(rows) >= 20 else None
+    data = registration.summary(registration.register_users(rows, hasher=hasher, allowed_roles=allowed_roles))
+    return Response(data, status=status.HTTP_201_CREATED if data['created'] else status.HTTP_200_OK)
+
+
+def registration_job_payload(request, job):
+    payload = {
+        'job_id': str(job.id),
+        'status': job.status,
+        'status_url': request.build_absolute_uri(reverse('bulk-register-job', args=[job.id])),
+    }
+    if job.status == 'done':
+        payload.update(job.result)
+    elif job.status == 'failed':
+        payload['error'] = job.error
+    return payload
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def bulk_register_job(request, job_id):
+    # the results list every email of the upload, only for whoever sent it
+    job = RegistrationJob.objects.filter(id=job_id, requested_by_id=request.user.id).defer('rows').first()
+    if job is None:
+        return Response({'detail': 'Job not found.'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(registration_job_payload(request, job))
+
+
 class SubscribedCourseViewSet(viewsets.ModelViewSet):
     queryset = SubscribedCourse.objects.all()
     serializer_class = SubscribedCourseSerializer
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ('subscribed_at', 'id')
 
     # Subscribe to a course
     def perform_create(self, serializer):
-        if not hasattr(self.request.user, 'student'):
+        if not self.request.user.student_id:
             raise PermissionDenied('Only students can subscribe to courses.')
 
-        serializer.save(student=self.request.user.student)
+        serializer.save(student_id=self.request.user.student_id)
 
     # A student only sees list of their own subscriptions, not others
     def get_queryset(self):
-        if hasattr(self.request.user, 'student'):
-            return SubscribedCourse.objects.filter(student=self.request.user.student)
+        if self.request.user.student_id:
+            return SubscribedCourse.objects.filter(student_id=self.request.user.student_id)
         return SubscribedCourse.objects.none()
 
 # student can see his subscribed courses
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def my_courses(request):
-    if not hasattr(request.user, 'student'):
-        return Response({'detail': 'Only students can access this.'}, status=status.HTTP_403_FORBIDDEN)
-
-    subscriptions = SubscribedCourse.objects.filter(student=request.user.student)
-    courses = [subscription.course for subscription in subscriptions]
-
-    from .serializers import CourseSerializer
-    serializer = CourseSerializer(courses, many=True)
-
-    return Response(serializer.data, status=status.HTTP_200_OK)
+@read_replica
+@require_GET
+async def my_courses(request):
+    user, error = await async_user(request)
+    if error:
+        return error
+    if not user.student_id:
+        return api_response({'detail': 'Only students can access this.'}, status.HTTP_403_FORBIDDEN)
+
+    courses = course_queryset(
+        request,
+        Course.objects.filter(subscribers__student_id=user.student_id).order_by('subscribers__id'),
+    )
+    # async iteration runs the query and its prefetches in one go
+    courses = [course async for course in courses]
+
+    serializer = CourseSerializer(courses, many=True, context={'request': request})
+    return api_response(serializer.data)
 
 # subscribe to a course, but with another endpoint - with parameter
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def subscribe_course(request, course_id):
-    if not hasattr(request.user, 'student'):
+    if not request.user.student_id:
         return Response({'detail': 'Only students can subscribe to courses.'}, status=status.HTTP_403_FORBIDDEN)
 
-    try:
-        course = Course.objects.get(id=course_id)
-    except Course.DoesNotExist:
+    result = subscribe_student(request.user.student_id, [course_id])[course_id]
+
+    if result == NOT_FOUND:
         return Response({'detail': 'Course not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Check if already subscribed
-    if SubscribedCourse.objects.filter(student=request.user.student, course=course).exists():
+    if result == ALREADY_SUBSCRIBED:
         return Response({'detail': 'Already subscribed.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    SubscribedCourse.objects.create(student=request.user.student, course=course)
-
     return Response({'detail': 'Subscribed successfully.'}, status=status.HTTP_201_CREATED)
 
-# get lessons of a course
-@api_view(['GET'])
+
+class BatchSubscribeSerializer(serializers.Serializer):
+    course_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+
+# subscribe to several courses at once (onboarding), body: {"course_ids": [1, 2, 3]}
+@api_view(['POST'])
 @permission_classes([IsAuthenticated])
-def my_course_lessons(request, course_id):
-    if not hasattr(request.user, 'student'):
-        return Response({'detail': 'Only students can access lessons.'}, status=status.HTTP_403_FORBIDDEN)
+def subscribe_courses(request):
+    if not request.user.student_id:
+        return Response({'detail': 'Only students can subscribe to courses.'}, status=status.HTTP_403_FORBIDDEN)
 
-    try:
-        course = Course.objects.get(id=course_id)
-    except Course.DoesNotExist:
-        return Response({'detail': 'Course not found.'}, status=status.HTTP_404_NOT_FOUND)
+    serializer = BatchSubscribeSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
 
-    # Check if the student is subscribed to the course
-    if not SubscribedCourse.objects.filter(student=request.user.student, course=course).exists():
-        return Response({'detail': 'You are not subscribed to this course.'}, status=status.HTTP_403_FORBIDDEN)
+    results = subscribe_student(request.user.student_id, serializer.validated_data['course_ids'])
 
-    # Get lessons of the course
-    lessons = course.lessons.all().order_by('lesson_number')  # Order lessons
-    from .serializers import LessonSerializer
-    serializer = LessonSerializer(lessons, many=True)
+    data = {SUBSCRIBED: [], ALREADY_SUBSCRIBED: [], NOT_FOUND: []}
+    for course_id, result in results.items():
+        data[result].append(course_id)
 
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    response_status = status.HTTP_201_CREATED if data[SUBSCRIBED] else status.HTTP_200_OK
+    return Response(data, status=response_status)
 
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def user_profile(request):
-    user = request.user
-    full_name = ''
+# get lessons of a course
+@require_GET
+async def my_course_lessons(request, course_id):
+    user, error = await async_user(request)
+    if error:
+        return error
+    if not user.student_id:
+        return api_response({'detail': 'Only students can access lessons.'}, status.HTTP_403_FORBIDDEN)
 
-    try:
-        if user.role == 'student':
-            student = Student.objects.get(user=user)
-            full_name = student.full_name
-        elif user.role == 'educator':
-            full_name = "Educator"  # Later you can adjust if educator has profile info
-    except Student.DoesNotExist:
-        full_name = user.email  # fallback if not found
+    if not await Course.objects.filter(id=course_id).aexists():
+        return api_response({'detail': 'Course not found.'}, status.HTTP_404_NOT_FOUND)
 
-    return Response({
+    # Check if the student is subscribed to the course
+    if not await SubscribedCourse.objects.filter(student_id=user.student_id, course_id=course_id).aexists():
+        return api_response({'detail': 'You are not subscribed to this course.'}, status.HTTP_403_FORBIDDEN)
+
+    # Get lessons of the course - summaries unless ?expand=content
+    lessons = Lesson.objects.filter(course_id=course_id).order_by('lesson_number')  # Order lessons
+    if wants_lesson_content(request):
+        serializer_class = LessonSerializer
+    else:
+        serializer_class, lessons = LessonSummarySerializer, lesson_summaries(lessons)
+    lessons = [lesson async for lesson in lessons]
+
+    return api_response(serializer_class(lessons, many=True).data)
+
+@require_GET
+async def user_profile(request):
+    user, error = await async_user(request)
+    if error:
+        return error
+    return api_response(profile_payload(user))
+
+
+def profile_payload(user):
+    # everything comes from the token claims, see core/authentication.py
+    return {
         'id': user.id,
         'email': user.email,
-        'name': full_name,
+        'name': user.name,
         'role': user.role,
-    })
+    }
 
 # --------------------- AI: Personalized Course Recommendation -------------------------------
 
+@read_replica
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def recommended_courses(request):
-    if not hasattr(request.user, 'student'):
+    if not request.user.student_id:
         return Response({'detail': 'Only students can access recommendations.'}, status=status.HTTP_403_FORBIDDEN)
 
     # Get student's subscribed courses
-    subscriptions = SubscribedCourse.objects.filter(student=request.user.student)
-    subscribed_courses = [sub.course for sub in subscriptions]
+    subscribed_course_ids = list(
+        SubscribedCourse.objects.filter(student_id=request.user.student_id).values_list('course_id', flat=True)
+    )
 
-    if not subscribed_courses:
+    if not subscribed_course_ids:
         return Response({'detail': 'No subscriptions found. Subscribe to courses first!'}, status=status.HTTP_404_NOT_FOUND)
 
-    subscribed_course_ids = [course.id for course in subscribed_courses]
-    recommended_courses_set = set()
+    # Same category + most shared tags first, topped up with popular courses.
+    # Scoring happens in the in-memory index, so this doesn't grow with the number of subscriptions
+    recommended_ids = get_recommendation_index().recommend(subscribed_course_ids, limit=5)
+
+    courses = course_queryset(request, Course.objects.filter(id__in=recommended_ids))
+    courses_by_id = {course.id: course for course in courses}
+    recommended_courses_list = [courses_by_id[course_id] for course_id in recommended_ids if course_id in courses_by_id]
+
+    from .serializers import CourseSerializer
+    serializer = CourseSerializer(recommended_courses_list, many=True, context={'request': request})
+
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+# ----------------------------------------------------------------------------
 
-    for course in subscribed_courses:
-        # Find other courses with the same category
-        similar_courses = Course.objects.filter(category=course.category).exclude(id__in=subscribed_course_ids)
+# --------------------- Student dashboard -------------------------------
+
+def dashboard_courses(student_id):
+    """Subscribed courses (oldest subscription first) with progress and the lesson to open next, in one query."""
+    completed = LessonProgress.objects.filter(student_id=student_id, completed_at__isnull=False)
+    # the first lesson the student hasn't completed yet
+    first_lesson = (
+        Lesson.objects.filter(course_id=OuterRef('course_id'))
+        .exclude(Exists(completed.filter(lesson_id=OuterRef('pk'))))
+        .order_by('lesson_number', 'id')
+    )
+    completed_count = (
+        completed.filter(course_id=OuterRef('course_id'))
+        .order_by().values('course_id').annotate(total=Count('id')).values('total')
+    )
+    subscriptions = (
+        SubscribedCourse.objects.filter(student_id=student_id)
+        .select_related('course').defer('course__description')
+        .annotate(
+            next_lesson_id=Subquery(first_lesson.values('id')[:1]),
+            next_lesson_title=Subquery(first_lesson.values('title')[:1]),
+            next_lesson_number=Subquery(first_lesson.values('lesson_number')[:1]),
+            completed_lessons=Coalesce(Subquery(completed_count, output_field=IntegerField()), 0),
+        )
+        .order_by('id')
+    )
+    courses = []
+    for subscription in subscriptions:
+        course = subscription.course
+        course.subscribed_at = subscription.subscribed_at
+        course.completed_lessons = subscription.completed_lessons
+        course.next_lesson = None
+        if subscription.next_lesson_id is not None:
+            course.next_lesson = {
+                'id': subscription.next_lesson_id,
+                'title': subscription.next_lesson_title,
+                'lesson_number': subscription.next_lesson_number,
+            }
+        courses.append(course)
+    return courses
+
+
+def dashboard_recommendations(student_id, limit=5):
+    # no subscriptions yet -> the index falls back to popular courses
+    subscribed_ids = list(SubscribedCourse.objects.filter(student_id=student_id).values_list('course_id', flat=True))
+    recommended_ids = get_recommendation_index().recommend(subscribed_ids, limit=limit)
+    courses = Course.objects.defer('description').in_bulk(recommended_ids)
+    return [courses[course_id] for course_id in recommended_ids if course_id in courses]
+
+
+# everything the student home screen needs in one response: 3 queries, the
+# subscriptions and the recommendations can be loaded side by side (see core/parallel.py)
+@read_replica
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def dashboard(request):
+    student_id = request.user.student_id
+    if not student_id:
+        return Response({'detail': 'Only students have a dashboard.'}, status=status.HTTP_403_FORBIDDEN)
+
+    courses, recommendations = run_parallel(
+        partial(dashboard_courses, student_id),
+        partial(dashboard_recommendations, student_id),
+    )
+    context = {'request': request}
+    return Response({
+        'profile': profile_payload(request.user),
+        'courses': SubscribedCourseCardSerializer(courses, many=True, context=context).data,
+        'recommendations': CourseCardSerializer(recommendations, many=True, context=context).data,
+    })
 
-        # Filter by tag similarity
-        course_tags = set(tag.name for tag in course.tags.all())
-        course_scores = []
+# --------------------- Lesson progress -------------------------------
 
-        for candidate in similar_courses:
-            candidate_tags = set(tag.name for tag in candidate.tags.all())
-            common_tags = course_tags.intersection(candidate_tags)
-            score = len(common_tags)
-            course_scores.append((candidate, score))
+class ProgressEventSerializer(serializers.Serializer):
+    lesson_id = serializers.IntegerField(min_value=1)
+    percent = serializers.IntegerField(min_value=0, max_value=100, default=0)
+    completed = serializers.BooleanField(default=False)
 
-        # Sort by number of common tags (higher = better)
-        course_scores.sort(key=lambda x: x[1], reverse=True)
 
-        # Take top 3-4 best matches (you can tweak number)
-        top_matches = [course_score[0] for course_score in course_scores[:4]]
+class ProgressBatchSerializer(serializers.Serializer):
+    events = serializers.ListField(child=ProgressEventSerializer(), allow_empty=False, max_length=200)
 
-        recommended_courses_set.update(top_matches)
 
-    recommended_courses_list = list(recommended_courses_set)
+# body: {"events": [{"lesson_id": 1, "percent": 40}, {"lesson_id": 2, "completed": true}]}
+# events are buffered and written in batches (core/progress.py), hence 202
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def record_progress(request):
+    student_id = request.user.student_id
+    if not student_id:
+        return Response({'detail': 'Only students can record progress.'}, status=status.HTTP_403_FORBIDDEN)
+
+    serializer = ProgressBatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    events = serializer.validated_data['events']
+
+    # only lessons of courses the student is subscribed to
+    course_ids = dict(
+        Lesson.objects.filter(
+            id__in={event['lesson_id'] for event in events},
+            course__subscribers__student_id=student_id,
+        ).values_list('id', 'course_id')
+    )
+    accepted = [
+        (event['lesson_id'], course_ids[event['lesson_id']], event['percent'], event['completed'])
+        for event in events if event['lesson_id'] in course_ids
+    ]
+    progress_buffer.add(student_id, accepted)
 
-    # If not enough, add same-category random courses
-    if len(recommended_courses_list) < 5:
-        additional_courses = Course.objects.exclude(id__in=subscribed_course_ids + [c.id for c in recommended_courses_list]).order_by('?')[:(5 - len(recommended_courses_list))]
-        recommended_courses_list += list(additional_courses)
+    return Response({
+        'accepted': len(accepted),
+        'rejected': sorted({event['lesson_id'] for event in events} - course_ids.keys()),
+    }, status=status.HTTP_202_ACCEPTED)
 
-    # Limit to 5 or more if you want
-    recommended_courses_list = recommended_courses_list[:5]
 
-    from .serializers import CourseSerializer
-    serializer = CourseSerializer(recommended_courses_list, many=True)
+# completion of one subscribed course; reads the student's progress rows of that course only
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def course_progress(request, course_id):
+    student_id = request.user.student_id
+    if not student_id:
+        return Response({'detail': 'Only students have progress.'}, status=status.HTTP_403_FORBIDDEN)
+
+    course = (
+        Course.objects.filter(id=course_id)
+        .annotate(subscribed=Exists(SubscribedCourse.objects.filter(student_id=student_id, course_id=OuterRef('pk'))))
+        .values('lesson_count', 'subscribed')
+        .first()
+    )
+    if course is None:
+        return Response({'detail': 'Course not found.'}, status=status.HTTP_404_NOT_FOUND)
+    if not course['subscribed']:
+        return Response({'detail': 'You are not subscribed to this course.'}, status=status.HTTP_403_FORBIDDEN)
 
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    # read your own events - those buffered in this process; another worker's
+    # buffer is written within PROGRESS_FLUSH_SECONDS (see core/progress.py)
+    if progress_buffer.has_pending(student_id):
+        progress_buffer.flush()
+
+    lessons = list(
+        LessonProgress.objects.filter(student_id=student_id, course_id=course_id)
+        .order_by('lesson_id')
+        .values('lesson_id', 'percent', 'opened_at', 'completed_at')
+    )
+    completed = sum(1 for lesson in lessons if lesson['completed_at'] is not None)
+    lesson_count = course['lesson_count']
+    return Response({
+        'course_id': course_id,
+        'lesson_count': lesson_count,
+        'completed_lessons': completed,
+        'percent_complete': round(100 * completed / lesson_count) if lesson_count else 0,
+        'lessons': lessons,
+    })
 
 # ----------------------------------------------------------------------------
 
 # --------------------- AI: Questions and MCQs Generation -------------------------------
 
-# Load API key from env
-genai.configure(api_key=config("GEMINI_API_KEY"))
+@csrf_exempt
+@require_POST
+async def generate_questions(request):
+    user, error = await async_user(request, required=False)
+    if error:
+        return error
+    # model calls cost money, see core/throttling.py
+    wait = await sync_to_async(throttling.check)("generate_questions", request, user)
+    if wait is not None:
+        return throttled(wait)
+    try:
+        data = request_data(request)
+    except ValueError as e:
+        return api_response({"detail": f"JSON parse error - {e}"}, status.HTTP_400_BAD_REQUEST)
 
-@api_view(["POST"])
-def generate_questions(request):
-    lesson_content = request.data.get("lesson_content")
+    lesson_content = data.get("lesson_content")
 
     if not lesson_content:
-        return Response({"error": "Lesson content is required."}, status=status.HTTP_400_BAD_REQUEST)
+        return api_response({"error": "Lesson content is required."}, status.HTTP_400_BAD_REQUEST)
 
     try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-
-        prompt = (
-            "Generate 3 open-ended answer questions with answers (2-4 sentences) and 3 multiple choice questions with 4 options each and the correct option, "
-            "based on the following lesson content:\n\n"
-            f"{lesson_content}\n\n"
-            "Return the response in JSON format like:\n"
-            "{\n"
-            "  \"questions\": [\n"
-            "    { \"question\": \"Q1...\", \"answer\": \"...\" },\n"
-            "    ...\n"
-            "  ],\n"
-            "  \"mcqs\": [\n"
-            "    {\n"
-            "      \"question\": \"What is...\",\n"
-            "      \"options\": [\"A\", \"B\", \"C\", \"D\"],\n"
-            "      \"answer\": \"B\"\n"
-            "    },\n"
-            "    ...\n"
-            "  ]\n"
-            "}"
-        )
-
-        response = model.generate_content(prompt)
-        raw_text = response.text
+        wait = min(float(request.GET.get("wait", 0)), settings.QUESTION_WAIT_MAX_SECONDS)
+    except ValueError:
+        wait = 0
+
+    if wait > 0:
+        # ?wait=<seconds>: await the model right here. A call that takes longer is
+        # cancelled; it, and a network/overload error, falls back to a job that a
+        # worker finishes. Anything else (no API key, rejected key, an answer that
+        # doesn't parse) would fail the job too, so it's a 500 here
+        try:
+            result = await asyncio.wait_for(agenerate_questions_for(lesson_content), wait)
+        except Exception as e:
+            if not is_transient(e):
+                raise
+        else:
+            return api_response(result)
+    else:
+        # answered before (cached by content hash, see core/ai.py)
+        cached = await sync_to_async(get_cached_questions)(content_hash(lesson_content))
+        if cached is not None:
+            return api_response(cached)
+
+    # otherwise a worker (manage.py run_question_worker) makes the model call, poll the job for the result
+    job = await sync_to_async(enqueue_question_job)(lesson_content, user=user)
+
+    return api_response(question_job_payload(request, job), status.HTTP_202_ACCEPTED)
+
+
+# questions for every lesson of a course: lessons are read and chunked server-side by the
+# worker (core/course_questions.py); answered right away when nothing changed since last time
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+@throttle_classes([throttling.CourseQuestionsThrottle])
+def generate_course_questions(request, course_id):
+    if not Course.objects.filter(id=course_id).exists():
+        return Response({"detail": "Course not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    stored = stored_course_questions(course_id)
+    if stored is not None:
+        return Response(stored)
+
+    job = enqueue_course_question_job(course_id, user=request.user)
+    return Response(question_job_payload(request, job), status=status.HTTP_202_ACCEPTED)
+
+
+def question_job_payload(request, job):
+    payload = {
+        "job_id": str(job.id),
+        "status": job.status,
+        "status_url": request.build_absolute_uri(reverse("generate-questions-job", args=[job.id])),
+    }
+    if job.status == "done":
+        payload["result"] = job.result
+    elif job.status == "failed":
+        payload["error"] = job.error
+    return payload
+
+
+@api_view(["GET"])
+def generate_questions_job(request, job_id):
+    # lesson jobs hold the requester's own content, only they see them (anonymous jobs: whoever
+    # has the id). A course job is shared by everyone who asked for that course, and its result
+    # is what POSTing to the course gives any signed-in user anyway
+    visible = Q(requested_by_id=request.user.id)
+    if request.user.is_authenticated:
+        visible |= Q(course__isnull=False)
+    job = QuestionGenerationJob.objects.filter(visible, id=job_id).first()
+    if job is None:
+        return Response({"detail": "Job not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(question_job_payload(request, job))
 
-        # Extract JSON using regex if it's wrapped in code block
-        json_match = re.search(r"```json\s*(.*?)\s*```", raw_text, re.DOTALL)
-        json_data = json_match.group(1) if json_match else raw_text
+# ----------------------------------------------------------------------------
 
-        parsed = json.loads(json_data)
+# --------------------- Search -------------------------------
 
-        return Response(parsed)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def search_catalog(request):
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'detail': 'Query parameter q is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    except Exception as e:
-        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    doc_type = request.query_params.get('type')
+    if doc_type not in (None, 'course', 'lesson'):
+        return Response({'detail': 'type must be course or lesson.'}, status=status.HTTP_400_BAD_REQUEST)
 
-# ----------------------------------------------------------------------------
\ No newline at end of file
+    try:
+        limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+    except ValueError:
+        limit = 20
+
+    return Response({'query': query, 'results': search.search(query, doc_type=doc_type, limit=limit)})
+
+# --------------------- Roster export -------------------------------
+
+# everyone subscribed to the educator's courses (or ?course=<id>), streamed as ?output=csv|jsonl -
+# not ?format=, which DRF keeps for its renderers. See core/roster.py.
+@read_replica
+@require_GET
+async def roster_export(request):
+    user, error = await async_user(request)
+    if error:
+        return error
+    if not user.educator_id:
+        return api_response({'detail': 'Only educators can export rosters.'}, status.HTTP_403_FORBIDDEN)
+
+    output = request.GET.get('output', 'csv')
+    if output not in roster.CONTENT_TYPES:
+        return api_response({'detail': 'output must be csv or jsonl.'}, status.HTTP_400_BAD_REQUEST)
+    course_id = request.GET.get('course')
+    if course_id is not None and not course_id.isdigit():
+        return api_response({'detail': 'course must be a course id.'}, status.HTTP_400_BAD_REQUEST)
+
+    # the rows are read after this view has returned, outside the replica routing it runs in
+    using = db_router.db_for_read(SubscribedCourse)
+    courses = [
+        course async for course in roster.roster_courses(user.educator_id, course_id and int(course_id), using=using)
+    ]
+    if course_id is not None and not courses:
+        return api_response({'detail': 'Course not found.'}, status.HTTP_404_NOT_FOUND)
+
+    if isinstance(request, ASGIRequest):
+        lines = roster.aexport_lines(courses, output, using=using)
+    else:
+        lines = roster.export_lines(courses, output, using=using)
+    response = StreamingHttpResponse(lines, content_type=roster.CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="roster.{output}"'
+    response['Cache-Control'] = 'no-store'
+    return response
+
+# --------------------- Course image derivatives -------------------------------
+
+# resized course images have content-hash names (see core/images.py), so they never change and can be cached forever.
+# Development only (DEBUG): in production the web server serves MEDIA_ROOT/img_courses/derived/ itself
+def course_image_derivative(request, path):
+    response = serve(request, images.DERIVED_DIR + path, document_root=settings.MEDIA_ROOT)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+# --------------------- Metrics -------------------------------
+
+def metrics_view(request):
+    """
+    Prometheus text format for this process, see core/metrics.py. Needs the
+    METRICS_TOKEN as a bearer token; without one configured it is only open
+    with DEBUG on.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token:
+        if not settings.DEBUG:
+            raise Http404
+    elif not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,63 @@
+"""
+Work a fresh worker does before it takes traffic, run from the ASGI lifespan
+startup (see edulearn_backend/asgi.py):
+  - connects to every database alias, so a worker that can't reach one fails
+    its startup instead of its first requests (and DNS/TLS/auth is paid here),
+  - fills the per-process caches the first requests would otherwise build:
+    catalog cache versions, the recommendation index, search stats, the AI
+    backend.
+On shutdown, buffered lesson progress is written and the connections closed.
+
+Django gives each ASGI request its own connections, so the ones opened here
+only prove the database is there; they are closed again afterwards.
+"""
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+from .ai import get_backend
+from .cache import get_versions
+from .progress import progress_buffer
+from .recommendations import get_recommendation_index
+from . import search
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSIONS = ('course', 'lesson', 'coursetag')
+
+
+def warm_up():
+    started = time.perf_counter()
+    for alias in connections:
+        connections[alias].ensure_connection()
+    get_versions(CATALOG_VERSIONS)
+    get_recommendation_index()
+    search.get_stats()
+    get_backend()
+    connections.close_all()
+    logger.info('worker warmed up in %.0fms', (time.perf_counter() - started) * 1000)
+
+
+def shut_down():
+    progress_buffer.flush()
+    connections.close_all()
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan protocol: warm_up() on startup, shut_down() on shutdown."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await sync_to_async(warm_up)()
+            except Exception as e:
+                logger.exception('warmup failed')
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await sync_to_async(shut_down)()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'edulearn_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# after setup, it imports models
+from core.warmup import lifespan  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # lifespan events (uvicorn sends them, --lifespan on) warm the worker up, see core/warmup.py
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -12,13 +12,15 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 from datetime import timedelta
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# widths of the resized course images (WebP + JPEG each), see core/images.py
+COURSE_IMAGE_WIDTHS = (320, 640, 1280)
 
 AUTH_USER_MODEL = 'core.User'
 
@@ -28,8 +30,79 @@ AUTH_USER_MODEL = 'core.User'
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = config('DJANGO_SECRET_KEY')
 
-# GEMINI API KEY
-GEMINI_API_KEY = config("GEMINI_API_KEY")
+# GEMINI API KEY - only needed by the processes that actually call Gemini (see core/ai.py)
+GEMINI_API_KEY = config("GEMINI_API_KEY", default='')
+
+# generate-questions backend: core.ai.GeminiBackend, or core.ai.StubBackend to work offline
+QUESTION_GENERATION_BACKEND = config('QUESTION_GENERATION_BACKEND', default='core.ai.GeminiBackend')
+# generated questions are cached by content hash; entries expire after the TTL
+# and the least recently used ones are dropped past MAX_ENTRIES by the question worker
+QUESTION_CACHE_TTL = timedelta(days=30)
+QUESTION_CACHE_MAX_ENTRIES = 50000
+# generate-questions requests are queued and run by `manage.py run_question_worker`
+QUESTION_WORKER_CONCURRENCY = config('QUESTION_WORKER_CONCURRENCY', default=4, cast=int)
+QUESTION_JOB_MAX_ATTEMPTS = 3
+QUESTION_JOB_TIMEOUT = timedelta(minutes=5)  # running longer than this = worker died, requeue
+# course jobs refresh started_at after every chunk; this is how long one chunk may go quiet
+QUESTION_COURSE_JOB_TIMEOUT = timedelta(minutes=20)
+# POST /api/generate-questions/?wait=<seconds> answers inline for up to this long
+# (cheap under ASGI, the request only holds a coroutine); a slower model call is
+# cancelled and the request falls back to a job
+QUESTION_WAIT_MAX_SECONDS = config('QUESTION_WAIT_MAX_SECONDS', default=30, cast=int)
+QUESTION_GENERATION_TIMEOUT = 60  # seconds, for the model's HTTP API
+# whole-course generation (POST /api/courses/<id>/generate-questions/, core/course_questions.py):
+# lessons are split into chunks of at most this many (estimated) tokens per prompt,
+# and each course job makes up to QUESTION_COURSE_CONCURRENCY model calls at once (all jobs
+# together: THROTTLES['question_model_calls']),
+# retrying a failed call QUESTION_CALL_RETRIES times (backoff doubles from 1s)
+QUESTION_CHUNK_TOKENS = config('QUESTION_CHUNK_TOKENS', default=2000, cast=int)
+QUESTION_COURSE_CONCURRENCY = config('QUESTION_COURSE_CONCURRENCY', default=4, cast=int)
+QUESTION_CALL_RETRIES = 2
+QUESTION_RETRY_BACKOFF = 1.0
+
+# token-bucket throttles for the expensive endpoints (core/throttling.py): scope -> buckets
+# a request has to pass. `rate` refills a bucket, `burst` is its size; `by` is 'ip',
+# 'user' (per user, per IP when anonymous) or 'global' (one bucket for all clients).
+# Kept in THROTTLE_CACHE_ALIAS - set CACHE_URL so the workers share them.
+THROTTLE_CACHE_ALIAS = 'default'
+THROTTLES = {
+    'login': [
+        {'by': 'ip', 'rate': '10/min', 'burst': 10},
+        # password hashing is CPU bound, cap it for everyone together too
+        {'by': 'global', 'rate': '20/s', 'burst': 40},
+    ],
+    'generate_questions': [
+        {'by': 'user', 'rate': '30/h', 'burst': 10},
+        {'by': 'global', 'rate': '5/s', 'burst': 20},
+    ],
+    'generate_course_questions': [
+        {'by': 'user', 'rate': '5/h', 'burst': 2},
+    ],
+    # every upload hashes up to BULK_REGISTRATION_MAX_ROWS passwords in the request
+    'bulk_register': [
+        {'by': 'user', 'rate': '10/h', 'burst': 5},
+        {'by': 'global', 'rate': '1/s', 'burst': 5},
+    ],
+    # model calls of course jobs, taken in the question worker (core/course_questions.py):
+    # QUESTION_COURSE_CONCURRENCY caps one job, this caps all workers together
+    'question_model_calls': [
+        {'by': 'global', 'rate': '5/s', 'burst': 10},
+    ],
+}
+
+# bulk registration (core/registration.py): passwords are hashed on this many processes
+# (0 = in the request's own process; one long-lived pool per web worker), a request
+# registers at most BULK_REGISTRATION_MAX_ROWS users itself, bigger uploads up to
+# BULK_REGISTRATION_JOB_MAX_ROWS are queued for `manage.py run_registration_worker`
+PASSWORD_HASH_WORKERS = config("PASSWORD_HASH_WORKERS", default=2, cast=int)
+BULK_REGISTRATION_MAX_ROWS = 50
+BULK_REGISTRATION_JOB_MAX_ROWS = 5000
+REGISTRATION_JOB_TIMEOUT = timedelta(hours=1)  # running longer than this = worker died, fail the job
+# queued uploads hold plaintext passwords; not picked up by then = failed and wiped
+REGISTRATION_JOB_PENDING_TTL = timedelta(hours=1)
+
+# rows per query when streaming a roster export (core/roster.py)
+ROSTER_EXPORT_BATCH_SIZE = 2000
 
 
 # SECURITY WARNING: don't run with debug turned on in production!
@@ -53,12 +126,18 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     # mac added
     'rest_framework',
+    # rotated refresh tokens are blacklisted (SIMPLE_JWT['BLACKLIST_AFTER_ROTATION'])
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     'core',
 ]
 
 MIDDLEWARE = [
+    # first, so its total covers everything below (see core/metrics.py)
+    'core.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware', # mac added
+    # compresses large JSON/text bodies, keep it above anything that touches the response body
+    'core.middleware.CompressionMiddleware',
 
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -67,6 +146,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'edulearn_backend.urls'
@@ -93,6 +173,10 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=3),        #  3 days refresh
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    # puts role/name/student_id/educator_id in the tokens, see core/authentication.py
+    'TOKEN_OBTAIN_SERIALIZER': 'core.authentication.EduLearnTokenObtainPairSerializer',
+    # ...and reloads them on refresh, so they don't go stale for the whole session
+    'TOKEN_REFRESH_SERIALIZER': 'core.authentication.EduLearnTokenRefreshSerializer',
 }
 
 # Database
@@ -115,6 +199,45 @@ DATABASES = {
     }
 }
 
+# Read replicas (see core/routers.py)
+# comma separated hosts replicating `default`; each becomes a "replica_<n>" alias
+# with the same credentials. To try it locally with SQLite any value works - the
+# alias then just opens the same file.
+DATABASE_REPLICA_HOSTS = config('DATABASE_REPLICA_HOSTS', default='', cast=Csv())
+for number, host in enumerate(DATABASE_REPLICA_HOSTS, start=1):
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        # tests run against default only
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+# how long a client that just wrote something keeps reading from default
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=10, cast=int)
+
+# Cache
+# local memory by default; point CACHE_URL at Redis (redis://host:6379/0) to
+# share cached data, e.g. the catalog cache versions, between workers
+CACHE_URL = config('CACHE_URL', default='')
+
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# anonymous catalog reads (courses, lessons, tags), see core/cache.py
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -143,9 +266,22 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.ClaimsJWTAuthentication',
     ),
+    # every list endpoint pages on an indexed key, see core/pagination.py
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
+    # proxies in front of Django that append to X-Forwarded-For; the client IP (throttling
+    # buckets, see core/throttling.py) is taken from there only when this is > 0, else REMOTE_ADDR
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
+    # JSON rendering counted as "serialize" in Server-Timing
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
+# upper bound for ?page_size=
+PAGINATION_MAX_PAGE_SIZE = 100
 # ---+
 
 
@@ -171,3 +307,36 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Recommendations
+# the in-memory tag index is patched by signals in this process and fully
+# rebuilt after this many seconds so writes made by other workers show up too
+RECOMMENDATION_INDEX_TTL = 300
+
+# Search
+# how many postings per query term are scored (best BM25 weights first)
+SEARCH_POSTINGS_PER_TERM = 1000
+
+# Metrics (core/metrics.py)
+# Server-Timing header on every response; turn off to keep timings away from clients
+METRICS_SERVER_TIMING = config('METRICS_SERVER_TIMING', default=True, cast=bool)
+# /metrics needs "Authorization: Bearer <token>"; left empty, /metrics is a 404 unless DEBUG is on
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+# requests slower than this are logged (core.slow_requests) with their slowest SQL, 0 = off
+SLOW_REQUEST_MS = config('SLOW_REQUEST_MS', default=1000, cast=int)
+
+# Dashboard
+# threads used to load the independent parts of /api/dashboard/ side by side (1 = one after another);
+# only used with persistent connections (CONN_MAX_AGE), and only worth it if
+# `manage.py bench --endpoint dashboard` says so, see core/parallel.py
+DASHBOARD_CONCURRENCY = config('DASHBOARD_CONCURRENCY', default=1, cast=int)
+
+# Lesson progress (core/progress.py)
+# events are merged in memory and written in one batch at this many rows...
+PROGRESS_BUFFER_SIZE = config('PROGRESS_BUFFER_SIZE', default=500, cast=int)
+# ...or when the oldest one is this many seconds old
+PROGRESS_FLUSH_SECONDS = config('PROGRESS_FLUSH_SECONDS', default=5, cast=int)
+# a batch that can't be written is kept for this many more flushes, then dropped;
+# while the database is unreachable at most PROGRESS_BUFFER_MAX rows are kept
+PROGRESS_FLUSH_RETRIES = 5
+PROGRESS_BUFFER_MAX = PROGRESS_BUFFER_SIZE * 10
@@ -15,11 +15,24 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from core.images import DERIVED_DIR
+from core.views import course_image_derivative, metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('core.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
+if settings.DEBUG:
+    # media from Django in development only; in production the web server serves MEDIA_ROOT,
+    # with far-future cache headers on the resized course images (see core/images.py)
+    urlpatterns += [
+        path(f'{settings.MEDIA_URL.lstrip("/")}{DERIVED_DIR}<path:path>', course_image_derivative, name='course-image-derivative'),
+    ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+